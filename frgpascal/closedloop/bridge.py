@@ -4,11 +4,13 @@ import numpy as np
 import os
 import time
 import json
+from threading import RLock
 from abc import ABC, abstractmethod
-import ntplib
 from frgpascal.experimentaldesign.tasks import Sample
 from frgpascal.closedloop.websocket import Client
+from frgpascal.hardware.timesync import get_clock
 from frgpascal import system
+from frgpascal.insertion import InsertionScheduler
 
 from typing import Any, Dict, NamedTuple, Union, Iterable, Set
 
@@ -18,12 +20,7 @@ from ax.core.base_trial import BaseTrial, TrialStatus
 from frgpascal.analysis.processing import load_sample
 from frgpascal.analysis import brightfield
 from frgpascal.experimentaldesign.tasks import Rest, Anneal
-from frgpascal.workers import Worker_Hotplate
-
-WORKERS = system.generate_workers()
-HOTPLATE_NAMES = [
-    name for name, worker in WORKERS.items() if isinstance(worker, Worker_Hotplate)
-]
+from frgpascal.closedloop.proposals import ProposalBuffer
 
 
 class NumpyFloatValuesEncoder(json.JSONEncoder):
@@ -59,7 +56,7 @@ class PASCALAxQueue(Client):
         # self.websocket = Client()
         self.experiment_folder = None
         self.t0 = None
-        self.__calibrate_time_to_nist()
+        self.clock = get_clock()
         self.initialize_experiment()
         # self._samplechecker = (
         #     brightfield.SampleChecker()
@@ -68,6 +65,9 @@ class PASCALAxQueue(Client):
             30  # time allotted (seconds) to determine task schedule
         )
         self.BUFFER_TIME = 10  # grace period (seconds) between schedule solution discovery and actual execution time
+        self.INCREMENTAL_SCHEDULING = True  # insert new samples around the existing schedule instead of re-solving it. Falls back to the full solver if insertion fails
+        self.proposals = None  # ProposalBuffer, see `start_proposals`
+        self._lock = RLock()  # sample building + scheduling happen on the proposal thread too
 
     @property
     def experiment_time(self) -> float:
@@ -81,15 +81,22 @@ class PASCALAxQueue(Client):
     @property
     def min_allowable_time(self) -> float:
         """earliest experiment_time (seconds) at which a new task can be scheduled"""
+        if self.INCREMENTAL_SCHEDULING:
+            return self.experiment_time + self.BUFFER_TIME  # insertion is near instant
         return self.experiment_time + self.SCHEDULE_SOLVE_TIME + self.BUFFER_TIME
 
     @property
     def nist_time(self) -> float:
-        return time.time() + self.__local_nist_offset
+        return self.clock.nist_time()
 
     def initialize_experiment(self):
         self.system = system.build()
-        self.sample_counter = 0
+        self.insertion = InsertionScheduler(self.system)
+        self.sample_counter = 0  # number of the sample being built, used in its name
+        self._next_sample_number = 0
+        self._free_sample_numbers = []  # numbers of discarded samples, reused so names stay contiguous
+        self._sample_numbers = {}  # {sample name: number}
+        self.abandoned_trials = set()  # indices of proposed trials that were discarded before being run
         self.first_sample_sent = False
         self.t0 = None
         self.jobs = {}
@@ -117,8 +124,9 @@ class PASCALAxQueue(Client):
                     f"Maximum hotplate temperature allowed is 200°C: currently requesting {max(unique_temperatures)}°C"
                 )
         self.HOTPLATE_ASSIGNMENTS = {}
-        for t, hp in zip(unique_temperatures, HOTPLATE_NAMES):
-            self.HOTPLATE_ASSIGNMENTS[t] = WORKERS[
+        workers = system.get_planning_workers()
+        for t, hp in zip(unique_temperatures, system.get_hotplate_names()):
+            self.HOTPLATE_ASSIGNMENTS[t] = workers[
                 hp
             ]  # hotplate worker dedicated to each temperature
             msg = {
@@ -152,16 +160,6 @@ class PASCALAxQueue(Client):
         pass
 
     ### PASCAL Methods
-    def __calibrate_time_to_nist(self):
-        client = ntplib.NTPClient()
-        response = None
-        while response is None:
-            try:
-                response = client.request("europe.pool.ntp.org", version=3)
-            except:
-                pass
-        self.__local_nist_offset = response.tx_time - time.time()
-
     def _process_message(self, message: str):
         options = {
             "sample_complete": self._mark_sample_completed,
@@ -178,20 +176,38 @@ class PASCALAxQueue(Client):
         msg = {"type": "set_start_time", "nist_time": self.t0}
         self.send(json.dumps(msg))
 
-    def _send_sample_to_maestro(
-        self, sample: Sample, parameters: dict, min_start: int = None
-    ):
-        """Send a new sample to the maestro workers"""
-        if not self.first_sample_sent:
-            self.set_start_time()
-            self.first_sample_sent = True
+    def _build_sample(self, parameters) -> Sample:
+        with self._lock:
+            if len(self._free_sample_numbers) > 0:
+                self.sample_counter = self._free_sample_numbers.pop(0)
+            else:
+                self.sample_counter = self._next_sample_number
+                self._next_sample_number += 1
+            sample = self.build_sample(parameters)
+            self._sample_numbers[sample.name] = self.sample_counter
+        return sample
+
+    def _discard_sample(self, sample: Sample):
+        """Undo everything `_build_sample` reserved for a sample that will never be sent"""
+        with self._lock:
+            self._withdraw_protocol(sample)
+            self.release_sample(sample)
+            self._free_sample_numbers.append(self._sample_numbers.pop(sample.name))
+            self._free_sample_numbers.sort()
 
-        if min_start is None:
-            min_start = self.min_allowable_time
-        min_start = max([min_start, self.min_allowable_time])
+    @abstractmethod
+    def release_sample(self, sample: Sample):
+        """Free the labware `build_sample` reserved for a sample that will never be
+        sent (ie a discarded proposal): its storage tray slot, mix wells, etc.
+
+        Args:
+            sample (Sample): sample that was built but not sent
+        """
+        pass
 
+    def _generate_protocol(self, sample: Sample, min_start: int):
         # make sure sample is resting in its storage tray, annealing on correct hotplate
-        tray_worker = WORKERS[sample.storage_slot["tray"]]
+        tray_worker = system.get_planning_workers()[sample.storage_slot["tray"]]
         for task in sample.worklist:
             if isinstance(task, Rest):
                 task.workers = [tray_worker]
@@ -210,7 +226,52 @@ class PASCALAxQueue(Client):
             ending_worker=tray_worker,
             min_start=min_start,
         )
-        self.system.scheduler.solve(self.SCHEDULE_SOLVE_TIME)
+
+    def _withdraw_protocol(self, sample: Sample):
+        """Remove a sample's protocol from the schedule, if it has one"""
+        protocol = getattr(sample, "protocol", None)
+        if protocol is None:
+            return
+        with self._lock:
+            scheduler = self.system.scheduler
+            if protocol in scheduler.protocols:
+                scheduler.protocols.remove(protocol)
+            self.system._protocols.pop(protocol.name, None)
+            scheduler._build_tasklist()
+            scheduler._num_tasks_on_last_solve = len(scheduler.tasklist)
+            sample.protocol = None
+
+    def _schedule_ahead(self, sample: Sample):
+        """Tentatively schedule a sample that has not been requested yet. Only
+        insertion is used, a full solve would move samples that were already sent.
+        If the sample cannot be inserted, it is scheduled when it is sent instead.
+        """
+        if self.t0 is None or not self.INCREMENTAL_SCHEDULING:
+            return
+        with self._lock:
+            self._generate_protocol(sample, min_start=self.min_allowable_time)
+            if not self.insertion.insert(sample.protocol):
+                self._withdraw_protocol(sample)
+
+    def _send_sample_to_maestro(
+        self, sample: Sample, parameters: dict, min_start: int = None
+    ):
+        """Send a new sample to the maestro workers"""
+        if not self.first_sample_sent:
+            self.set_start_time()
+            self.first_sample_sent = True
+
+        if min_start is None:
+            min_start = self.min_allowable_time
+        min_start = max([min_start, self.min_allowable_time])
+
+        with self._lock:
+            protocol = getattr(sample, "protocol", None)
+            if protocol is None or min(t.start for t in protocol.worklist) < min_start:
+                # not scheduled ahead of time, or its slot has already passed
+                self._withdraw_protocol(sample)
+                self._generate_protocol(sample, min_start=min_start)
+                self._schedule_protocol(sample.protocol)
 
         msg_dict = sample.to_dict()
         msg_dict["parameters"] = parameters
@@ -222,7 +283,16 @@ class PASCALAxQueue(Client):
         msg_dict["type"] = "protocol"
         msg = json.dumps(msg_dict)
         self.send(msg)
-        self.sample_counter += 1
+
+    def _schedule_protocol(self, protocol):
+        """Schedule a new protocol, inserting it around the existing schedule if possible"""
+        if self.INCREMENTAL_SCHEDULING:
+            if self.insertion.insert(protocol):
+                return
+            print("Could not insert sample into the existing schedule, re-solving")
+            for task in protocol.worklist:  # leave time for the full solve
+                task.min_start += self.SCHEDULE_SOLVE_TIME
+        self.system.scheduler.solve(self.SCHEDULE_SOLVE_TIME)
 
     def get_experiment_directory(self):
         """
@@ -294,13 +364,45 @@ class PASCALAxQueue(Client):
             )
 
     ### Ax Methods
+    def start_proposals(self, experiment, generation_strategy, size: int = 2):
+        """Start generating optimizer suggestions in the background, so samples can
+        be dispatched without waiting on the model. See `ProposalBuffer`.
+
+        Args:
+            experiment (ax.Experiment): experiment run by the Ax Scheduler
+            generation_strategy (ax.GenerationStrategy): generation strategy of the Ax Scheduler
+            size (int, optional): number of suggestions to keep ready. Defaults to 2.
+        """
+        self.proposals = ProposalBuffer(
+            queue=self,
+            experiment=experiment,
+            generation_strategy=generation_strategy,
+            size=size,
+        )
+        self.proposals.start()
+
+    def stop_proposals(self):
+        """Stop generating suggestions, abandoning any that were not dispatched"""
+        self.proposals.stop()
+        self.proposals = None
+
     def schedule_job_with_parameters(
-        self, parameters: Dict[str, Union[str, float, int, bool]]
+        self, parameters: Dict[str, Union[str, float, int, bool]], trial_index=None
     ) -> int:
         """Schedules an evaluation job with given parameters and returns job ID."""
-        # Code to actually schedule the job and produce an ID would go here;
-        # using timestamp as dummy ID for this example.
-        sample = self.build_sample(parameters)
+        proposal = None
+        if self.proposals is not None and trial_index is not None:
+            proposal = self.proposals.pop(trial_index)
+        if trial_index in self.abandoned_trials:
+            # discarded by the proposal buffer while the Ax Scheduler was picking it, do not run
+            job_id = f"abandoned_trial{trial_index}"
+            self.jobs[job_id] = PASCALJob(job_id, parameters)
+            self.jobs[job_id].status = TrialStatus.ABANDONED
+            return job_id
+        if proposal is None:
+            sample = self._build_sample(parameters)
+        else:
+            sample = proposal.sample  # built and usually scheduled ahead of time
         self._send_sample_to_maestro(sample=sample, parameters=parameters)
         job_id = sample.name
         self.jobs[job_id] = PASCALJob(job_id, parameters)
@@ -338,7 +440,7 @@ class PASCALRunner(Runner):  # Deploys trials to external system.
             raise ValueError("This runner only handles `Trial`.")
 
         job_id = self._pascalqueue.schedule_job_with_parameters(
-            parameters=trial.arm.parameters
+            parameters=trial.arm.parameters, trial_index=trial.index
         )
         # This run metadata will be attached to trial as `trial.run_metadata`
         # by the base `Scheduler`.
@@ -0,0 +1,155 @@
+import time
+from threading import Thread, Lock
+
+from ax.core.base_trial import TrialStatus
+from ax.core.observation import ObservationFeatures
+
+
+class Proposal:
+    def __init__(self, trial, sample, n_outcomes):
+        self.trial = trial
+        self.sample = sample
+        self.n_outcomes = n_outcomes  # outcomes the optimizer had seen when proposing this sample
+
+    @property
+    def parameters(self) -> dict:
+        return self.trial.arm.parameters
+
+
+class ProposalBuffer:
+    """Keeps a few optimizer suggestions ready to run, so the next sample can be
+    dispatched as soon as Ax asks for it.
+
+    A background thread generates candidates from the generation strategy and
+    adds them to the experiment as CANDIDATE trials. The Ax Scheduler deploys
+    existing CANDIDATE trials before generating new ones, so while the buffer is
+    filled the model is never fit on the dispatch path. Each candidate's Sample
+    is built, and if possible inserted into the schedule, ahead of time.
+
+    When new outcomes arrive, candidates proposed without them are stale: they
+    are abandoned, their labware released, and fresh candidates generated from
+    the updated model.
+    """
+
+    def __init__(
+        self,
+        queue,
+        experiment,
+        generation_strategy,
+        size: int = 2,
+        refresh_after: int = 1,
+    ):
+        """
+        Args:
+            queue (PASCALAxQueue): queue that builds, schedules and sends the samples
+            experiment (ax.Experiment): experiment the candidate trials are added to
+            generation_strategy (ax.GenerationStrategy): strategy to generate candidates from, usually the one passed to the Ax Scheduler
+            size (int, optional): number of candidates to keep ready. Defaults to 2.
+            refresh_after (int, optional): number of new outcomes after which a candidate is stale. Defaults to 1.
+        """
+        self.queue = queue
+        self.experiment = experiment
+        self.generation_strategy = generation_strategy
+        self.SIZE = size
+        self.REFRESH_AFTER = refresh_after
+        self.POLLINGRATE = 1  # seconds between buffer checks when full
+        self.proposals = {}  # {trial index: Proposal}, in the order they were generated
+        self.lock = Lock()
+        self.running = False
+
+    ### Thread
+    def start(self):
+        if self.running:
+            raise Exception("Already running!")
+        self.running = True
+        self.thread = Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop proposing and discard all candidates that were not dispatched"""
+        if not self.running:
+            raise Exception("Not running!")
+        self.running = False
+        self.thread.join()
+        with self.lock:
+            for trial_index in list(self.proposals):
+                self._discard(trial_index, reason="proposal buffer stopped")
+
+    def _worker(self):
+        while self.running:
+            try:
+                with self.lock:
+                    self._discard_stale()
+                    full = len(self.proposals) >= self.SIZE
+                if full:
+                    time.sleep(self.POLLINGRATE)
+                else:
+                    self._propose()
+            except Exception as e:
+                print(f"Could not propose a new sample: {e}")
+                time.sleep(self.POLLINGRATE)
+
+    ### Proposals
+    def _n_outcomes(self) -> int:
+        return sum(
+            job.status in (TrialStatus.COMPLETED, TrialStatus.FAILED)
+            for job in list(self.queue.jobs.values())
+        )
+
+    def _pending_observations(self) -> dict:
+        """{metric name: features of trials that are pending, including buffered candidates}"""
+        pending = [
+            ObservationFeatures.from_arm(arm=trial.arm, trial_index=trial.index)
+            for trial in self.experiment.trials.values()
+            if trial.status
+            in (TrialStatus.CANDIDATE, TrialStatus.STAGED, TrialStatus.RUNNING)
+        ]
+        return {metric: pending for metric in self.experiment.metrics}
+
+    def _propose(self):
+        n_outcomes = self._n_outcomes()
+        generator_run = self.generation_strategy.gen(
+            experiment=self.experiment,
+            n=1,
+            pending_observations=self._pending_observations(),
+        )  # slow, model fitting happens here
+        sample = self.queue._build_sample(generator_run.arms[0].parameters)
+        self.queue._schedule_ahead(sample)
+        with self.lock:
+            # the Ax Scheduler can deploy the trial as soon as it exists, so it is
+            # only created once its proposal can be popped
+            try:
+                trial = self.experiment.new_trial(generator_run=generator_run)
+            except Exception:
+                self.queue._discard_sample(sample)
+                raise
+            self.proposals[trial.index] = Proposal(trial, sample, n_outcomes)
+
+    def _discard(self, trial_index, reason):
+        """caller must hold self.lock"""
+        proposal = self.proposals.pop(trial_index)
+        self.queue.abandoned_trials.add(trial_index)
+        proposal.trial.mark_abandoned(reason=reason)
+        self.queue._discard_sample(proposal.sample)
+
+    def _discard_stale(self):
+        n_outcomes = self._n_outcomes()
+        for trial_index, proposal in list(self.proposals.items()):
+            if n_outcomes - proposal.n_outcomes >= self.REFRESH_AFTER:
+                self._discard(
+                    trial_index,
+                    reason=f"stale, proposed before {n_outcomes - proposal.n_outcomes} new outcomes",
+                )
+
+    def pop(self, trial_index: int) -> Proposal:
+        """Take a candidate out of the buffer to dispatch it. Once popped, a
+        candidate can no longer be discarded as stale.
+
+        Args:
+            trial_index (int): index of the Ax trial being run
+
+        Returns:
+            Proposal: the buffered candidate, or None if that trial was not buffered or was already discarded (see `queue.abandoned_trials`)
+        """
+        with self.lock:
+            return self.proposals.pop(trial_index, None)
@@ -0,0 +1,173 @@
+import os
+import numpy as np
+from math import ceil
+
+from frgpascal.hardware.helpers import load_hardware_constants
+from frgpascal.learnedmodel import LearnedModel
+
+MODULE_DIR = os.path.dirname(__file__)
+MODEL_PATH = os.path.join(MODULE_DIR, "hardware", "durationmodel.yaml")
+constants = load_hardware_constants()["durationmodel"]
+
+
+class DurationModel(LearnedModel):
+    """Task durations learned from the actual timings of previous runs.
+
+    Durations are stored at increasing levels of detail, keyed as
+        task name
+        task name/source/destination (transitions only)
+        task name/source/destination/storage slot (transitions to/from a storage tray)
+    and estimates are drawn from the most detailed level with enough
+    observations, as a quantile of the observed durations. If no level has
+    enough observations, the hardcoded estimate is used.
+
+    Tasks with an explicit planned duration (characterize) instead learn the
+    residual between the actual and planned duration, which is added to future
+    plans.
+    """
+
+    STORES = ("durations", "residuals")  # {key: [seconds]}, {task name: [actual - planned seconds]}
+
+    def __init__(self, filepath=MODEL_PATH, quantile=None):
+        """
+        Args:
+            filepath (str, optional): yaml file the model is persisted to. Defaults to durationmodel.yaml next to hardwareconstants.yaml.
+            quantile (float, optional): quantile (0-1) of observed durations used as the estimate. Higher = more conservative schedules. Defaults to hardwareconstants.yaml > durationmodel > quantile.
+        """
+        super().__init__(filepath=filepath, constants=constants, quantile=quantile)
+
+    ### Learning
+    @staticmethod
+    def _key(*parts) -> str:
+        return "/".join(str(p) for p in parts if p is not None)
+
+    def observe(
+        self,
+        name: str,
+        duration: float,
+        source: str = None,
+        destination: str = None,
+        slot: str = None,
+    ):
+        """Record one observed task duration
+
+        Args:
+            name (str): task name
+            duration (float): seconds
+            source (str, optional): source worker name, for transitions. Defaults to None.
+            destination (str, optional): destination worker name, for transitions. Defaults to None.
+            slot (str, optional): storage slot the transition picked from/placed into. Defaults to None.
+        """
+        duration = round(float(duration), 2)
+        self._record(self.durations, self._key(name), duration)
+        if source is None or destination is None:
+            return
+        self._record(self.durations, self._key(name, source, destination), duration)
+        if slot is not None:
+            self._record(
+                self.durations, self._key(name, source, destination, slot), duration
+            )
+
+    def learn(self, samples: dict):
+        """Learn from the actual timings of a run
+
+        Args:
+            samples (dict): {sample name: sample dict}, ie Maestro.samples or the contents of maestro_sample_log.json
+        """
+        from frgpascal.system import get_task_worker_types, get_storage_names
+
+        all_tasks = get_task_worker_types()
+        trays = get_storage_names()
+        for sample in samples.values():
+            storage_slot = sample.get("storage_slot") or {}
+            for task in sample["worklist"]:
+                if "start_actual" not in task or "finish_actual" not in task:
+                    continue  # task did not complete
+                duration = task["finish_actual"] - task["start_actual"]
+                details = task.get("details") or {}
+                if "duration" in task:  # duration was planned explicitly
+                    planned = task.get("estimated_duration", task["duration"])
+                    self._record(
+                        self.residuals, task["name"], round(float(duration - planned), 2)
+                    )
+                    continue
+                if task["name"] not in all_tasks:
+                    continue
+                if all_tasks[task["name"]]["estimated_duration"] is None:
+                    continue  # duration depends on process variables, not hardware
+                if "duration" in details:
+                    continue  # duration was set by the user, ie rest
+                source = details.get("source")
+                destination = details.get("destination")
+                slot = None
+                if storage_slot.get("tray") in trays and storage_slot.get("tray") in (
+                    source,
+                    destination,
+                ):
+                    slot = storage_slot.get("slot")
+                self.observe(
+                    task["name"],
+                    duration,
+                    source=source,
+                    destination=destination,
+                    slot=slot,
+                )
+
+    ### Estimates
+    def estimate(
+        self,
+        name: str,
+        source: str = None,
+        destination: str = None,
+        slot: str = None,
+        default: float = None,
+        quantile: float = None,
+    ):
+        """Estimated duration of a task
+
+        Args:
+            name (str): task name
+            source (str, optional): source worker name, for transitions. Defaults to None.
+            destination (str, optional): destination worker name, for transitions. Defaults to None.
+            slot (str, optional): storage slot the transition picks from/places into. Defaults to None.
+            default (float, optional): returned if there are not enough observations. Defaults to None.
+            quantile (float, optional): overrides self.QUANTILE. Defaults to None.
+
+        Returns:
+            int: duration (seconds), or default if there are not enough observations
+        """
+        if quantile is None:
+            quantile = self.QUANTILE
+        keys = []
+        if source is not None and destination is not None:
+            if slot is not None:
+                keys.append(self._key(name, source, destination, slot))
+            keys.append(self._key(name, source, destination))
+        keys.append(self._key(name))
+        with self._lock:
+            for key in keys:
+                observations = self.durations.get(key, [])
+                if len(observations) >= self.MIN_OBSERVATIONS:
+                    return ceil(np.quantile(observations, quantile))
+        return default
+
+    def residual(self, name: str, quantile: float = None) -> float:
+        """Correction (seconds) to add to the planned duration of a task
+
+        Args:
+            name (str): task name
+            quantile (float, optional): overrides self.QUANTILE. Defaults to None.
+
+        Returns:
+            float: quantile of (actual - planned duration), or 0 if there are not enough observations
+        """
+        if quantile is None:
+            quantile = self.QUANTILE
+        with self._lock:
+            observations = self.residuals.get(name, [])
+            if len(observations) < self.MIN_OBSERVATIONS:
+                return 0
+            return float(np.quantile(observations, quantile))
+
+
+get_duration_model = DurationModel.shared
@@ -1,14 +1,11 @@
 import os
-import yaml
 import numpy as np
 from abc import ABC, abstractmethod
 from math import ceil
+from frgpascal.hardware.helpers import load_hardware_constants
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(
-    os.path.join(MODULE_DIR, "..", "hardware", "hardwareconstants.yaml"), "r"
-) as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)["characterizationline"]
+constants = load_hardware_constants()["characterizationline"]
 
 AVAILABLE_STATION = [k for k in constants["stations"].keys()]
 
@@ -14,11 +14,17 @@ from frgpascal.experimentaldesign.tasks import (
 )
 from copy import deepcopy
 import uuid
-import matplotlib.pyplot as plt
-import pandas as pd
-from frgpascal.system import generate_workers, build
-from frgpascal.workers import Worker_Hotplate
+from frgpascal.system import (
+    get_planning_workers,
+    get_hotplate_names,
+    build,
+    apply_slot_durations,
+)
 from frgpascal.experimentaldesign.protocolwriter import generate_ot2_protocol
+from frgpascal.experimentaldesign.liquidrouting import MixingRouter
+from frgpascal.netlist import write_netlist, NETLIST_EXTENSION
+from frgpascal.schedulecache import ScheduleCache
+from frgpascal.hardware.helpers import lazy_module_attributes
 from typing import Tuple
 import mixsol as mx
 from mixsol.mix import _solutions_to_matrix
@@ -28,10 +34,14 @@ from roboflo import System
 import subprocess
 import re
 
-WORKERS = generate_workers()
-HOTPLATE_NAMES = [
-    name for name, worker in WORKERS.items() if isinstance(worker, Worker_Hotplate)
-]
+# workers are built on first access rather than at import
+__getattr__ = lazy_module_attributes(
+    __name__,
+    {
+        "WORKERS": get_planning_workers,
+        "HOTPLATE_NAMES": get_hotplate_names,
+    },
+)
 
 
 #### General
@@ -106,34 +116,68 @@ def interpolate_solutions(solutions: list, steps: int) -> list:
         list: list of unique Solution objects resulting from the interpolation
     """
 
-    solution_matrix, solvent_idx, components = _solutions_to_matrix(solutions)
-    solvent_components = [components[i] for i in solvent_idx]
-    solution_idx = list(range(len(solutions)))
-    tweened_solutions = []
-    for solution_indices in itertools.combinations_with_replacement(
-        solution_idx, steps
-    ):
-        svector = np.mean([solution_matrix[i] for i in solution_indices], axis=0)
-        molarity = np.mean([solutions[i].molarity for i in solution_indices])
-        solutes = components_to_name(
-            {
-                c: v / molarity
-                for c, v in zip(components, svector)
-                if v > 0 and c not in solvent_components
-            }
-        )
-        solvent = components_to_name(
-            {
-                c: v
-                for c, v in zip(components, svector)
-                if v > 0 and c in solvent_components
-            }
-        )
-        new_solution = Solution(solutes=solutes, solvent=solvent, molarity=molarity)
-        if new_solution not in tweened_solutions:
-            tweened_solutions.append(new_solution)
+    return list(iter_interpolated_solutions(solutions, steps))
+
 
-    return tweened_solutions
+def iter_interpolated_solutions(solutions: list, steps: int, chunksize: int = 10000):
+    """Lazily generate the unique solutions of `interpolate_solutions`, in the same order
+
+    The mixtures are computed in chunks as one array operation, and
+    duplicates are dropped by a hash of their composition rounded to the
+    precision of the solution names, so large simplex grids (many endpoints
+    and/or steps) stay fast.
+
+    Args:
+        solutions (list): List of Solution objects to be interpolated between
+        steps (int): number of steps to interpolate between endpoint solutions.
+        chunksize (int, optional): number of mixtures computed at once. Defaults to 10000.
+
+    Yields:
+        Solution: unique interpolated solution
+    """
+    solution_matrix, solvent_idx, components = _solutions_to_matrix(solutions)
+    is_solvent = np.zeros(len(components), dtype=bool)
+    is_solvent[solvent_idx] = True
+    molarities = np.array([s.molarity for s in solutions], dtype=float)
+    combinations = itertools.combinations_with_replacement(
+        range(len(solutions)), steps
+    )
+    seen = set()
+    while True:
+        chunk = np.array(
+            list(itertools.islice(combinations, chunksize)), dtype=int
+        )  # rows = mixtures, columns = index of each endpoint solution in the mixture
+        if len(chunk) == 0:
+            break
+        svectors = solution_matrix[chunk].mean(axis=1)
+        molarity = molarities[chunk].mean(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            amounts = np.where(
+                is_solvent, svectors, svectors / molarity[:, None]
+            )  # solutes are named per unit molarity
+        amounts[svectors <= 0] = 0
+        keys = np.round(amounts, 2)  # same precision as components_to_name
+
+        for svector, amount, key, m in zip(svectors, amounts, keys, molarity):
+            key = (key.tobytes(), round(m, 4))
+            if key in seen:
+                continue
+            seen.add(key)
+            solutes = components_to_name(
+                {
+                    c: a
+                    for c, a, v, s in zip(components, amount, svector, is_solvent)
+                    if v > 0 and not s
+                }
+            )
+            solvent = components_to_name(
+                {
+                    c: a
+                    for c, a, v, s in zip(components, amount, svector, is_solvent)
+                    if v > 0 and s
+                }
+            )
+            yield Solution(solutes=solutes, solvent=solvent, molarity=m)
 
 
 #### Plot contents of sample tray for loading guidance
@@ -143,6 +187,8 @@ def plot_tray(tray, ax=None):
     """
     plot tray w/ substrates to load prior to experiment start
     """
+    import matplotlib.pyplot as plt
+
     if ax is None:
         fig, ax = plt.subplots()
         ax.set_aspect("equal")
@@ -278,10 +324,10 @@ def build_sample_list(
                 continue
             if type(step) == Spincoat:
                 this_set_of_steps.append(
-                    apply_solution_mesh(deepcopy(step), solution_mesh)
+                    apply_solution_mesh(step, solution_mesh)
                 )
             else:
-                this_set_of_steps.append([deepcopy(step)])
+                this_set_of_steps.append([step])
         all_worklists += list(itertools.product(*this_set_of_steps))
 
     idx = starting_index
@@ -300,7 +346,7 @@ def build_sample_list(
                     this_sample = Sample(
                         name=name,
                         substrate=sub,
-                        worklist=deepcopy(wl),
+                        worklist=wl,  # Sample makes its own task instances
                         storage_slot=None,
                         # sampleid=sampleid
                     )
@@ -342,55 +388,139 @@ def load_sample_trays(samples: list, available_trays: list):
         sample.storage_slot = storage_slot
         for task in sample.worklist:
             if isinstance(task, Rest):
-                task.workers = [WORKERS[storage_slot["tray"]]]
+                task.workers = [get_planning_workers()[storage_slot["tray"]]]
 
 
-def samples_to_dataframe(samples):
-    dfdata = []
-    for sample in samples:
-        this = {
-            "name": sample.name,
-            "storage_tray": sample.storage_slot["tray"],
-            "storage_slot": sample.storage_slot["slot"],
-            "substrate": sample.substrate,
-            "worklist": json.dumps(
-                [task.to_dict() for task in sample.worklist],
-                cls=NumpyFloatValuesEncoder,
-            ),
-        }
+def _json_key(value) -> str:
+    return json.dumps(value, cls=NumpyFloatValuesEncoder)
+
+
+def _typed_column(values: list):
+    """Convert a list of per-sample values (None where missing) to a typed column
+
+    Returns:
+        np.ndarray for numeric/boolean columns (float with NaN where missing),
+        otherwise a tuple of (integer codes, categories) with -1 where missing.
+        Nested values (lists, dicts) are stored as json strings in the categories.
+    """
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, (bool, np.bool_)) for v in present) and len(present) == len(
+        values
+    ):
+        return np.array(values, dtype=bool)
+    if len(present) > 0 and all(
+        isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_))
+        for v in present
+    ):
+        return np.array(
+            [np.nan if v is None else v for v in values], dtype=float
+        )  # NaN where a sample does not have this task
+
+    codes = np.full(len(values), -1, dtype=np.int32)
+    categories = {}  # {category: code}
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        if not isinstance(v, str):
+            v = _json_key(v)
+        codes[i] = categories.setdefault(v, len(categories))
+    return codes, list(categories)
+
+
+def _samples_to_columns(samples: list) -> dict:
+    """Flatten samples into one typed column per sample attribute/task detail
+
+    Returns:
+        dict: {column name: np.ndarray or (codes, categories)}, see `_typed_column`
+    """
+    n = len(samples)
+    columns = {}  # {column name: [value for each sample]}
+
+    def put(column, i, value):
+        if column not in columns:
+            columns[column] = [None] * n
+        columns[column][i] = value
+
+    solution_dicts = {}  # {id(solution): (solutes json, solvent json)}, solutions are shared between samples
+    for i, sample in enumerate(samples):
+        put("name", i, sample.name)
+        put("storage_tray", i, sample.storage_slot["tray"])
+        put("storage_slot", i, sample.storage_slot["slot"])
+        put("substrate", i, sample.substrate)
+        put("worklist", i, None)  # filled in after the tasks, keeps column order
+
+        recipe = []
         task_idx = {}
         for task in sample.worklist:
-            if task.task not in task_idx:
-                task_idx[task.task] = 0
-            header = f"{task.task}{task_idx[task.task]}_"
-            task_idx[task.task] += 1
-            for c, v in task.to_dict().get("details", {}).items():
-                if c == "drops":
-                    for drop_idx, d in enumerate(v):
-                        key = header + f"drop{drop_idx}_"
-                        for aspect in ["time", "height", "rate", "volume"]:
-                            this[key + aspect] = d[aspect]
-
-                        this[key + "molarity"] = d["solution"]["molarity"]
-                        this[key + "solutes"] = d["solution"]["solutes"]
-                        this[key + "solutes_dict"] = json.dumps(
-                            task.drops[drop_idx].solution.solutes,
-                            cls=NumpyFloatValuesEncoder,
+            details = task.generate_details()
+            recipe.append(
+                {"name": task.task, "immediate": task.immediate, "details": details}
+            )
+            header = f"{task.task}{task_idx.get(task.task, 0)}_"
+            task_idx[task.task] = task_idx.get(task.task, 0) + 1
+            for c, v in details.items():
+                if c != "drops":
+                    put(header + c, i, v)
+                    continue
+                for drop_idx, (d, drop) in enumerate(zip(v, task.drops)):
+                    key = header + f"drop{drop_idx}_"
+                    for aspect in ["time", "height", "rate", "volume"]:
+                        put(key + aspect, i, d[aspect])
+                    put(key + "molarity", i, d["solution"]["molarity"])
+                    put(key + "solutes", i, d["solution"]["solutes"])
+                    put(key + "solvent", i, d["solution"]["solvent"])
+                    sid = id(drop.solution)
+                    if sid not in solution_dicts:
+                        solution_dicts[sid] = (
+                            _json_key(drop.solution.solutes),
+                            _json_key(drop.solution.solvent),
                         )
+                    put(key + "solutes_dict", i, solution_dicts[sid][0])
+                    put(key + "solvent_dict", i, solution_dicts[sid][1])
+        put("worklist", i, recipe)
 
-                        this[key + "solvent"] = d["solution"]["solvent"]
-                        this[key + "solvent_dict"] = json.dumps(
-                            task.drops[drop_idx].solution.solvent,
-                            cls=NumpyFloatValuesEncoder,
-                        )
+    return {column: _typed_column(values) for column, values in columns.items()}
+
+
+def samples_to_dataframe(samples: list, filepath: str = None) -> "pd.DataFrame":
+    """Tabulate samples, one row per sample and one column per task detail
+
+    Columns are built in a single pass and typed: numeric details are float
+    columns (NaN where a sample does not have that task), and text or nested
+    details (worklists, solute dicts, spin steps) are categorical columns whose
+    categories are the unique json strings, so repeated recipes are only stored
+    once. The "worklist" column holds each sample's recipe (task name,
+    immediate flag and details), without task ids or schedule times.
+
+    Args:
+        samples (list): Sample objects
+        filepath (str, optional): if given, the dataframe is also written here. Parquet if the path ends in .parquet (keeps the column types), otherwise csv.
 
-                else:
-                    key = header + c
-                    if key in dfdata:
-                        this[key] = v
-        dfdata.append(this)
+    Returns:
+        pd.DataFrame: sample dataframe
+    """
+    import pandas as pd
+
+    data = {}
+    for column, values in _samples_to_columns(samples).items():
+        if isinstance(values, tuple):
+            codes, categories = values
+            if len(categories) == len(samples) and (codes >= 0).all():
+                data[column] = np.array(categories, dtype=object)[
+                    codes
+                ]  # all unique (ie names), categorical would not save anything
+            else:
+                data[column] = pd.Categorical.from_codes(codes, categories=categories)
+        else:
+            data[column] = values
+    df = pd.DataFrame(data)
 
-    return pd.DataFrame(dfdata)
+    if filepath is not None:
+        if filepath.endswith(".parquet"):
+            df.to_parquet(filepath)
+        else:
+            df.to_csv(filepath)
+    return df
 
 
 def assign_hotplates(samples: list):
@@ -417,17 +547,17 @@ def assign_hotplates(samples: list):
             )
 
     hotplate_settings = {}
-    for temperature, hp in zip(unique_temperatures, HOTPLATE_NAMES):
+    for temperature, hp in zip(unique_temperatures, get_hotplate_names()):
         for task in temperatures[temperature]:
             task.hotplate = hp
-            task.workers = [WORKERS[hp]]
+            task.workers = [get_planning_workers()[hp]]
         hotplate_settings[hp] = temperature
     return hotplate_settings
 
 
 def process_sample_list(
     samples: list, sample_trays: list, experiment_name: str
-) -> Tuple[pd.DataFrame, dict]:
+) -> Tuple["pd.DataFrame", dict]:
     for i, s in enumerate(samples):
         s.name = f"sample{i}"
     hotplate_settings = assign_hotplates(samples)
@@ -615,6 +745,8 @@ class PASCALPlanner:
             print("No solutions required for this experiment!")
             self.solution_details = {}
             self.mixing_netlist = {}
+            self.mixing_route = []
+            self.mixing_time = 0
             return
 
         if len(self.stock_solutions) == 0:
@@ -643,41 +775,142 @@ class PASCALPlanner:
         )
         self.mixer.print()
 
+        # group transfers into multi-dispenses, order them by deck travel, and reuse tips where possible
+        router = MixingRouter(labware=self.solution_storage)
+        self.mixing_route = router.route(self.mixing_netlist)
+        self.mixing_time = router.estimate_time(self.mixing_route)
+        unoptimized = router.unoptimized_route(self.mixing_netlist)
+        print(
+            f"Mixing on the liquid handler: {router.tips_required(self.mixing_route)} tips, ~{self.mixing_time/60:.1f} minutes (transfer by transfer: {router.tips_required(unoptimized)} tips, ~{router.estimate_time(unoptimized)/60:.1f} minutes)"
+        )
+
     def solve_schedule(
-        self, shuffle: bool = True, prioritize_first_spincoat: bool = False, **kwargs
+        self,
+        shuffle: bool = True,
+        prioritize_first_spincoat: bool = False,
+        portfolio: int = 1,
+        processes: int = None,
+        window: int = None,
+        overlap: int = None,
+        use_cache: bool = True,
+        **kwargs,
     ):
-        self.system: System = build()
-        if shuffle:
-            sample_it = iter(random.sample(self.samples, len(self.samples)))
-        else:
-            sample_it = iter(self.samples)
-
-        for sample in sample_it:
-            sample: Sample
-            sample_tray = WORKERS[sample.storage_slot["tray"]]
-            sample.protocol = self.system.generate_protocol(
-                worklist=sample.worklist,
-                name=sample.name,
-                starting_worker=sample_tray,
-                ending_worker=sample_tray,
-            )
-
-        if prioritize_first_spincoat:
-            for sample in self.samples:
-                for task in sample.protocol.worklist:
-                    if isinstance(task, Spincoat):
-                        task.breakpoint = True
-                        break
+        """Schedule all samples with the roboflo solver
 
-        self.system.scheduler._collect_breakpoints()
+        Args:
+            shuffle (bool, optional): randomize the order samples are added to the scheduler. Defaults to True.
+            prioritize_first_spincoat (bool, optional): solve up to each sample's first spincoat before the rest of the schedule. Defaults to False.
+            portfolio (int, optional): number of independent solves, each with a different random sample order, run in parallel processes. The schedule with the shortest makespan is kept. Defaults to 1.
+            processes (int, optional): max parallel solves when portfolio > 1. Defaults to the number of cpu cores.
+            window (int, optional): if set, schedule samples in rolling windows of this many samples instead of all at once. Earlier windows are fixed before solving later ones, so planning time grows roughly linearly with the number of samples. Use for sample lists too large to solve at once (> a few hundred). Defaults to None.
+            overlap (int, optional): samples from the next window included (but not fixed) when solving each window, so each window leaves room for what follows. Defaults to window // 2.
+            use_cache (bool, optional): reuse a previously solved schedule for the same problem (see frgpascal.schedulecache). If only a few samples changed, the unchanged samples are fixed at their cached times and only the rest are solved in one go, so this warm start is skipped when using `window` or `portfolio`. Defaults to True.
+            **kwargs: passed to roboflo Scheduler.solve, ie solve_time (seconds allotted to each solve)
+        """
+        import matplotlib.pyplot as plt
 
-        self.system.scheduler.solve(**kwargs)
+        if window is not None and portfolio > 1:
+            raise ValueError("Rolling window scheduling cannot be combined with a portfolio!")
+        seed = random.randrange(2 ** 32) if shuffle else None
+        self.system: System = _build_schedule(
+            self.samples, seed, prioritize_first_spincoat
+        )
+        cache_status = "miss"
+        if use_cache:
+            cache = ScheduleCache()
+            cache_status = cache.apply(
+                self.system, allow_partial=window is None and portfolio == 1
+            )
+            if cache_status == "hit":
+                print("Schedule loaded from cache")
+            elif cache_status == "partial":
+                print("Similar schedule found in cache, solving only the changed samples")
+
+        if cache_status == "hit":
+            pass
+        elif cache_status == "partial" or (window is None and portfolio == 1):
+            self.system.scheduler.solve(**kwargs)
+        elif window is not None:
+            _solve_rolling_horizon(
+                self.system,
+                window=window,
+                overlap=window // 2 if overlap is None else overlap,
+                **kwargs,
+            )
+        else:
+            self._solve_schedule_portfolio(
+                portfolio=portfolio,
+                shuffle=shuffle,
+                prioritize_first_spincoat=prioritize_first_spincoat,
+                processes=processes,
+                **kwargs,
+            )
+        if use_cache and cache_status != "hit":
+            cache.save(self.system)
         self.system.scheduler.plot_solution()
         filename = f"schedule_{self.name}.jpeg"
         plt.savefig(filename, bbox_inches="tight")
         print(f'schedule image saved to "{filename}"')
 
-    def export(self):
+    def _solve_schedule_portfolio(
+        self, portfolio, shuffle, prioritize_first_spincoat, processes, **kwargs
+    ):
+        """Run several solves in parallel, keep the one with the shortest makespan"""
+        from concurrent.futures import ProcessPoolExecutor
+
+        seeds = [random.randrange(2 ** 32) for _ in range(portfolio)]
+        if not shuffle:
+            seeds[0] = None  # keep the given sample order as one of the candidates
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [
+                pool.submit(
+                    _solve_schedule_candidate,
+                    self.samples,
+                    seed,
+                    prioritize_first_spincoat,
+                    kwargs,
+                )
+                for seed in seeds
+            ]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"\tportfolio solve failed: {e}")
+        if len(results) == 0:
+            raise Exception("All portfolio solves failed!")
+
+        makespans = [makespan for makespan, _, _ in results]
+        self.schedule_portfolio = [(seed, makespan) for makespan, seed, _ in results]
+        best_makespan, best_seed, best_times = min(results, key=lambda r: r[0])
+        print(
+            f"{len(results)}/{portfolio} solves succeeded. Makespan (minutes): best {min(makespans)/60:.1f}, median {np.median(makespans)/60:.1f}, worst {max(makespans)/60:.1f}"
+        )
+
+        # rebuild the winning schedule in this process, so samples reference its protocols
+        self.system: System = _build_schedule(
+            self.samples, best_seed, prioritize_first_spincoat
+        )
+        for sample in self.samples:
+            for task, (start, end) in zip(
+                sample.protocol.worklist, best_times[sample.name]
+            ):
+                task.start = start
+                task.end = end
+                task._solution_count += 1
+        scheduler = self.system.scheduler
+        scheduler._build_tasklist()
+        scheduler._num_tasks_on_last_solve = len(scheduler.tasklist)
+
+    def export(self, compact: bool = False):
+        """Export the planned experiment: solution/tray maps, the OT2 protocol, the maestro netlist and a sample dataframe
+
+        Args:
+            compact (bool, optional): write the maestro netlist in the compact format (maestronetlist_*.pnl, see frgpascal.netlist) instead of json. Faster to write and load for large campaigns. Defaults to False.
+        """
+        import matplotlib.pyplot as plt
+
         ## plot solution destinations
         ll_with_solutions = [ll for ll in self.solution_storage if len(ll.contents) > 0]
 
@@ -741,7 +974,7 @@ class PASCALPlanner:
             template = "1000left300right"
             generate_ot2_protocol(
                 title=self.name,
-                mixing_netlist=self.mixing_netlist,
+                mixing_netlist=self.mixing_route,
                 labware=self.solution_storage,
                 tipracks_1000=self.tip_racks_1000,
                 tipracks_300=self.tip_racks_300,
@@ -783,9 +1016,15 @@ class PASCALPlanner:
             "hotplate_setpoints": self.hotplate_settings,
         }
 
-        fname = f"maestronetlist_{self.name}.json"
-        with open(fname, "w") as f:
-            json.dump(out, f, indent=4, sort_keys=True, cls=NumpyFloatValuesEncoder)
+        if compact:
+            fname = f"maestronetlist_{self.name}{NETLIST_EXTENSION}"
+            write_netlist(out, fname)
+        else:
+            fname = f"maestronetlist_{self.name}.json"
+            with open(fname, "w") as f:
+                json.dump(
+                    out, f, indent=4, sort_keys=True, cls=NumpyFloatValuesEncoder
+                )
         print(f'Maestro Netlist dumped to "{fname}"')
 
         df = samples_to_dataframe(samples=self.samples)
@@ -794,6 +1033,111 @@ class PASCALPlanner:
         print(f'Sample dataframe dumped to "{fname}"')
 
 
+def _build_schedule(samples: list, seed: int, prioritize_first_spincoat: bool) -> System:
+    """Generate the protocol for each sample on a new roboflo System, ready to be solved
+
+    Args:
+        samples (list): Sample objects. Each sample's .protocol is set to its new protocol
+        seed (int): seed for the random order samples are added to the scheduler. If None, samples are added in the given order
+        prioritize_first_spincoat (bool): place a breakpoint at each sample's first spincoat
+
+    Returns:
+        System: roboflo system with all protocols added to its scheduler
+    """
+    system = build()
+    if seed is None:
+        ordered_samples = samples
+    else:
+        ordered_samples = random.Random(seed).sample(samples, len(samples))
+
+    for sample in ordered_samples:
+        sample: Sample
+        sample_tray = get_planning_workers()[sample.storage_slot["tray"]]
+        sample.protocol = system.generate_protocol(
+            worklist=sample.worklist,
+            name=sample.name,
+            starting_worker=sample_tray,
+            ending_worker=sample_tray,
+        )
+        apply_slot_durations(sample.protocol.worklist, sample.storage_slot)
+
+    if prioritize_first_spincoat:
+        for sample in samples:
+            for task in sample.protocol.worklist:
+                if isinstance(task, Spincoat):
+                    task.breakpoint = True
+                    break
+
+    system.scheduler._collect_breakpoints()
+    return system
+
+
+def _solve_rolling_horizon(system: System, window: int, overlap: int, **kwargs):
+    """Solve a schedule in rolling windows of protocols, in the order they were added to the scheduler
+
+    Each solve includes one window of protocols plus `overlap` protocols from the
+    next window. Only the window is fixed after the solve, the overlap is solved
+    again with the next window. Tasks of a window may not start before the first
+    task of the previous window, so fixed protocols that end before then cannot
+    conflict and are left out of the solver model. Resource state (worker
+    occupancy) is carried forward by the fixed protocols that remain.
+
+    Args:
+        system (System): roboflo system with all protocols added to its scheduler
+        window (int): protocols fixed per solve
+        overlap (int): protocols from the next window included in each solve
+        **kwargs: passed to roboflo Scheduler.solve for each window, ie solve_time
+    """
+    if window < 1:
+        raise ValueError("window must be at least one sample!")
+    scheduler = system.scheduler
+    all_protocols = list(scheduler.protocols)
+    release = 0  # earliest start for tasks in the current window
+    for i in range(0, len(all_protocols), window):
+        print(f"Solving samples {i+1}-{min(i+window, len(all_protocols))} of {len(all_protocols)}")
+        batch = all_protocols[i : i + window + overlap]
+        for p in batch:
+            shift = max(0, release - p.worklist[0].min_start)
+            for task in p.worklist:
+                task.min_start += shift
+        active = [p for p in all_protocols[:i] if p.worklist[-1].end > release]
+
+        scheduler.protocols = active + batch
+        scheduler._collect_breakpoints()
+        scheduler._num_tasks_on_last_solve = 0
+        scheduler.solve(**kwargs)
+
+        for p in batch[window:]:  # overlap is re-solved with the next window
+            for task in p.worklist:
+                task.start = np.nan
+                task.end = np.nan
+                task._solution_count = 0
+        release = min(p.worklist[0].start for p in batch[:window])
+
+    scheduler.protocols = all_protocols
+    scheduler._collect_breakpoints()
+    scheduler._build_tasklist()
+    scheduler._num_tasks_on_last_solve = len(scheduler.tasklist)
+
+
+def _solve_schedule_candidate(
+    samples: list, seed: int, prioritize_first_spincoat: bool, solve_kwargs: dict
+):
+    """One solve of a schedule portfolio, run in a worker process
+
+    Returns:
+        tuple: (makespan (seconds), seed, {sample name: [(start, end) of each task in its protocol]})
+    """
+    system = _build_schedule(samples, seed, prioritize_first_spincoat)
+    system.scheduler.solve(**solve_kwargs)
+    times = {
+        sample.name: [(task.start, task.end) for task in sample.protocol.worklist]
+        for sample in samples
+    }
+    makespan = max(end for sample_times in times.values() for _, end in sample_times)
+    return makespan, seed, times
+
+
 def export_closedloop(
     name, characterization_task, labware, tipracks_300, tipracks_1000
 ):
@@ -806,7 +1150,7 @@ def export_closedloop(
 
     generate_ot2_protocol(
         title=name,
-        mixing_netlist={},
+        mixing_netlist=[],
         labware=labware_,
         tipracks_300=tipracks_300,
         tipracks_1000=tipracks_1000,
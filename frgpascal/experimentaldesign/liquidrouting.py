@@ -0,0 +1,341 @@
+import numpy as np
+from math import ceil
+from frgpascal.hardware.helpers import load_hardware_constants
+
+tc = load_hardware_constants()["liquidhandler"]["timings"]
+mc = tc["mixing"]  # mixing constants
+
+
+def _operation(
+    source,
+    transfers,
+    new_tip,
+    drop_tip,
+    mix_before=None,
+    mix_after=None,
+    touch_tip=False,
+):
+    return {
+        "source": source,
+        "destinations": [d for d, _ in transfers],
+        "volumes": [round(float(v), 2) for _, v in transfers],
+        "new_tip": new_tip,
+        "drop_tip": drop_tip,
+        "mix_before": mix_before,
+        "mix_after": mix_after,
+        "touch_tip": touch_tip,
+        "air_gap": mc["air_gap"],  # uL drawn after aspirating, leaves the tip with the first dispense
+        "blow_out": "destination"
+        if len(transfers) == 1
+        else "source",  # residual liquid would throw off the last of several dispenses
+    }
+
+
+class MixingRouter:
+    """Plans the liquid handler moves to execute a mixing netlist.
+
+    The mixing netlist from `handle_liquids` is a list of generations, each
+    {source: {destination: volume}}. Executed as is, every transfer is its own
+    aspirate + dispense, and every transfer after the first generation uses a
+    fresh tip. The router instead, for each source in each generation:
+        - dispenses into several destinations from one aspiration, as long as
+            the total fits in the tip
+        - orders destinations (nearest neighbor on the deck) to minimize travel
+        - shares one tip between all transfers that do not mix the destination.
+            Only the final transfer into a destination (which mixes it afterwards)
+            contaminates the tip, so these get their own tip.
+    """
+
+    def __init__(self, labware: list, tip_volume: float = 300):
+        """
+        Args:
+            labware (list): LiquidLabware objects holding the sources and destinations
+            tip_volume (float, optional): volume (uL) of the tips used for mixing. Defaults to 300.
+        """
+        self.labware = {ll.name: ll for ll in labware}
+        self.CAPACITY = tip_volume - mc["air_gap"]
+        self.MIX_BEFORE = mc["mix_before"]
+        self.MIX_AFTER = mc["mix_after"]
+
+    ### Deck geometry
+    def position(self, location: str) -> np.ndarray:
+        """xy coordinate (mm) of a "labware-well" location on the deck"""
+        labware_name, well = location.split("-")
+        labware = self.labware[labware_name]
+        pitch_x, pitch_y = mc["deck_slot_pitch"]
+        slot_x = ((labware.deck_slot - 1) % 3) * pitch_x
+        slot_y = ((labware.deck_slot - 1) // 3) * pitch_y
+        x, y, _ = labware._coordinates[well]
+        return np.array([slot_x + x, slot_y + y])
+
+    def travel_time(self, start: str, end: str) -> float:
+        distance = np.linalg.norm(self.position(start) - self.position(end))
+        return mc["move"] + distance / mc["speed"]
+
+    ### Routing
+    def _split(self, transfers: list) -> list:
+        """split transfers larger than the tip into several equal transfers"""
+        split = []
+        for destination, volume in transfers:
+            n = ceil(volume / self.CAPACITY)
+            split += [(destination, volume / n)] * n
+        return split
+
+    def _nearest_neighbor(self, start: str, transfers: list) -> list:
+        """order transfers so each destination is the closest one to the previous"""
+        remaining = list(transfers)
+        ordered = []
+        current = start
+        while len(remaining) > 0:
+            nearest = min(remaining, key=lambda t: self.travel_time(current, t[0]))
+            remaining.remove(nearest)
+            ordered.append(nearest)
+            current = nearest[0]
+        return ordered
+
+    def _trips(self, source: str, transfers: list) -> list:
+        """Group transfers into trips of one aspiration each, visiting the nearest
+        destination that still fits in the tip next.
+
+        Returns:
+            list: trips, each a list of (destination, volume)
+        """
+        remaining = self._split(transfers)
+        trips = []
+        while len(remaining) > 0:
+            trip = []
+            load = 0
+            current = source
+            while True:
+                fits = [t for t in remaining if load + t[1] <= self.CAPACITY + 1e-6]
+                if len(fits) == 0:
+                    break
+                nearest = min(fits, key=lambda t: self.travel_time(current, t[0]))
+                remaining.remove(nearest)
+                trip.append(nearest)
+                load += nearest[1]
+                current = nearest[0]
+            trips.append(trip)
+        return trips
+
+    def _final_generation(self, mixing_netlist: list) -> dict:
+        """{destination: index of the generation with its final incoming transfer}"""
+        final_generation = {}
+        for gen_idx, generation in enumerate(mixing_netlist):
+            for transfers in generation.values():
+                for destination in transfers:
+                    final_generation[destination] = gen_idx
+        return final_generation
+
+    def route(self, mixing_netlist: list) -> list:
+        """Plan the pipetting operations for a mixing netlist
+
+        Args:
+            mixing_netlist (list): generations of {source: {destination: volume}}, from `handle_liquids`
+
+        Returns:
+            list: mixing route. A list of generations, each a list of pipetting
+                operations executed in order. Each operation is one aspiration from
+                a source, dispensed into one or more destinations:
+                {
+                    "source": "labware-well",
+                    "destinations": ["labware-well", ...],
+                    "volumes": [uL, ...],  # one per destination, total fits in the tip
+                    "new_tip": bool,  # pick up a fresh tip before this operation
+                    "drop_tip": bool,  # drop the tip after this operation
+                    "mix_before": [cycles, uL] or None,  # mix the source before aspirating
+                    "mix_after": [cycles, uL] or None,  # mix the (last) destination after dispensing
+                    "touch_tip": bool,  # touch tip on the (last) destination after dispensing
+                    "air_gap": uL,  # air drawn after aspirating, the tip holds volumes + air_gap
+                    "blow_out": "destination" or "source",  # where to blow out the tip
+                }
+        """
+        final_generation = self._final_generation(mixing_netlist)
+        route = []
+        for gen_idx, generation in enumerate(mixing_netlist):
+            operations = []
+            for source, transfers in generation.items():
+                transfers = [(d, v) for d, v in transfers.items() if v > 0]
+                if gen_idx == 0:
+                    # stock solutions into wells, nothing is mixed in the first generation
+                    shared, final = transfers, []
+                    mix_before = None
+                else:
+                    shared = [
+                        t for t in transfers if final_generation[t[0]] != gen_idx
+                    ]
+                    final = [t for t in transfers if final_generation[t[0]] == gen_idx]
+                    mix_before = self.MIX_BEFORE  # source is itself a mixed solution
+
+                trips = self._trips(source, shared)
+                for i, trip in enumerate(trips):
+                    operations.append(
+                        _operation(
+                            source,
+                            trip,
+                            new_tip=i == 0,
+                            drop_tip=i == len(trips) - 1,
+                            mix_before=mix_before if i == 0 else None,
+                        )
+                    )
+                if len(trips) > 0:
+                    mix_before = None  # source was already mixed
+
+                start = trips[-1][-1][0] if len(trips) > 0 else source
+                for transfer in self._nearest_neighbor(start, final):
+                    # one tip per destination, it touches the destination liquid while mixing
+                    chunks = self._split([transfer])
+                    for i, chunk in enumerate(chunks):
+                        last = i == len(chunks) - 1
+                        operations.append(
+                            _operation(
+                                source,
+                                [chunk],
+                                new_tip=i == 0,
+                                drop_tip=last,
+                                mix_before=mix_before if i == 0 else None,
+                                mix_after=self.MIX_AFTER if last else None,
+                                touch_tip=last,
+                            )
+                        )
+                    mix_before = None
+            route.append(operations)
+        return route
+
+    def unoptimized_route(self, mixing_netlist: list) -> list:
+        """The pipetting operations of a mixing netlist executed transfer by
+        transfer, as the liquid handler did before routing. Useful as a baseline
+        for `estimate_time`.
+        """
+        final_generation = self._final_generation(mixing_netlist)
+        route = []
+        for gen_idx, generation in enumerate(mixing_netlist):
+            operations = []
+            for source, transfers in generation.items():
+                transfers = [(d, v) for d, v in transfers.items() if v > 0]
+                for i, (destination, volume) in enumerate(transfers):
+                    chunks = self._split([(destination, volume)])
+                    for j, chunk in enumerate(chunks):
+                        if gen_idx == 0:  # one tip per source
+                            operations.append(
+                                _operation(
+                                    source,
+                                    [chunk],
+                                    new_tip=i == 0 and j == 0,
+                                    drop_tip=i == len(transfers) - 1
+                                    and j == len(chunks) - 1,
+                                )
+                            )
+                        else:  # one tip per transfer
+                            last = j == len(chunks) - 1
+                            mix_after = final_generation[destination] == gen_idx
+                            operations.append(
+                                _operation(
+                                    source,
+                                    [chunk],
+                                    new_tip=j == 0,
+                                    drop_tip=last,
+                                    mix_before=self.MIX_BEFORE,
+                                    mix_after=self.MIX_AFTER
+                                    if mix_after and last
+                                    else None,
+                                    touch_tip=True,
+                                )
+                            )
+            route.append(operations)
+        return route
+
+    def single_transfers(self, transfers: dict) -> list:
+        """Pipetting operations for transfers into one destination, one fresh tip
+        per source and the destination mixed after the last, as the liquid
+        handler executes a `mix` task
+
+        Args:
+            transfers (dict): {source: {destination: volume}}
+
+        Returns:
+            list: pipetting operations
+        """
+        transfers = [
+            (source, destination, volume)
+            for source, t in transfers.items()
+            for destination, volume in t.items()
+            if volume > 0
+        ]
+        operations = []
+        for i, (source, destination, volume) in enumerate(transfers):
+            last = i == len(transfers) - 1
+            operations.append(
+                _operation(
+                    source,
+                    [(destination, volume)],
+                    new_tip=True,
+                    drop_tip=True,
+                    mix_after=self.MIX_AFTER if last else None,
+                    touch_tip=True,
+                )
+            )
+        return operations
+
+    ### Timing
+    @staticmethod
+    def _mix_time(mix) -> float:
+        """time to mix, same model as the drop pre_mix"""
+        if mix is None:
+            return 0
+        cycles, volume = mix
+        premix = tc["aspirate"]["premix"]
+        return cycles * (premix["a"] * volume + premix["b"])
+
+    def operation_time(self, operation: dict, previous: str = None) -> float:
+        """Estimated duration (seconds) of one pipetting operation
+
+        Args:
+            operation (dict): pipetting operation
+            previous (str, optional): location the pipette starts from, if it already holds a tip. Defaults to None.
+
+        Returns:
+            float: duration, in seconds
+        """
+        t = 0
+        if operation["new_tip"] or previous is None:
+            t += tc["aspirate"]["preparetip"]  # includes travel to the source
+        else:
+            t += self.travel_time(previous, operation["source"])
+        t += self._mix_time(operation["mix_before"])
+        t += sum(operation["volumes"]) / mc["aspirate_rate"]
+        t += tc["aspirate"]["airgap"]
+
+        current = operation["source"]
+        for destination, volume in zip(operation["destinations"], operation["volumes"]):
+            t += self.travel_time(current, destination)
+            t += volume / mc["dispense_rate"]
+            current = destination
+        t += self._mix_time(operation["mix_after"])
+        if operation["blow_out"] == "source":
+            t += self.travel_time(current, operation["source"])
+        t += mc["blowout"]
+        if operation["touch_tip"]:
+            t += tc["aspirate"]["touchtip"]
+        if operation["drop_tip"]:
+            t += mc["droptip"]
+        return t
+
+    def estimate_time(self, route: list) -> float:
+        """Estimated duration (seconds) of a mixing route"""
+        t = 0
+        for generation in route:
+            previous = None
+            for operation in generation:
+                t += self.operation_time(operation, previous)
+                if operation["drop_tip"]:
+                    previous = None
+                elif operation["blow_out"] == "source":
+                    previous = operation["source"]
+                else:
+                    previous = operation["destinations"][-1]
+        return t
+
+    @staticmethod
+    def tips_required(route: list) -> int:
+        return sum(op["new_tip"] for generation in route for op in generation)
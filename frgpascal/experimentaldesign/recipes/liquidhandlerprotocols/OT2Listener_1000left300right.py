@@ -109,6 +109,7 @@ class ListenerWebsocket:
         self.reusable_tips = {}
         self.return_current_tip = {p: False for p in self.pipettes.values()}
 
+        self.NTP_ATTEMPTS = 3  # NTP requests before relying on Maestro's clock
         self.__calibrate_time_to_nist()
         self.__initialize_tasks()  # populate task list
 
@@ -125,14 +126,18 @@ class ListenerWebsocket:
             time_since_1900 = unpacked_data[10]
             return time_since_1900 - 2208988800  # Convert to Unix epoch (1970)
 
-        response_time = None
-        while response_time is None:
+        self.__local_nist_offset = 0  # fall back to local clock until synced
+        for _ in range(self.NTP_ATTEMPTS):
             try:
                 response_time = get_ntp_time()
             except Exception:
-                pass  # Retry if there's an issue connecting to the NTP server
+                continue  # Retry if there's an issue connecting to the NTP server
+            self.__local_nist_offset = response_time - time.time()
+            break
 
-        self.__local_nist_offset = response_time - time.time()
+    def __sync_to_maestro(self, time_sync):
+        """Adopt the clock served by Maestro over the websocket"""
+        self.__local_nist_offset = time_sync["nist_time"] - time.time()
 
     def nist_time(self):
         return time.time() + self.__local_nist_offset
@@ -152,6 +157,8 @@ class ListenerWebsocket:
         finished = False
         while not finished:
             maestro = json.loads(await websocket.recv())
+            if "time_sync" in maestro:
+                self.__sync_to_maestro(maestro["time_sync"])
             if "task" in maestro:
                 await self.__process_task(maestro["task"], websocket)
             if "status" in maestro or len(self.recently_completed_tasks) > 0:
@@ -510,70 +517,41 @@ def run(protocol_context):
         listener.set_starting_tips()  # reset the starting tips since we just "used" one.
 
     ### run through the pre-experiment mixing
-    # identify the generation of the final incoming transfer per each well. We will mix after this move
-    final_generation = {}
-    for gen_idx, generation in enumerate(mixing_netlist):
-        for destination_strings in generation.values():
-            for destination_str in destination_strings.keys():
-                final_generation[destination_str] = gen_idx
-
-    # run through the mixing protocol
-    for gen_idx, generation in enumerate(mixing_netlist):
-        for source_str, destination_strings in generation.items():
-            source_labware, source_well = source_str.split("-")
-            source = labwares[source_labware][source_well]
-
-            destinations = []
-            volumes = []
-            is_last_transfer = []
-            for destination_str, volume in destination_strings.items():
-                destination_labware, destination_well = destination_str.split("-")
-                destinations.append(labwares[destination_labware][destination_well])
-                volumes.append(volume)
-                is_last_transfer.append(final_generation[destination_str] == gen_idx)
-
-            # original_speed = listener.pipettes["right"].speed
-            # listener.pipettes[
-            #     "right"
-            # ].speed = 100  # this is the speed we use during slow transfers
-            if gen_idx == 0:
-                # first generation, we dont need to worry about cross contamination
-
-                listener.pipettes["right"].transfer(
-                    volume=volumes,
-                    source=source,
-                    dest=destinations,
-                    disposal_volume=0,
-                    carryover=True,
-                    new_tip="once",
-                    blow_out=True,
-                    blow_out_location="source well",
-                    air_gap=20,
-                )
+    # mixing_netlist is a mixing route (see frgpascal/experimentaldesign/liquidrouting.py): generations of
+    # pipetting operations, each a single aspiration dispensed into one or more destinations
+    def get_well(location):
+        labware, well = location.split("-")
+        return labwares[labware][well]
+
+    p = listener.pipettes["right"]
+    for generation in mixing_netlist:
+        for operation in generation:
+            source = get_well(operation["source"])
+            destinations = [get_well(d) for d in operation["destinations"]]
+            volumes = operation["volumes"]
+
+            if operation["new_tip"]:
+                p.pick_up_tip()
+            if operation["mix_before"] is not None:
+                p.mix(*operation["mix_before"], source)
+            p.aspirate(sum(volumes), source)
+            air_gap = operation["air_gap"]
+            if air_gap > 0:
+                p.air_gap(air_gap)
+            for i, (destination, volume) in enumerate(zip(destinations, volumes)):
+                if i == 0:
+                    volume += air_gap  # air gap leaves the tip first
+                p.dispense(volume, destination.top())
+            if operation["mix_after"] is not None:
+                p.mix(*operation["mix_after"], destinations[-1])
+            if operation["blow_out"] == "source":
+                p.blow_out(source.top())
             else:
-                for dest, vol, last_transfer in zip(
-                    destinations, volumes, is_last_transfer
-                ):
-                    if last_transfer:
-                        mix_after = (
-                            5,
-                            50,
-                        )  # mix now that all liquid has reached the well
-                    else:
-                        mix_after = None
-                    listener.pipettes["right"].transfer(
-                        volume=vol,
-                        source=source,
-                        dest=dest,
-                        disposal_volume=0,
-                        mix_before=(3, 50),
-                        mix_after=mix_after,
-                        blow_out=True,
-                        blow_out_location="destination well",
-                        touch_tip=True,
-                        air_gap=20,
-                    )
-            # listener.pipettes["right"].speed = original_speed
+                p.blow_out(destinations[-1].top())
+            if operation["touch_tip"]:
+                p.touch_tip(destinations[-1])
+            if operation["drop_tip"]:
+                p.drop_tip()
 
     protocol_context.comment("Ready to receive commands from Maestro")
     if protocol_context.is_simulating():  # stop here during simulation
@@ -1,15 +1,18 @@
 import numpy as np
 import uuid
 import json
-import yaml
 from copy import deepcopy
+from functools import lru_cache
 import os
 import mixsol as mx
 from mixsol.helpers import components_to_name
-from frgpascal.system import generate_workers
+from frgpascal.system import get_planning_workers, TRANSITION_TASKS
 import roboflo
 
 from frgpascal.hardware import liquidhandler
+from frgpascal.hardware.helpers import load_hardware_constants, lazy_module_attributes
+from frgpascal.durationmodel import get_duration_model
+from frgpascal.experimentaldesign.liquidrouting import MixingRouter
 from frgpascal.workers import (
     Worker_GantryGripper,
     Worker_Characterization,
@@ -21,57 +24,63 @@ from frgpascal.experimentaldesign.characterizationtasks import CharacterizationT
 
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(
-    os.path.join(MODULE_DIR, "..", "hardware", "hardwareconstants.yaml"), "r"
-) as f:
-    HARDWARECONSTANTS = yaml.load(f, Loader=yaml.FullLoader)
-
-workers = generate_workers()
-ALL_TASKS = {
-    task: {
-        "workers": [worker]
-        + details.other_workers,  # list of workers required to perform task
-        "estimated_duration": details.estimated_duration,  # time (s) to complete task
+HARDWARECONSTANTS = load_hardware_constants()
+
+
+@lru_cache(maxsize=None)
+def get_all_tasks() -> dict:
+    """Tasks available to the planning workers, built on first use
+
+    Returns:
+        dict: {task name: {"workers": [...], "estimated_duration": seconds}}
+    """
+    return {
+        task: {
+            "workers": [worker]
+            + details.other_workers,  # list of workers required to perform task
+            "estimated_duration": details.estimated_duration,  # time (s) to complete task
+        }
+        for worker in get_planning_workers().values()
+        for task, details in worker.functions.items()
     }
-    for worker in workers.values()
-    for task, details in worker.functions.items()
-}
-
-# transition_tasks[source_worker][destination_worker] = Worker_GantryGripper task to move from source to destination
-TRANSITION_TASKS = {
-    Worker_SpincoaterLiquidHandler: {
-        Worker_Hotplate: "spincoater_to_hotplate",
-        Worker_Storage: "spincoater_to_storage",
-        Worker_Characterization: "spincoater_to_characterization",
-    },
-    Worker_Hotplate: {
-        Worker_SpincoaterLiquidHandler: "hotplate_to_spincoater",
-        Worker_Storage: "hotplate_to_storage",
-        Worker_Characterization: "hotplate_to_characterization",
-    },
-    Worker_Storage: {
-        Worker_SpincoaterLiquidHandler: "storage_to_spincoater",
-        Worker_Hotplate: "storage_to_hotplate",
-        Worker_Characterization: "storage_to_characterization",
-    },
-    Worker_Characterization: {
-        Worker_SpincoaterLiquidHandler: "characterization_to_spincoater",
-        Worker_Hotplate: "characterization_to_hotplate",
-        Worker_Storage: "characterization_to_storage",
+
+
+def get_available_tasks() -> dict:
+    hide_me = [
+        task for p1 in TRANSITION_TASKS.values() for task in p1.values()
+    ]  # user does not need to see transition tasks
+    return {
+        task: details
+        for task, details in get_all_tasks().items()
+        if task not in hide_me
+    }  # tasks to display to user
+
+
+# workers and task lists are built on first access rather than at import
+__getattr__ = lazy_module_attributes(
+    __name__,
+    {
+        "workers": get_planning_workers,
+        "ALL_TASKS": get_all_tasks,
+        "AVAILABLE_TASKS": get_available_tasks,
     },
-}
+)
 
-__hide_me = [
-    task for p1 in TRANSITION_TASKS.values() for task in p1.values()
-]  # user does not need to see transition tasks
-AVAILABLE_TASKS = {
-    task: details for task, details in ALL_TASKS.items() if task not in __hide_me
-}  # tasks to display to user
 
 ### Sample Class
 
 
 class Sample:
+    __slots__ = (
+        "name",
+        "substrate",
+        "storage_slot",
+        "worklist",
+        "status",
+        "tasks",
+        "protocol",
+    )  # no per-instance __dict__, keeps large sample lists small
+
     def __init__(
         self,
         name: str,
@@ -186,6 +195,21 @@ class Solution(mx.Solution):
 
 
 class Drop:
+    __slots__ = (
+        "solution",
+        "volume",
+        "time",
+        "rate",
+        "height",
+        "slow_retract",
+        "touch_tip",
+        "air_gap",
+        "pre_mix",
+        "reuse_tip",
+        "slow_travel",
+        "blow_out",
+    )
+
     def __init__(
         self,
         solution: Solution,
@@ -331,13 +355,16 @@ class Task(roboflo.Task):
         details: dict = {},
     ):
         self.sample = sample
-        if task not in ALL_TASKS:
+        all_tasks = get_all_tasks()
+        if task not in all_tasks:
             raise ValueError(f"Task {task} not in ALL_TASKS!")
         self.task = task
-        taskinfo = ALL_TASKS[task]
+        taskinfo = all_tasks[task]
         self.workers = taskinfo["workers"]
         if duration is None:
-            duration_ = taskinfo["estimated_duration"]
+            duration_ = get_duration_model().estimate(
+                task, default=taskinfo["estimated_duration"]
+            )  # learned from previous runs, if available
         else:
             duration_ = int(duration)
 
@@ -363,11 +390,20 @@ class Task(roboflo.Task):
         return isinstance(other, self.__class__) and (other.id == self.id)
 
     def __deepcopy__(self, memo):
+        """Copies are lightweight (flyweight) instances of the same task. The
+        step specification (spin steps, drops, solutions, characterization
+        tasks) is shared between copies and should be treated as immutable -
+        only the per-instance state (sample, precedent, workers, details,
+        scheduled times, id) belongs to each copy.
+        """
         cls = self.__class__
         result = cls.__new__(cls)
         memo[id(self)] = result
-        for k, v in self.__dict__.items():
-            setattr(result, k, deepcopy(v, memo))
+        result.__dict__.update(self.__dict__)
+        result.workers = list(self.workers)
+        result.details = dict(self.details)
+        result.sample = memo.get(id(self.sample), self.sample)
+        result.precedent = memo.get(id(self.precedent), self.precedent)
 
         result.__generate_taskid()  # give a unique id to the copied task
         return result
@@ -382,7 +418,8 @@ class Task(roboflo.Task):
         if self.sample is None:
             out["sample"] = "none"
         else:
-            out["sample"] = self.sample.name  # only change to roboflo Task.to_dict()
+            out["sample"] = self.sample.name
+        out["immediate"] = self.immediate  # needed to re-solve the schedule mid-run
 
         if self.precedent is None:
             out["precedent"] = None
@@ -435,7 +472,9 @@ class Mix(Task):
         raise ValueError(f"Solution {soln} not found in any labware")
 
     def _get_duration(self):
-        return 40 * len(self.inputs)  # for now assume 40 seconds per solution transfer
+        router = MixingRouter(labware=[*self.inputs_labware, self.destination_labware])
+        operations = router.single_transfers(self._generate_mixing_netlist())
+        return int(np.ceil(router.estimate_time([operations])))
 
     def _generate_mixing_netlist(self):
         return {
@@ -537,7 +576,9 @@ class Spincoat(Task):
             )
         elif len(drops) == 2:
             asp0, stage0, disp0 = liquidhandler.expected_timings(drops[0].to_dict())
-            asp1, stage1, disp1 = liquidhandler.expected_timings(drops[1].to_dict())
+            asp1, stage1, disp1 = liquidhandler.expected_timings(
+                drops[1].to_dict(), pipette="antisolvent"
+            )
             duration += max(
                 (asp0 + stage0 + disp0) + asp1 - self.drops[0].time,
                 0,
@@ -720,6 +761,10 @@ class Characterize(Task):
         for p0, p1 in zip(positions, positions[1:]):
             distance = np.abs(p1 - p0)
             self.duration += distance * m + b
+        self.estimated_duration = self.duration
+        self.duration = max(
+            self.duration + get_duration_model().residual("characterize"), 1
+        )  # correct the estimate by how far off it was in previous runs
 
         super().__init__(
             task="characterize",
@@ -730,6 +775,7 @@ class Characterize(Task):
     def to_dict(self):
         out = super().to_dict()
         out["duration"] = self.duration
+        out["estimated_duration"] = self.estimated_duration  # before correction
         out["details"] = {
             "characterization_tasks": [t.to_dict() for t in self.characterization_tasks]
         }
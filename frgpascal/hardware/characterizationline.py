@@ -1,4 +1,3 @@
-import serial
 import time
 import re
 import numpy as np
@@ -9,18 +8,20 @@ from abc import ABC, abstractmethod
 from tifffile import imwrite
 import csv
 import json
+from concurrent.futures import TimeoutError
 
-from frgpascal.hardware.helpers import get_port
+from frgpascal.hardware.helpers import get_port, load_hardware_constants
 from frgpascal.hardware.thorcam import Thorcam, ThorcamHost
 from frgpascal.hardware.spectrometer import Spectrometer
 from frgpascal.hardware.switchbox import SingleSwitch, Switchbox
 from frgpascal.hardware.shutter import Shutter
 from frgpascal.hardware.filterslider import FilterSlider
+from frgpascal.hardware.serialtransport import SerialTransport
+from frgpascal.hardware.geometry import check_calibration
 
 MODULE_DIR = os.path.dirname(__file__)
 CALIBRATION_DIR = os.path.join(MODULE_DIR, "calibrations")
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)["characterizationline"]
+constants = load_hardware_constants()["characterizationline"]
 
 
 ## Line Methods
@@ -102,19 +103,41 @@ class CharacterizationLine:
             ]
         }
 
+        self._lights_off = {
+            s.lightswitch.switchid: False
+            for s in self.stations.values()
+            if hasattr(s, "lightswitch")
+        }  # all station light sources off
+
         # state variables
         self._calibrated = False
 
+    def _set_lights(self, station=None):
+        """Set all light sources for a station in one switchbox transaction: the
+        lights the station declares on, every other light off.
+
+        Args:
+            station (CharacterizationStationTemplate, optional): station about to measure. Defaults to None (all lights off).
+        """
+        states = dict(self._lights_off)
+        if station is not None:
+            states.update(station.light_states)
+        self.switchbox.set_state(states)
+
     def run(self, samplename, details):
         """Pass a sample down the line and measure at each station"""
         folder = self._create_measurement_folder(samplename)
-        for task in details["characterization_tasks"]:
-            station = self.stations[task["name"]]
-            station.set_directory(folder)
-            self.axis.moveto(station.position)
-            station.run(
-                sample=samplename, **task["details"]
-            )  # combines measure + save methods
+        try:
+            for task in details["characterization_tasks"]:
+                station = self.stations[task["name"]]
+                station.set_directory(folder)
+                self.axis.moveto(station.position)
+                self._set_lights(station)
+                station.run(
+                    sample=samplename, **task["details"]
+                )  # combines measure + save methods
+        finally:
+            self._set_lights()  # never leave lamps on if a station fails
         self.axis.moveto(self.axis.TRANSFERPOSITION)
 
     def calibrate(self, netlist_fpath: str):
@@ -193,7 +216,10 @@ class CharacterizationAxis:
 
     # communication methods
     def connect(self):
-        self._handle = serial.Serial(port=self.port, timeout=1, baudrate=115200)
+        self._transport = SerialTransport(
+            port=self.port, baudrate=115200, resync_command="M400"
+        )
+        self._transport.connect()
         self.update()
         # self.update_gripper()
         if self.position == max(
@@ -204,8 +230,8 @@ class CharacterizationAxis:
         # self.write('M92 X40.0 Y26.77 Z400.0')
 
     def disconnect(self):
-        self._handle.close()
-        del self._handle
+        self._transport.disconnect()
+        del self._transport
 
     def __call__(self):
         """Calling the characterization axis object will return its gantry coordinates. For consistency with the callable nature of gridded hardware (storage, hotplate, etc)
@@ -234,6 +260,9 @@ class CharacterizationAxis:
         self.gantry.gui()
         self.coordinates = np.array(self.gantry.position)
         # self.gantry.moverel(z=10, zhop=False)
+        check_calibration(
+            "characterization axis", {"transfer": self.coordinates}, self.gantry
+        )
         self.__calibrated = True
         with open(
             os.path.join(CALIBRATION_DIR, f"characterizationaxis_calibration.yaml"), "w"
@@ -245,6 +274,9 @@ class CharacterizationAxis:
             os.path.join(CALIBRATION_DIR, f"characterizationaxis_calibration.yaml"), "r"
         ) as f:
             self.coordinates = np.array(yaml.load(f, Loader=yaml.FullLoader))
+        check_calibration(
+            "characterization axis", {"transfer": self.coordinates}, self.gantry
+        )
         self.__calibrated = True
 
     def set_defaults(self):
@@ -255,15 +287,7 @@ class CharacterizationAxis:
         # )  # set steps/mm, randomly resets to defaults sometimes idk why
 
     def write(self, msg):
-        self._handle.write(f"{msg}\n".encode())
-        time.sleep(self.POLLINGDELAY)
-        output = []
-        while self._handle.in_waiting:
-            line = self._handle.readline().decode("utf-8").strip()
-            if line != "ok":
-                output.append(line)
-            time.sleep(self.POLLINGDELAY)
-        return output
+        return self._transport.write(msg, timeout=self.TIMEOUT)
 
     def _enable_steppers(self):
         self.write("M17")
@@ -280,7 +304,7 @@ class CharacterizationAxis:
     # movement methods
 
     def gohome(self):
-        self.write("G28 X")
+        self._transport.write("G28 X")  # no timeout, homing can take a while
         self.update()
 
     def premove(self, x):
@@ -302,7 +326,7 @@ class CharacterizationAxis:
     def moveto(self, x: float):
         """internal command to execute a direct move from current location to new location"""
         if self.premove(x):
-            self.write(f"G0 X{x}")
+            self._transport.send(f"G0 X{x}")
             return self._waitformovement()
 
     def moverel(self, x=0):
@@ -318,34 +342,48 @@ class CharacterizationAxis:
         target position is not reached in time allotted by self.characterizationlineTIMEOUT
         """
         self.inmotion = True
-        start_time = time.time()
-        time_elapsed = time.time() - start_time
-        self._handle.write(f"M400\n".encode())
-        self._handle.write(f"M118 E1 FinishedMoving\n".encode())
+        deadline = time.time() + self.TIMEOUT
+        futures = []
         reached_destination = False
-        while not reached_destination and time_elapsed < self.TIMEOUT:
-            time.sleep(self.POLLINGDELAY)
-            while self._handle.in_waiting:
-                line = self._handle.readline().decode("utf-8").strip()
-                if line == "echo:FinishedMoving":
-                    self.update()
-                    if self.position - self.__targetposition < self.POSITIONTOLERANCE:
-                        reached_destination = True
+        try:
+            futures = self._transport.send_many(
+                ["M400", "M118 E1 FinishedMoving", "M114"], timeout=self.TIMEOUT
+            )  # position report is pipelined behind the move, no extra round trip
+            _, finished, report = futures
+            if "echo:FinishedMoving" in finished.result(
+                timeout=max(deadline - time.time(), 0)
+            ):
+                self.update(report.result(timeout=max(deadline - time.time(), 0)))
+                reached_destination = self._at_target()
+            while not reached_destination and time.time() < deadline:
                 time.sleep(self.POLLINGDELAY)
-            time_elapsed = time.time() - start_time
+                self.update()
+                reached_destination = self._at_target()
+        except TimeoutError:
+            if not all(f.done() for f in futures):
+                self._transport.resync()  # lost acknowledgement, later position reports would be off by one
 
         self.inmotion = False
         return reached_destination
 
-    def update(self):
-        found_coordinates = False
-        while not found_coordinates:
-            output = self.write("M114")  # get current position
-            for line in output:
-                if line.startswith("X:"):
-                    x = float(re.findall(r"X:(\S*)", line)[0])
-                    found_coordinates = True
-                    break
+    def _at_target(self):
+        return abs(self.position - self.__targetposition) < self.POSITIONTOLERANCE
+
+    def _parse_position(self, output):
+        for line in output:
+            if line.startswith("X:"):
+                return float(re.findall(r"X:(\S*)", line)[0])
+        return None
+
+    def update(self, output=None):
+        """Update the current position
+
+        Args:
+            output (list, optional): response to an M114 that was already sent, ie pipelined behind a move. If this does not contain a position report, a new M114 is sent. Defaults to None.
+        """
+        x = self._parse_position(output or [])
+        while x is None:
+            x = self._parse_position(self.write("M114"))  # get current position
         self.position = x
 
     def movetotransfer(self):
@@ -369,6 +407,9 @@ class CharacterizationStationTemplate(ABC):
         self.position = position
         self._rootdir = rootdir
         self.name = name
+        self.light_states = (
+            {}
+        )  # {switch: bool} required during measurement, set by CharacterizationLine on arrival
 
     def set_directory(self, rootdir):
         self.savedir = rootdir
@@ -399,6 +440,7 @@ class DarkfieldImaging(CharacterizationStationTemplate):
         super().__init__(position=position, rootdir=rootdir, name="Darkfield")
         self.camera = camera
         self.lightswitch = lightswitch
+        self.light_states = {lightswitch.switchid: True}
         self.DEFAULT_EXPOSURE_TIME = 0.05  # dwelltime, seconds
         self.DEFAULT_NUM_FRAMES = 50  # average 500 frames
 
@@ -408,7 +450,7 @@ class DarkfieldImaging(CharacterizationStationTemplate):
             "exposure_time", self.DEFAULT_EXPOSURE_TIME
         )
         self.camera.num_frames = kwargs.get("num_frames", self.DEFAULT_NUM_FRAMES)
-        self.lightswitch.on()
+        self.lightswitch.on()  # no-op if already set by CharacterizationLine
         img = self.camera.capture()
         self.lightswitch.off()
         self.camera.num_frames = 1
@@ -432,6 +474,7 @@ class PLImaging(CharacterizationStationTemplate):
         super().__init__(position=position, rootdir=rootdir, name="PLImaging")
         self.camera = camera
         self.lightswitch = lightswitch
+        self.light_states = {lightswitch.switchid: True}
         self.DEFAULT_EXPOSURE_TIMES = [
             0.05,
             0.2,
@@ -451,7 +494,7 @@ class PLImaging(CharacterizationStationTemplate):
         self.camera.num_frames = kwargs.get("num_frames", self.DEFAULT_NUM_FRAMES)
         imgs = {}
 
-        self.lightswitch.on()
+        self.lightswitch.on()  # no-op if already set by CharacterizationLine
         time.sleep(1)  # LED lamp takes a second to turn on
         for t in exposure_times:
             self.camera.exposure_time = t
@@ -481,6 +524,7 @@ class BrightfieldImaging(CharacterizationStationTemplate):
 
         self.camera = camera
         self.lightswitch = lightswitch
+        self.light_states = {lightswitch.switchid: True}
         self.DEFAULT_EXPOSURE_TIME = 0.05  # 50 ms dwell time
         self.DEFAULT_NUM_FRAMES = 1
 
@@ -489,7 +533,7 @@ class BrightfieldImaging(CharacterizationStationTemplate):
             "exposure_time", self.DEFAULT_EXPOSURE_TIME
         )
         self.camera.num_frames = kwargs.get("num_frames", self.DEFAULT_NUM_FRAMES)
-        self.lightswitch.on()
+        self.lightswitch.on()  # no-op if already set by CharacterizationLine
         img = self.camera.capture()
         self.lightswitch.off()
         return img
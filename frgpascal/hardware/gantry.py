@@ -1,21 +1,20 @@
-import serial
 import time
 import re
 import numpy as np
 import sys
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QGridLayout, QPushButton
 import PyQt5
-import yaml
 import os
 
 # from PyQt5.QtCore.Qt import AlignHCenter
 from functools import partial
-from frgpascal.hardware.helpers import get_port
+from concurrent.futures import TimeoutError
+from frgpascal.hardware.helpers import get_port, load_hardware_constants
+from frgpascal.hardware.serialtransport import SerialTransport
 
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)
+constants = load_hardware_constants()
 
 
 class Gantry:
@@ -76,7 +75,10 @@ class Gantry:
 
     # communication methods
     def connect(self):
-        self._handle = serial.Serial(port=self.port, timeout=1, baudrate=115200)
+        self._transport = SerialTransport(
+            port=self.port, baudrate=115200, resync_command="M400"
+        )
+        self._transport.connect()
         self.update()
         # self.update_gripper()
         if self.position == [
@@ -94,8 +96,8 @@ class Gantry:
         print("Connected to gantry")
 
     def disconnect(self):
-        self._handle.close()
-        del self._handle
+        self._transport.disconnect()
+        del self._transport
 
     def set_defaults(self):
         self.write("M501")  # load defaults from EEPROM
@@ -118,15 +120,7 @@ class Gantry:
         self.set_speed_percentage(100)  # set speed to 80% of max
 
     def write(self, msg):
-        self._handle.write(f"{msg}\n".encode())
-        time.sleep(self.POLLINGDELAY)
-        output = []
-        while self._handle.in_waiting:
-            line = self._handle.readline().decode("utf-8").strip()
-            if line != "ok":
-                output.append(line)
-            time.sleep(self.POLLINGDELAY)
-        return output
+        return self._transport.write(msg, timeout=self.GANTRYTIMEOUT)
 
     def _enable_steppers(self):
         self.write("M17")
@@ -134,18 +128,25 @@ class Gantry:
     def _disable_steppers(self):
         self.write("M18")
 
-    def update(self):
-        found_coordinates = False
-        while not found_coordinates:
-            output = self.write("M114")  # get current position
-            for line in output:
-                if line.startswith("X:"):
-                    x = float(re.findall(r"X:(\S*)", line)[0])
-                    y = float(re.findall(r"Y:(\S*)", line)[0])
-                    z = float(re.findall(r"Z:(\S*)", line)[0])
-                    found_coordinates = True
-                    break
-        self.position = [x, y, z]
+    def _parse_position(self, output):
+        for line in output:
+            if line.startswith("X:"):
+                x = float(re.findall(r"X:(\S*)", line)[0])
+                y = float(re.findall(r"Y:(\S*)", line)[0])
+                z = float(re.findall(r"Z:(\S*)", line)[0])
+                return [x, y, z]
+        return None
+
+    def update(self, output=None):
+        """Update the current position
+
+        Args:
+            output (list, optional): response to an M114 that was already sent, ie pipelined behind a move. If this does not contain a position report, a new M114 is sent. Defaults to None.
+        """
+        position = self._parse_position(output or [])
+        while position is None:
+            position = self._parse_position(self.write("M114"))  # get current position
+        self.position = position
         self.__currentframe = self._target_frame(*self.position)
         self.__ZLIM = (
             self.__FRAMES["opentrons"]["z_max"] - 3
@@ -164,7 +165,7 @@ class Gantry:
 
     def gohome(self):
         # self.movetoclear()
-        self.write("G28 X Y Z")
+        self._transport.write("G28 X Y Z")  # no timeout, homing can take a while
         self.update()
 
     def _target_frame(self, x, y, z):
@@ -188,14 +189,10 @@ class Gantry:
             return frame
         return "invalid"
 
-    def _transition_to_frame(self, target_frame):
-        self._movecommand(
-            x=self.position[0],
-            y=self.position[1],
-            z=self.__ZLIM,
-            speed=self.speed,
-        )  # move just in z
-
+    def _transition_path(self, target_frame, start=None):
+        """waypoints to move from start (defaults to the current position) into the target frame"""
+        if start is None:
+            start = self.position
         # nudge the gantry into the target frame
         x, y, z = self.TRANSITION_COORDINATES
         z = self.__ZLIM
@@ -203,12 +200,18 @@ class Gantry:
             x -= 0.2
         else:
             x += 0.2
-        self._movecommand(x, y, z, speed=self.speed)
+        return [
+            [start[0], start[1], self.__ZLIM],  # move just in z
+            [x, y, z],
+        ]
+
+    def _transition_to_frame(self, target_frame):
+        self.movepath(self._transition_path(target_frame), m400=False)
 
     def _move_below_opentrons_limits(self, x, y, z):
         self._movecommand(x, y, z, speed=self.speed)
 
-    def premove(self, x, y, z, zhop=True):
+    def premove(self, x, y, z, zhop=True, start=None):
         """
         checks to confirm that all target positions are valid
         """
@@ -216,43 +219,64 @@ class Gantry:
             raise Exception(
                 "Stage has not been homed! Home with self.gohome() before moving please."
             )
+        if start is None:
+            start = self.position
         if x is None:
-            x = self.position[0]
+            x = start[0]
         if y is None:
-            y = self.position[1]
+            y = start[1]
         if z is None:
-            z = self.position[2]
+            z = start[2]
 
-        # check if we are transitioning between workspace/gantry, if so, handle it
         target_frame = self._target_frame(x, y, z)
         if target_frame == "invalid":
             raise ValueError(f"Coordinate ({x}, {y}, {z}) is invalid!")
 
+        return x, y, z
+
+    def plan_moveto(self, x=None, y=None, z=None, zhop=True, start=None):
+        """Waypoints that .moveto() would travel through, without moving
+
+        Args:
+            x (float, optional): target x coordinate (mm). Defaults to None (stay at start x).
+            y (float, optional): target y coordinate (mm). Defaults to None (stay at start y).
+            z (float, optional): target z coordinate (mm). Defaults to None (stay at start z).
+            zhop (bool, optional): rise to the z ceiling before traversing. Defaults to True.
+            start (list, optional): [x,y,z] the path starts from. Defaults to the current position.
+
+        Returns:
+            list: [x,y,z] waypoints, ending at the target
+        """
+        if start is None:
+            start = self.position
+        x, y, z = self.premove(x, y, z, zhop, start)  # will error out if invalid move
+
+        if (x == start[0]) and (y == start[1]):
+            zhop = False  # no use zhopping for no lateral movement
+
+        if zhop:
+            waypoints = []
+            for target in [
+                (None, None, self.__ZLIM),
+                (x, y, self.__ZLIM),
+                (None, None, z),
+            ]:
+                waypoints += self.plan_moveto(
+                    *target, zhop=False, start=waypoints[-1] if waypoints else start
+                )
+            return waypoints
+
+        waypoints = []
+        # check if we are transitioning between workspace/gantry, if so, handle it
         # checks to see if current z is more than 5mm below opentrons limits
         # and same for y
         opentrons_z_max_limit = constants["gantry"]["opentrons_limits"]["z_max"] - 3
         opentrons_y_min_limit = 60
-        if self.__currentframe != target_frame and not zhop:
-            # if z > opentrons_z_max_limit:
-            #     z = opentrons_z_max_limit
-            # if y < opentrons_y_min_limit:
-            #     y = opentrons_y_min_limit
-            self._movecommand(
-                self.position[0],
-                self.position[1],
-                opentrons_z_max_limit,
-                speed=self.speed,
-                m400=True,
-            )
-            self._movecommand(
-                self.position[0],
-                opentrons_y_min_limit,
-                self.position[2],
-                speed=self.speed,
-                m400=True,
-            )
-
-        return x, y, z
+        if self._target_frame(*start) != self._target_frame(x, y, z):
+            waypoints.append([start[0], start[1], opentrons_z_max_limit])
+            waypoints.append([start[0], opentrons_y_min_limit, opentrons_z_max_limit])
+        waypoints.append([x, y, z])
+        return waypoints
 
     def moveto(self, x=None, y=None, z=None, zhop=True, speed=None, m400=False):
         """
@@ -263,28 +287,44 @@ class Gantry:
                 x, y, z = x  # split 3 coordinates into appropriate variables
         except:
             pass
-        x, y, z = self.premove(x, y, z, zhop)  # will error out if invalid move
+        waypoints = self.plan_moveto(x, y, z, zhop)
+        if len(waypoints) > 1:
+            m400 = True  # multi-segment paths are confirmed only once complete
+        return self.movepath(waypoints, speed=speed, m400=m400)
 
-        if speed is None:
-            speed = self.speed
-        if (x == self.position[0]) and (y == self.position[1]):
-            zhop = False  # no use zhopping for no lateral movement
+    def movepath(self, waypoints, speed=None, m400=True):
+        """Move through a sequence of waypoints as one queued motion. All segments
+        are sent to Marlin at once, so the planner blends them without stopping,
+        and arrival is confirmed once at the final waypoint.
 
-        # if self.position[2] > self.__ZLIM:
-        #     m400 = True
+        Args:
+            waypoints (list): [x,y,z] coordinates (mm) to move through, in order
+            speed (float, optional): mm/min. Defaults to self.speed.
+            m400 (bool, optional): wait for all motion to finish before confirming arrival. Defaults to True.
 
-        if zhop:
-            z_ceiling = max(self.position[2], z) + self.ZHOP_HEIGHT
-            z_ceiling = min(
-                z_ceiling, self.__ZLIM
-            )  # cant z-hop above build volume. mostly here for first move after homing.
+        Raises:
+            ValueError: a waypoint is outside of the accessible frames
 
-            self.moveto(z=self.__ZLIM, zhop=False, speed=speed, m400=m400)
-            self.moveto(x, y, self.__ZLIM, zhop=False, speed=speed, m400=m400)
-            self.moveto(z=z, zhop=False, speed=speed, m400=True)
+        Returns:
+            bool: whether the final waypoint was reached
+        """
+        if speed is None:
+            speed = self.speed
+        path = []
+        last = self.position
+        for waypoint in waypoints:
+            waypoint = [float(c) for c in waypoint]
+            if self._target_frame(*waypoint) == "invalid":
+                raise ValueError(f"Coordinate {waypoint} is invalid!")
+            if waypoint != last:  # skip segments with no movement
+                path.append(waypoint)
+                last = waypoint
+        if len(path) == 0:
+            return True  # already at target position
 
-        else:
-            self._movecommand(x, y, z, speed, m400)
+        self.__targetposition = path[-1]
+        self._transport.send_many([f"G0 X{x} Y{y} Z{z} F{speed}" for x, y, z in path])
+        return self._waitformovement(m400, timeout=self.GANTRYTIMEOUT * len(path))
 
     def movetoclear(self):
         self.moveto(self.CLEAR_COORDINATES)
@@ -294,13 +334,7 @@ class Gantry:
 
     def _movecommand(self, x: float, y: float, z: float, speed: float, m400=False):
         """internal command to execute a direct move from current location to new location"""
-        if self.position == [x, y, z]:
-            return True  # already at target position
-        else:
-            self.__targetposition = [x, y, z]
-            self.write(f"G0 X{x} Y{y} Z{z} F{speed}")
-
-            return self._waitformovement(m400)
+        return self.movepath([[x, y, z]], speed=speed, m400=m400)
 
     def moverel(self, x=0, y=0, z=0, zhop=False, speed=None):
         """
@@ -316,44 +350,53 @@ class Gantry:
         z += self.position[2]
         self.moveto(x, y, z, zhop, speed)
 
-    def _waitformovement(self, m400=False):
+    def _waitformovement(self, m400=False, timeout=None):
         """
         confirm that gantry has reached target position. returns False if
-        target position is not reached in time allotted by self.GANTRYTIMEOUT
+        target position is not reached in time allotted by timeout (defaults to self.GANTRYTIMEOUT)
         """
+        if timeout is None:
+            timeout = self.GANTRYTIMEOUT
         self.inmotion = True
-        start_time = time.time()
-        time_elapsed = time.time() - start_time
+        deadline = time.time() + timeout
+        commands = []
         if m400 is True:
-            self._handle.write(f"M400\n".encode())
-
-        self._handle.write(f"M118 E1 FinishedMoving\n".encode())
+            commands.append("M400")
+        commands += [
+            "M118 E1 FinishedMoving",
+            "M114",
+        ]  # position report is pipelined behind the move, no extra round trip
 
+        futures = []
         reached_destination = False
-        while not reached_destination and time_elapsed < self.GANTRYTIMEOUT:
-            time.sleep(self.POLLINGDELAY)
-            while self._handle.in_waiting:
-                line = self._handle.readline().decode("utf-8").strip()
-                if line == "echo:FinishedMoving":
-                    self.update()
-                    if (
-                        np.linalg.norm(
-                            [
-                                a - b
-                                for a, b in zip(self.position, self.__targetposition)
-                            ]
-                        )
-                        < self.POSITIONTOLERANCE
-                    ):
-                        reached_destination = True
-
+        try:
+            futures = self._transport.send_many(commands, timeout=timeout)
+            *_, finished, report = futures
+            if "echo:FinishedMoving" in finished.result(
+                timeout=max(deadline - time.time(), 0)
+            ):
+                self.update(report.result(timeout=max(deadline - time.time(), 0)))
+                reached_destination = self._at_target()
+            while not reached_destination and time.time() < deadline:
                 time.sleep(self.POLLINGDELAY)
+                self.update()
+                reached_destination = self._at_target()
+        except TimeoutError:
+            if not all(f.done() for f in futures):
+                self._transport.resync()  # lost acknowledgement, later position reports would be off by one
 
-        self.inmotion = ~reached_destination
-        self.update()
+        self.inmotion = not reached_destination
 
         return reached_destination
 
+    def _at_target(self):
+        return (
+            np.linalg.norm(
+                [a - b for a, b in zip(self.position, self.__targetposition)]
+            )
+            < self.POSITIONTOLERANCE
+        )
+
     # GUI
     def gui(self):
         GantryGUI(gantry=self)  # opens blocking gui to manually jog motors
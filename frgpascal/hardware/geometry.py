@@ -1,6 +1,5 @@
 import numpy as np
 import os
-import matplotlib.pyplot as plt
 
 ### https://stackoverflow.com/questions/15457786/ctrl-c-crashes-python-after-importing-scipy-stats
 os.environ["FOR_DISABLE_CONSOLE_CTRL_HANDLER"] = (
@@ -10,12 +9,12 @@ os.environ["FOR_DISABLE_CONSOLE_CTRL_HANDLER"] = (
 from scipy.interpolate import LinearNDInterpolator
 from frgpascal.hardware.gantry import Gantry
 from frgpascal.hardware.gripper import Gripper
+from frgpascal.hardware.helpers import load_hardware_constants
 import yaml
 
 MODULE_DIR = os.path.dirname(__file__)
 CALIBRATION_DIR = os.path.join(MODULE_DIR, "calibrations")
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)
+constants = load_hardware_constants()
 
 
 class CoordinateMapper:
@@ -33,14 +32,51 @@ class CoordinateMapper:
         self.zinterp = LinearNDInterpolator(self.destination[:, :2], self.source[:, 2])
 
     def map(self, p):
-        if len(p) == 2:
-            p = list(p)
-            p.append(0)
-        p = np.asarray(p, dtype=float)
-        p[2] = self.zinterp(p[:2])
-        pmap = p - self.xyoffset
+        return self.map_many([p])[0]
 
-        return pmap
+    def map_many(self, points):
+        """Transform many points at once
+
+        Args:
+            points (array-like): (n,2) or (n,3) points in destination coordinates. z values are ignored
+
+        Returns:
+            np.ndarray: (n,3) points in source coordinates
+        """
+        p = np.zeros((len(points), 3))
+        p[:, :2] = [tuple(point)[:2] for point in points]
+        p[:, 2] = self.zinterp(p[:, :2])  # one interpolator call for all points
+        return p - self.xyoffset
+
+
+def check_calibration(name: str, coordinates: dict, gantry: Gantry = None):
+    """Verify that calibrated gantry coordinates are usable, so a bad calibration
+    fails on load rather than mid-experiment
+
+    Args:
+        name (str): name of the calibrated hardware, for error messages
+        coordinates (dict): {slot name: (x,y,z) gantry coordinates}
+        gantry (Gantry, optional): if provided, coordinates are also checked against the gantry's accessible frames. Defaults to None.
+
+    Raises:
+        ValueError: coordinate is nan (usually from rounding errors on calibration .yamls) or outside of the accessible frames
+    """
+    nans = [slot for slot, p in coordinates.items() if np.any(np.isnan(p))]
+    if len(nans) > 0:
+        raise ValueError(
+            f"{name} calibration transformed {nans} into nan! Check for rounding errors on calibration .yamls"
+        )
+    if gantry is None:
+        return
+    out_of_frame = [
+        slot
+        for slot, p in coordinates.items()
+        if gantry._target_frame(*p) == "invalid"
+    ]
+    if len(out_of_frame) > 0:
+        raise ValueError(
+            f"{name} calibration places {out_of_frame} outside of the gantry's accessible frames!"
+        )
 
 
 def map_coordinates(name, slots, points, gantry: Gantry, z_clearance=5):
@@ -188,15 +224,19 @@ class Workspace:
                 self._openslots.sort()
                 # self._coordinates[name] = [p + poffset for p, poffset in zip(relative_position, self.offset)]
 
+    def _build_coordinate_table(self):
+        """Map every slot into gantry coordinates once, after each calibration"""
+        slots = list(self._coordinates.keys())
+        table = dict(
+            zip(slots, self.transform.map_many([self._coordinates[s] for s in slots]))
+        )
+        check_calibration(self.name, table, self.gantry)
+        self._gantry_coordinates = table
+
     def slot_coordinates(self, name):
         if self.__calibrated == False:
             raise Exception(f"Need to calibrate {self.name} before use!")
-        coords = self.transform.map(self._coordinates[name])
-        if any(np.isnan(coords)):
-            raise Exception(
-                "Coordinate was transformed into nan! Check for rounding errors on calibration .yamls"
-            )
-        return self.transform.map(self._coordinates[name])
+        return self._gantry_coordinates[name].copy()
 
     def __call__(self, name):
         return self.slot_coordinates(name)
@@ -216,6 +256,7 @@ class Workspace:
             self.gantry,
             self.z_clearance,
         )
+        self._build_coordinate_table()
         self.__calibrated = True
         self.GRIPPERTIMEOUT = constants["gripper"][
             "idle_timeout"
@@ -233,6 +274,7 @@ class Workspace:
         ) as f:
             pts = yaml.load(f, Loader=yaml.FullLoader)
         self.transform = CoordinateMapper(p0=pts["p0"], p1=pts["p1"])
+        self._build_coordinate_table()
         self.__calibrated = True
 
     def load(self, contents) -> str:
@@ -284,6 +326,8 @@ class Workspace:
         """
         plot current contents of the labware
         """
+        import matplotlib.pyplot as plt
+
         if ax is None:
             fig, ax = plt.subplots()
             ax.set_aspect("equal")
@@ -1,15 +1,14 @@
 # from termios import error
 import time
 import numpy as np
-import yaml
-from frgpascal.hardware.helpers import get_port
+from frgpascal.hardware.helpers import get_port, load_hardware_constants
 import os
-import serial
 import threading
+from concurrent.futures import TimeoutError
+from frgpascal.hardware.serialtransport import SerialTransport
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)
+constants = load_hardware_constants()
 
 
 class Gripper:
@@ -42,6 +41,7 @@ class Gripper:
         self.MINWIDTH = constants["gripper"]["width_min"]
         self.SLOWGRIPPERINTERVAL = constants["gripper"]["slow_interval"]
         self.FASTGRIPPERINTERVAL = constants["gripper"]["fast_interval"]
+        self.ACKNOWLEDGEMENTTIMEOUT = 2  # max time (s) for the arduino to acknowledge a command
 
         self.currentwidth = self.MINWIDTH
         self.currentpwm = self.MINPWM
@@ -51,44 +51,47 @@ class Gripper:
         # self.write(f"S{self.MINPWM} {self.SLOWGRIPPERINTERVAL}")
 
     def connect(self):
-        self._handle = serial.Serial(port=self.port, timeout=1, baudrate=115200)
+        self._transport = SerialTransport(port=self.port, baudrate=115200)
+        self._transport.connect()
         time.sleep(3)  # takes a few seconds for connection to establish
         self.__start_gripper_timeout_watchdog()
         print("Connected to gripper")
 
     def disconnect(self):
         self.__stop_gripper_timeout_watchdog()
-        self._handle.close()
-        del self._handle
+        self._transport.disconnect()
+        del self._transport
 
     def write(self, msg):
         """
         writes a message to the arduino.
         In the event of an error, resets the connection and tries again
         Three tries max, then throws error
+
+        Returns:
+            Future: resolves once the arduino acknowledges the command
         """
         with self._lock:
             for i in range(3):  # 3 tries
                 try:
-                    self._handle.write(f"{msg}\n".encode())
-                    return
+                    return self._transport.send(
+                        msg, timeout=self.ACKNOWLEDGEMENTTIMEOUT
+                    )
                 except:
                     self.disconnect()
                     self.connect()
                 time.sleep(self.POLLINGDELAY)
         raise Exception("Could not talk to gripper")
 
-    def _waitformovement(self):
-        # return
-        readline = ""
-        time0 = time.time()
-        while readline != "ok":
-            if time.time() - time0 > 2:  # self.GRIPPERTIMEOUT:
-                raise ValueError("Gripper timed out during movement")
-            if self._handle.in_waiting > 0:
+    def _waitformovement(self, command):
+        """wait for the arduino to acknowledge a movement command, returned by self.write()"""
+        try:
+            command.result(timeout=self.ACKNOWLEDGEMENTTIMEOUT)
+        except TimeoutError:
+            if not command.done():
                 with self._lock:
-                    readline = self._handle.readline().decode("utf-8").strip()
-            time.sleep(self.POLLINGDELAY)
+                    self._transport.resync()  # lost "ok", later acknowledgements would resolve the wrong command
+            raise ValueError("Gripper timed out during movement")
 
     # gripper methods
     def open(self, width=None, slow=False):
@@ -104,15 +107,13 @@ class Gripper:
             rate = self.SLOWGRIPPERINTERVAL
         else:
             rate = self.FASTGRIPPERINTERVAL
-        self.write(f"S{pwm} {rate}")
-        self._waitformovement()
+        self._waitformovement(self.write(f"S{pwm} {rate}"))
         self.__gripper_last_opened = time.time()
         self.currentwidth = width
         self.currentpwm = pwm
 
     def open_pwm(self, pwm):
-        self.write(f"S{pwm} {self.FASTGRIPPERINTERVAL}")
-        self._waitformovement()
+        self._waitformovement(self.write(f"S{pwm} {self.FASTGRIPPERINTERVAL}"))
         self.__gripper_last_opened = time.time()
         self.currentwidth = self.__pwm_to_width(pwm)
         self.currentpwm = pwm
@@ -130,8 +131,7 @@ class Gripper:
 
         rate = self.SLOWGRIPPERINTERVAL
         # for i,value in enumerate(values):
-        self.write(f"S{value} {rate}")
-        self._waitformovement()
+        self._waitformovement(self.write(f"S{value} {rate}"))
         self.__gripper_last_opened = time.time()
         pwm = value
         self.currentpwm = pwm
@@ -142,11 +142,15 @@ class Gripper:
         """
         self.open(width=self.MINWIDTH, slow=slow)
 
+    def get_load(self):
+        """read the load on the gripper servo"""
+        with self._lock:
+            self._transport.write_unacknowledged("l")
+            return float(self._transport.readline(timeout=1))
+
     def is_under_load(self):
         time.sleep(0.5)  # wait for gripper to complete motion
-        self.write("l")
-        with self._lock:
-            load = float(self._handle.readline())
+        load = self.get_load()
         # print(load)
         if load > self.LOADTHRESHOLD:
             return True
@@ -1,7 +1,48 @@
-import serial.tools.list_ports as lp
+import os
 import sys
 import subprocess
 import re
+import time
+import yaml
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+MODULE_DIR = os.path.dirname(__file__)
+
+startup_step = namedtuple("startup_step", ["function", "dependencies", "timeout"])
+
+
+@lru_cache(maxsize=None)
+def load_hardware_constants() -> dict:
+    """Read hardwareconstants.yaml. The file is only read once per process, so treat
+    the returned dictionary as read-only.
+
+    Returns:
+        dict: hardware constants
+    """
+    with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def lazy_module_attributes(module_name: str, attributes: dict):
+    """Module level `__getattr__` that builds attributes on first access rather
+    than at import, ie `__getattr__ = lazy_module_attributes(__name__, {...})`
+
+    Args:
+        module_name (str): __name__ of the module
+        attributes (dict): {attribute name: function that returns its value}
+
+    Returns:
+        function: the module's `__getattr__`
+    """
+
+    def __getattr__(name):
+        if name in attributes:
+            return attributes[name]()
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+
+    return __getattr__
 
 
 def which_os():
@@ -17,6 +58,8 @@ def which_os():
 
 
 def _get_port_windows(device_identifiers):
+    import serial.tools.list_ports as lp
+
     for p in lp.comports():
         match = True
         for attr, value in device_identifiers.items():
@@ -31,6 +74,8 @@ def _get_port_linux(serial_number):
     """
     finds port number for a given hardware serial number
     """
+    import serial.tools.list_ports as lp
+
     for p in lp.comports():
         if p.serial_number and p.serial_number == serial_number:
             return p.device
@@ -85,3 +130,95 @@ def get_ot2_ip():
     except Exception as e:
         print(f"Error retrieving IP address: {e}")
         return None
+
+
+def run_startup_graph(steps: dict, max_workers: int = None):
+    """Run device startup steps concurrently, respecting dependencies between them
+
+    Each step is called with the results of its dependencies as positional arguments,
+    as soon as all of its dependencies have succeeded. Steps that raise, exceed their
+    timeout, or depend on a failed step are reported as failed. A step that times out
+    is abandoned, not killed - its thread is left to finish in the background.
+
+    Args:
+        steps (dict): {name: startup_step(function, dependencies, timeout)}. timeout (seconds) can be None to wait indefinitely.
+        max_workers (int, optional): max number of steps to run at once. Defaults to one thread per step.
+
+    Raises:
+        ValueError: a step depends on an undefined step, or dependencies are circular
+
+    Returns:
+        dict: {name: result} for steps that succeeded
+        dict: {name: exception} for steps that failed
+    """
+    for name, step in steps.items():
+        for dep in step.dependencies:
+            if dep not in steps:
+                raise ValueError(f"Startup step {name} depends on undefined step {dep}!")
+
+    results = {}
+    errors = {}
+    timings = {}
+    waiting = dict(steps)
+    running = {}  # future: (name, start time)
+    executor = ThreadPoolExecutor(max_workers=max_workers or max(len(steps), 1))
+    t0 = time.time()
+
+    while waiting or running:
+        # skip steps whose dependencies failed, start steps whose dependencies are met
+        for name, step in list(waiting.items()):
+            failed = [dep for dep in step.dependencies if dep in errors]
+            if failed:
+                errors[name] = RuntimeError(f"dependencies failed: {failed}")
+                del waiting[name]
+            elif all(dep in results for dep in step.dependencies):
+                args = [results[dep] for dep in step.dependencies]
+                future = executor.submit(step.function, *args)
+                running[future] = (name, time.time())
+                del waiting[name]
+        if not running:
+            if waiting:
+                raise ValueError(
+                    f"Circular dependencies between startup steps: {list(waiting)}"
+                )
+            break
+
+        # wait for the next step to finish or time out
+        now = time.time()
+        deadlines = [
+            start + steps[name].timeout - now
+            for name, start in running.values()
+            if steps[name].timeout is not None
+        ]
+        done, _ = wait(
+            running,
+            timeout=max(min(deadlines), 0) if deadlines else None,
+            return_when=FIRST_COMPLETED,
+        )
+        now = time.time()
+        for future, (name, start) in list(running.items()):
+            if future in done:
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+            elif steps[name].timeout is not None and now - start >= steps[name].timeout:
+                errors[name] = TimeoutError(
+                    f"did not finish within {steps[name].timeout} s"
+                )
+            else:
+                continue
+            timings[name] = now - start
+            del running[future]
+    executor.shutdown(wait=False)
+
+    # timing report
+    print(f"Startup finished in {time.time() - t0:.1f} s:")
+    for name in steps:
+        if name in results:
+            print(f"\t{name}: {timings[name]:.1f} s")
+        elif name in timings:
+            print(f"\t{name}: FAILED after {timings[name]:.1f} s ({errors[name]})")
+        else:
+            print(f"\t{name}: SKIPPED ({errors[name]})")
+    return results, errors
@@ -1,37 +1,16 @@
 import serial
 import numpy as np
-
-# from pydlcp import errors
-import time
-import os
-import yaml
-import logging
-import configparser
-from typing import List
-from frgpascal.hardware.geometry import Workspace
-from frgpascal.hardware.gantry import Gantry
-from frgpascal.hardware.gripper import Gripper
-
-MODULE_DIR = os.path.dirname(__file__)
-HOTPLATE_VERSIONS_DIR = os.path.join(MODULE_DIR, "versions", "hotplates")
-AVAILABLE_VERSIONS = {
-    os.path.splitext(f)[0]: os.path.join(HOTPLATE_VERSIONS_DIR, f)
-    for f in os.listdir(HOTPLATE_VERSIONS_DIR)
-    if ".yaml" in f
-}
-
-from matplotlib.pyplot import hot
-import serial
-import numpy as np
 import os
+import time
 import yaml
 from typing import List
-from threading import Lock
+from threading import Lock, Thread, Event
 
 from frgpascal.hardware.geometry import Workspace
 from frgpascal.hardware.gantry import Gantry
 from frgpascal.hardware.gripper import Gripper
-from frgpascal.hardware.helpers import get_port
+from frgpascal.hardware.helpers import get_port, load_hardware_constants
+from frgpascal.hardware.timesync import get_clock
 
 MODULE_DIR = os.path.dirname(__file__)
 HOTPLATE_VERSIONS_DIR = os.path.join(MODULE_DIR, "versions", "hotplates")
@@ -40,8 +19,8 @@ AVAILABLE_VERSIONS = {
     for f in os.listdir(HOTPLATE_VERSIONS_DIR)
     if ".yaml" in f
 }
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    hotplateconstants = yaml.load(f, Loader=yaml.FullLoader)["hotplates"]
+hotplateconstants = load_hardware_constants()["hotplates"]
+telemetryconstants = load_hardware_constants()["hotplate_telemetry"]
 
 
 def available_versions(self):
@@ -134,6 +113,25 @@ class Omega:
 
         return data
 
+    def get_state(self):
+        """Read temperature and setpoint in a single transaction
+
+        Returns:
+            tuple: (temperature, setpoint), both in C
+        """
+        numWords = 2  # registers 1000 (process value) + 1001 (setpoint)
+
+        payload = self.__build_payload(
+            address=self.address, command=3, dataAddress=1000, content=numWords
+        )
+        response = self.query(payload)
+
+        data = response[7:-4]  # 4 hex characters per register
+        temperature = int(data[0:4], 16) * 0.1  # response given in 0.1 C
+        setpoint = int(data[4:8], 16) * 0.1
+
+        return round(temperature, 2), round(setpoint, 2)
+
     def set_setpoint(self, setpoint):
         setpoint = round(setpoint * 10)  # need to give integer values of 0.1 C
 
@@ -223,6 +221,124 @@ class Omega:
         return payload
 
 
+class HotplateTelemetry:
+    """Records hotplate temperature + setpoint in a background thread.
+
+    Readings are kept in a fixed size ring buffer for slicing out traces (ie
+    for a single anneal), and optionally appended to a csv file so the full
+    run is preserved. The serial port is only held for one transaction per
+    reading, so other threads can still talk to the hotplate.
+    """
+
+    def __init__(self, controller: Omega, interval: float = None, capacity: int = None):
+        """
+        Args:
+            controller (Omega): hotplate temperature controller
+            interval (float, optional): seconds between readings. Defaults to hardwareconstants.yaml > hotplate_telemetry > interval.
+            capacity (int, optional): readings kept in memory. Defaults to hardwareconstants.yaml > hotplate_telemetry > capacity.
+        """
+        self.controller = controller
+        self.clock = get_clock()
+        self.INTERVAL = (
+            telemetryconstants["interval"] if interval is None else interval
+        )
+        self.CAPACITY = (
+            telemetryconstants["capacity"] if capacity is None else capacity
+        )
+        self._buffer = np.full(
+            (self.CAPACITY, 3), np.nan
+        )  # nist time (s), temperature (C), setpoint (C)
+        self._count = 0  # total readings, buffer index is count % capacity
+        self._lock = Lock()
+        self._logfile = None
+        self._stop = Event()
+        self._thread = None
+
+    ### Recording
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self.__worker, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.close_logfile()
+
+    def __worker(self):
+        while not self._stop.is_set():
+            try:
+                temperature, setpoint = self.controller.get_state()
+            except Exception:
+                temperature, setpoint = np.nan, np.nan  # missed reading, keep polling
+            self._record(self.clock.nist_time(), temperature, setpoint)
+            self._stop.wait(self.INTERVAL)
+
+    def _record(self, t, temperature, setpoint):
+        with self._lock:
+            self._buffer[self._count % self.CAPACITY] = (t, temperature, setpoint)
+            self._count += 1
+            if self._logfile is not None:
+                self._logfile.write(f"{t:.2f},{temperature:.1f},{setpoint:.1f}\n")
+
+    def set_logfile(self, filepath: str):
+        """Append every reading to a csv file
+
+        Args:
+            filepath (str): path to the csv file
+        """
+        self.close_logfile()
+        new = not os.path.exists(filepath)
+        with self._lock:
+            self._logfile = open(filepath, "a", buffering=1)  # line buffered
+            if new:
+                self._logfile.write("nist_time,temperature,setpoint\n")
+
+    def close_logfile(self):
+        with self._lock:
+            if self._logfile is not None:
+                self._logfile.close()
+                self._logfile = None
+
+    ### Access
+    @property
+    def latest(self):
+        """(nist time, temperature, setpoint) of the most recent reading, or None if nothing has been read yet"""
+        with self._lock:
+            if self._count == 0:
+                return None
+            return tuple(self._buffer[(self._count - 1) % self.CAPACITY])
+
+    def history(self) -> np.ndarray:
+        """All readings in memory, oldest first
+
+        Returns:
+            np.ndarray: (n,3) array of nist time (s), temperature (C), setpoint (C)
+        """
+        with self._lock:
+            if self._count <= self.CAPACITY:
+                return self._buffer[: self._count].copy()
+            idx = self._count % self.CAPACITY
+            return np.concatenate([self._buffer[idx:], self._buffer[:idx]])
+
+    def trace(self, t_start: float, t_end: float) -> np.ndarray:
+        """Readings between two times
+
+        Args:
+            t_start (float): nist time (s)
+            t_end (float): nist time (s)
+
+        Returns:
+            np.ndarray: (n,3) array of nist time (s), temperature (C), setpoint (C)
+        """
+        history = self.history()
+        mask = (history[:, 0] >= t_start) & (history[:, 0] <= t_end)
+        return history[mask]
+
+
 class HotPlate(Workspace):
     def __init__(
         self,
@@ -246,6 +362,10 @@ class HotPlate(Workspace):
             self.controller._set_PIDchannel(
                 4
             )  # auto select PID settings based on setpoint
+            self.telemetry = HotplateTelemetry(self.controller)
+            self.telemetry.start()
+        else:
+            self.telemetry = None
 
         xmean = np.mean([p[0] for p in self._coordinates.values()])
         ymean = np.mean([p[1] for p in self._coordinates.values()])
@@ -272,6 +392,13 @@ class HotPlate(Workspace):
             for slot, p in self._coordinates.items()
         }
 
+    def disconnect(self):
+        """Stop recording telemetry and release the temperature controller"""
+        if self.telemetry is not None:
+            self.telemetry.stop()  # otherwise keeps polling the closed port
+        if hasattr(self, "controller"):
+            self.controller.disconnect()
+
     def get_open_slot(self):
         if len(self.emptyslots) == 0:
             raise ValueError("No empty slots!")
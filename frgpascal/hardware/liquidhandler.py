@@ -1,51 +1,35 @@
 import numpy as np
 import asyncio
 import time
-import ntplib
 import json
 import os
-import yaml
-import websockets
 import threading
 import uuid
 import logging
+from .timesync import get_clock
+from .helpers import load_hardware_constants
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)["liquidhandler"]
+constants = load_hardware_constants()["liquidhandler"]
 
 tc = constants["timings"]
 
 
-def expected_timings(drop):
-    """Estimate the duration (seconds) liquid aspiration will require for a given drop
+def expected_timings(drop, pipette="perovskite"):
+    """Estimate the durations (seconds) of the aspiration, staging and dispense of a given drop.
+    Uses the timings learned from previous runs where available (see
+    frgpascal/liquidhandlertimings.py), otherwise the constants in hardwareconstants.yaml
 
     Args:
         drop (dict): dictionary of drop parameters
+        pipette (str, optional): "perovskite" (first drop) or "antisolvent" (second drop). Defaults to "perovskite".
 
     Returns:
-        float: duration, in seconds
+        tuple: (aspirate, staging, dispense) durations in seconds
     """
-    ac = tc["aspirate"]  # aspiration constants
-    aspirate_duration = ac["preparetip"] + drop["volume"] / 100 + tc["travel"]
-    aspirate_duration += drop["pre_mix"][0] * (
-        ac["premix"]["a"] * drop["pre_mix"][1] + ac["premix"]["b"]
-    )  # overhead time for aspirate+dispense cycles to mix solution prior to final aspiration
-    if drop["touch_tip"]:
-        aspirate_duration += ac["touchtip"]
-    if drop["slow_retract"]:
-        aspirate_duration += ac["slowretract"]
-    if drop["air_gap"]:
-        aspirate_duration += ac["airgap"]
-
-    if drop["slow_travel"]:
-        staging_duration = tc["travel_slow"]
-        dispense_duration = tc["dispensedelay_slow"]
-    else:
-        staging_duration = tc["travel"]
-        dispense_duration = tc["dispensedelay"]
-
-    return aspirate_duration, staging_duration, dispense_duration
+    from frgpascal.liquidhandlertimings import get_liquidhandler_timing_model
+
+    return get_liquidhandler_timing_model().expected_timings(drop, pipette=pipette)
 
 
 class OT2:
@@ -192,33 +176,31 @@ class OT2:
 
 class OT2Server:
     def __init__(self):
-        self.__calibrate_time_to_nist()
+        self.clock = get_clock()
         self.connected = False
         self.ip = constants["server"]["ip"]
         self.port = constants["server"]["port"]
         self.pending_tasks = []
         self.completed_tasks = {}
+        self.requested_times = {}  # {taskid: requested nist time}, to learn timings against completed_tasks
         self.POLLINGRATE = 1  # seconds between status checks to OT2
         self.loop = asyncio.new_event_loop()
 
     ### Time Synchronization with NIST
-    def __calibrate_time_to_nist(self):
-        client = ntplib.NTPClient()
-        response = None
-        while response is None:
-            try:
-                response = client.request("europe.pool.ntp.org", version=3)
-            except:
-                pass
-        t_local = time.time()
-        self.__local_nist_offset = response.tx_time - t_local
-
     @property
     def nist_time(self):
-        return time.time() + self.__local_nist_offset
+        return self.clock.nist_time()
+
+    async def __send_time_sync(self):
+        """Serve the shared clock to the OT2, so it does not need its own NTP sync"""
+        await self.websocket.send(
+            json.dumps({"time_sync": {"nist_time": self.nist_time}})
+        )
 
     ### Server Methods
     async def __connect_to_websocket(self):
+        import websockets
+
         try:
             del self.websocket
         except:
@@ -226,6 +208,7 @@ class OT2Server:
         self.websocket = await websockets.connect(
             self.uri, ping_interval=20, ping_timeout=300
         )
+        await self.__send_time_sync()
 
     def start(self, ip=None, port=None):
         if ip is not None:
@@ -319,6 +302,8 @@ class OT2Server:
         self.completed_tasks.update(tasklist)
 
     async def worker(self):
+        import websockets
+
         while self.connected:
             try:
                 response = await asyncio.wait_for(self.websocket.recv(), timeout=0.5)
@@ -355,6 +340,7 @@ class OT2Server:
 
         if nist_time is None:
             nist_time = self.nist_time
+        self.requested_times[taskid] = nist_time
 
         task = {
             "task": {
@@ -0,0 +1,259 @@
+import serial
+import time
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future, TimeoutError
+from queue import Queue, Empty
+
+pending_command = namedtuple("pending_command", ["command", "future", "output"])
+
+
+class SerialTransport:
+    """Owns the serial port to a line-based firmware (Marlin, gripper arduino).
+
+    A background thread reads every line the device sends. Commands are
+    acknowledged in the order they were sent, so each "ok" resolves the oldest
+    pending command's future with the lines (position reports, echoes, etc.)
+    received since the previous acknowledgement. Several commands can be
+    written back to back without waiting on each other (pipelining), up to the
+    number of lines the firmware can buffer. Lines that arrive while no
+    command is pending are kept for `.readline()`.
+
+    If an acknowledgement is lost (ie firmware reset), every later "ok" would
+    resolve the wrong command. So when a command times out, all pending
+    commands are failed and the transport resynchronizes with the device, see
+    `.resync()`.
+    """
+
+    def __init__(
+        self,
+        port,
+        baudrate=115200,
+        acknowledgement="ok",
+        max_pending=4,
+        resync_command=None,
+        resync_timeout=60,
+    ):
+        """
+        Args:
+            port (str): serial port of the device
+            baudrate (int, optional): Defaults to 115200.
+            acknowledgement (str, optional): line the firmware sends once a command has been processed. Defaults to "ok".
+            max_pending (int, optional): max unacknowledged commands in flight. Marlin buffers 4 commands by default (BUFSIZE). Defaults to 4.
+            resync_command (str, optional): command acknowledged only once the device has finished everything before it (ie "M400" for Marlin), used with an M118 echo to resynchronize after a lost acknowledgement. Defaults to None (reconnect instead).
+            resync_timeout (float, optional): seconds to wait for the resync command. Defaults to 60.
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.ACKNOWLEDGEMENT = acknowledgement
+        self.MAX_PENDING = max_pending
+        self.RESYNC_COMMAND = resync_command
+        self.RESYNC_TIMEOUT = resync_timeout
+        self.connected = False
+
+        self._pending = deque()  # pending_command's awaiting acknowledgement, oldest first
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps write order == pending order
+        self._slots = threading.Semaphore(self.MAX_PENDING)
+        self._unsolicited = Queue()
+        self._reader = None
+        self._resyncs = 0  # numbers the resync markers, so each is unique
+        self._resync_marker = None  # echo that ends the current resync
+        self._resync_echoed = False
+        self._resynced = threading.Event()
+
+    ### Connection
+    def connect(self):
+        # short timeout only bounds how long the reader takes to notice a disconnect,
+        # readline returns as soon as a full line arrives
+        self._handle = serial.Serial(port=self.port, timeout=0.1, baudrate=self.baudrate)
+        self.connected = True
+        self._reader = threading.Thread(target=self.__read_worker, daemon=True)
+        self._reader.start()
+
+    def disconnect(self):
+        self.connected = False
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        self._handle.close()
+        del self._handle
+        self.__fail_pending(ConnectionError(f"Disconnected from {self.port}"))
+
+    ### Reading
+    def __read_worker(self):
+        while self.connected:
+            try:
+                raw = self._handle.readline()
+            except serial.SerialException as e:
+                self.connected = False
+                self.__fail_pending(e)
+                return
+            line = raw.decode("utf-8", errors="replace").strip()
+            if line == "":
+                continue
+            self.__route(line)
+
+    def __is_acknowledgement(self, line) -> bool:
+        # Marlin ADVANCED_OK appends line/buffer info, ie "ok N12 P15 B3"
+        return line == self.ACKNOWLEDGEMENT or line.startswith(
+            self.ACKNOWLEDGEMENT + " "
+        )
+
+    def __route(self, line):
+        with self._pending_lock:
+            acknowledgement = self.__is_acknowledgement(line)
+            if self._resync_marker is not None:
+                # resynchronizing, drop everything (ie late acknowledgements of failed commands)
+                # up to the marker echo and the acknowledgement of the echo command
+                if line == f"echo:{self._resync_marker}":
+                    self._resync_echoed = True
+                elif acknowledgement and self._resync_echoed:
+                    self._resync_marker = None
+                    self._resynced.set()
+                return
+            if len(self._pending) == 0:
+                if not acknowledgement:  # stray ok's carry no information
+                    self._unsolicited.put(line)
+                return
+            if not acknowledgement:
+                self._pending[0].output.append(line)
+                return
+            command = self._pending.popleft()
+        self._slots.release()
+        command.future.set_result(command.output)
+
+    def __fail_pending(self, exception):
+        with self._pending_lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        for command in pending:
+            self._slots.release()
+            command.future.set_exception(exception)
+
+    def resync(self):
+        """Recover from a lost acknowledgement. Fails every pending command, then
+        waits until the device has caught up, or reconnects if there is no resync
+        command or the device does not respond to it.
+
+        The resync command is followed by an echo of a unique marker
+        ("M118 E1 RESYNC<n>"). Every line up to the marker is discarded, so a
+        late acknowledgement of a failed command cannot be mistaken for the
+        device catching up.
+        """
+        with self._write_lock:  # no new commands until resynchronized
+            self.__fail_pending(
+                TimeoutError(f"Lost acknowledgement from {self.port}, resynchronizing")
+            )
+            if self.RESYNC_COMMAND is not None:
+                self._resyncs += 1
+                marker = f"RESYNC{self._resyncs}"
+                with self._pending_lock:
+                    self._resync_marker = marker
+                    self._resync_echoed = False
+                    self._resynced.clear()
+                self._handle.write(f"{self.RESYNC_COMMAND}\n".encode())
+                self._handle.write(f"M118 E1 {marker}\n".encode())
+                if self._resynced.wait(timeout=self.RESYNC_TIMEOUT):
+                    return
+                with self._pending_lock:
+                    self._resync_marker = None
+            print(f"Could not resynchronize with {self.port}, reconnecting")
+            self.disconnect()
+            self.connect()
+
+    ### Writing
+    def send(self, msg: str, timeout: float = None) -> Future:
+        """Send a command without waiting for it to complete
+
+        Args:
+            msg (str): command, without line terminator
+            timeout (float, optional): seconds to wait for room in the firmware's command buffer. Defaults to None (wait forever).
+
+        Raises:
+            TimeoutError: pending commands were not acknowledged within timeout. The transport is resynchronized before raising.
+
+        Returns:
+            Future: resolves to a list of lines the device sent in response, not including the acknowledgement
+        """
+        if not self._slots.acquire(
+            timeout=timeout
+        ):  # wait for room in the firmware's command buffer
+            self.resync()
+            raise TimeoutError(
+                f"{self.port} did not acknowledge pending commands within {timeout} seconds"
+            )
+        return self.__send(msg)
+
+    def __send(self, msg: str) -> Future:
+        """write a command, caller must have acquired a slot"""
+        command = pending_command(msg, Future(), [])
+        with self._write_lock:
+            with self._pending_lock:
+                self._pending.append(command)
+            self._handle.write(f"{msg}\n".encode())
+        return command.future
+
+    def send_many(self, msgs: list, timeout: float = None) -> list:
+        """Pipeline several commands to the device
+
+        Args:
+            msgs (list): commands, in order of execution
+            timeout (float, optional): seconds to wait for room in the firmware's command buffer, per command. Defaults to None (wait forever).
+
+        Returns:
+            list: Futures, one per command
+        """
+        return [self.send(msg, timeout=timeout) for msg in msgs]
+
+    def write(self, msg: str, timeout: float = None) -> list:
+        """Send a command and wait for it to be acknowledged
+
+        Args:
+            msg (str): command, without line terminator
+            timeout (float, optional): seconds to wait for acknowledgement. Defaults to None (wait forever).
+
+        Raises:
+            TimeoutError: command was not acknowledged within timeout
+
+        Returns:
+            list: lines the device sent in response, not including the acknowledgement
+        """
+        start = time.time()
+        future = self.send(msg, timeout=timeout)
+        remaining = None
+        if timeout is not None:
+            remaining = max(timeout - (time.time() - start), 0)
+        try:
+            return future.result(timeout=remaining)
+        except TimeoutError:
+            if future.done():
+                raise  # failed by a resync or disconnect, not by waiting
+            self.resync()
+            raise TimeoutError(
+                f"{self.port} did not acknowledge {msg} within {timeout} seconds"
+            )
+
+    def write_unacknowledged(self, msg: str):
+        """Send a command that the firmware does not acknowledge. Any response is read with `.readline()`"""
+        with self._write_lock:
+            while not self._unsolicited.empty():  # drop stale lines, ie startup messages
+                self._unsolicited.get_nowait()
+            self._handle.write(f"{msg}\n".encode())
+
+    def readline(self, timeout: float = None) -> str:
+        """Next line received while no command was pending
+
+        Args:
+            timeout (float, optional): seconds to wait for a line. Defaults to None (wait forever).
+
+        Raises:
+            TimeoutError: no line received within timeout
+
+        Returns:
+            str: line, stripped of whitespace
+        """
+        try:
+            return self._unsolicited.get(timeout=timeout)
+        except Empty:
+            raise TimeoutError(f"No response from {self.port} within {timeout} seconds")
@@ -1,5 +1,4 @@
-import yaml
-from frgpascal.hardware.helpers import get_port
+from frgpascal.hardware.helpers import get_port, load_hardware_constants
 import os
 import serial
 import time
@@ -8,8 +7,7 @@ from warnings import warn
 # https://github.com/cdbaird/TL-rotation-control/blob/759dc3fc58efd975c37c7ee954fa6152618cd58e/elliptec/rotation.py
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)["characterizationline"]["shutter"]
+constants = load_hardware_constants()["characterizationline"]["shutter"]
 
 
 class Shutter:
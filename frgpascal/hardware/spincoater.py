@@ -6,19 +6,24 @@ import numpy as np
 import os
 import yaml
 import threading
-from frgpascal.hardware.helpers import get_port
+import ctypes
+from collections import namedtuple
+from concurrent.futures import Future
+from frgpascal.hardware.helpers import get_port, load_hardware_constants
 from frgpascal.hardware.gantry import Gantry
+from frgpascal.hardware.geometry import check_calibration
 from frgpascal.hardware.switchbox import SingleSwitch
 from datetime import datetime
 
 MODULE_DIR = os.path.dirname(__file__)
 CALIBRATION_DIR = os.path.join(MODULE_DIR, "calibrations")
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.Loader)
+constants = load_hardware_constants()
 
 # spincoater_serial_number = constants["spincoater"]["serialid"]
 # print(constants["spincoater"])
 
+profile_step = namedtuple("profile_step", ["time", "rpm", "acceleration"])
+
 
 class SpinCoater:
     def __init__(self, gantry: Gantry, switch: SingleSwitch):
@@ -59,8 +64,18 @@ class SpinCoater:
         self.__calibrated = False
         # logging
         self.__logging_active = False
-        self.__logdata = {"time": [], "rpm": []}
         self.LOGGINGINTERVAL = constants["spincoater"]["logging_interval"]
+        self.LOGGINGCAPACITY = constants["spincoater"][
+            "logging_capacity"
+        ]  # samples kept per log, oldest are overwritten past this
+        self.__logbuffer = np.full(
+            (self.LOGGINGCAPACITY, 2), np.nan
+        )  # time (s), rpm. preallocated so logging does not allocate per sample
+        self.__logcount = 0  # total samples, buffer index is count % capacity
+        self.logdir = None  # folder spin logs are saved to
+        self.PROFILE_SPIN_WINDOW = constants["spincoater"][
+            "profile_spin_window"
+        ]  # seconds before a spin profile transition to stop sleeping and spin-wait
 
         self.VACUUM_DISENGAGEMENT_TIME = constants["spincoater"][
             "vacuum_disengagement_time"
@@ -137,6 +152,7 @@ class SpinCoater:
         self.gantry.gui()
         self.coordinates = self.gantry.position
         # self.gantry.moverel(z=10, zhop=False)
+        check_calibration("spincoater", {"chuck": self.coordinates}, self.gantry)
         self.__calibrated = True
         with open(
             os.path.join(CALIBRATION_DIR, f"spincoater_calibration.yaml"), "w"
@@ -148,6 +164,7 @@ class SpinCoater:
             os.path.join(CALIBRATION_DIR, f"spincoater_calibration.yaml"), "r"
         ) as f:
             self.coordinates = np.array(yaml.load(f, Loader=yaml.FullLoader))
+        check_calibration("spincoater", {"chuck": self.coordinates}, self.gantry)
         self.__calibrated = True
 
     def __call__(self):
@@ -174,13 +191,7 @@ class SpinCoater:
         self.switch.off()
 
     # odrive BLDC motor control methods
-    def set_rpm(self, rpm: int, acceleration: float = 1000):
-        """sends commands to arduino to set a target speed with a target acceleration
-
-        Args:
-                        rpm (int): target angular velocity, in rpm
-                        acceleration (float, optional): target angular acceleration, in rpm/second.  Defaults to 500.
-        """
+    def _check_rpm(self, rpm, acceleration):
         if rpm != 0 and (rpm < self.SPEEDRANGE[0] or rpm > self.SPEEDRANGE[1]):
             raise ValueError(
                 f"RPM out of range. Must be between {self.SPEEDRANGE[0]} and {self.SPEEDRANGE[1]}"
@@ -193,6 +204,24 @@ class SpinCoater:
                 f"Acceleration out of range. Must be between {self.ACCELERATIONRANGE[0]} and {self.ACCELERATIONRANGE[1]}"
             )
 
+    def _velocity_control(self):
+        """put the odrive in ramped velocity control mode"""
+        if self.axis.current_state != AXIS_STATE_CLOSED_LOOP_CONTROL:
+            self.axis.requested_state = AXIS_STATE_CLOSED_LOOP_CONTROL
+
+        self.axis.controller.config.control_mode = CONTROL_MODE_VELOCITY_CONTROL
+        self.axis.controller.config.input_mode = INPUT_MODE_VEL_RAMP
+        self._locked = False
+
+    def set_rpm(self, rpm: int, acceleration: float = 1000):
+        """sends commands to arduino to set a target speed with a target acceleration
+
+        Args:
+                        rpm (int): target angular velocity, in rpm
+                        acceleration (float, optional): target angular acceleration, in rpm/second.  Defaults to 500.
+        """
+        self._check_rpm(rpm, acceleration)
+
         rps = int(rpm / 60)  # convert rpm to rps for odrive
         acceleration = int(acceleration / 60)  # convert rpm/s to rps/s for odrive
         self.axis.controller.config.vel_ramp_rate = acceleration
@@ -202,14 +231,93 @@ class SpinCoater:
 
         # if acceleration == 0:
         #     acceleration = self.ACCELERATIONRANGE[1]  # default to max acceleration
-        if self.axis.current_state != AXIS_STATE_CLOSED_LOOP_CONTROL:
-            self.axis.requested_state = AXIS_STATE_CLOSED_LOOP_CONTROL
+        self._velocity_control()
+        self._current_rps = rps
 
-        self.axis.controller.config.control_mode = CONTROL_MODE_VELOCITY_CONTROL
-        self.axis.controller.config.input_mode = INPUT_MODE_VEL_RAMP
+    # spin profile execution
+    def plan_profile(self, steps: list, start_time: float) -> list:
+        """Precompute the rpm/acceleration timeline of a spincoating recipe
 
-        self._current_rps = rps
-        self._locked = False
+        Args:
+                        steps (list): recipe steps, dicts with "rpm", "acceleration" (rpm/s) and "duration" (seconds)
+                        start_time (float): time (on the clock used to execute the profile) at which the first step begins
+
+        Returns:
+                        list: profile_step's, one per recipe step plus a final stop at the end of the recipe
+        """
+        profile = []
+        t = start_time
+        for step in steps:
+            self._check_rpm(step["rpm"], step["acceleration"])
+            profile.append(profile_step(t, step["rpm"], step["acceleration"]))
+            t += step["duration"]
+        profile.append(profile_step(t, 0, 1000))  # bring the rotor to a halt
+        return profile
+
+    def run_profile(self, steps: list, start_time: float, clock=None) -> Future:
+        """Execute a spincoating recipe from a dedicated timing thread
+
+        The full timeline is planned before the thread starts, and every transition is
+        a single pair of writes to the odrive at its scheduled time. The thread sleeps
+        until just before each transition, then spin-waits on the high resolution
+        performance counter to hit the transition precisely.
+
+        Args:
+                        steps (list): recipe steps, dicts with "rpm", "acceleration" (rpm/s) and "duration" (seconds)
+                        start_time (float): time (on clock) at which the first step begins
+                        clock (callable, optional): returns the current time on the clock start_time refers to. Defaults to time.time.
+
+        Returns:
+                        Future: resolves to a list of dicts, one per transition, with the scheduled
+                                        + actual transition times (on clock) and the timing error (seconds)
+        """
+        if clock is None:
+            clock = time.time
+        profile = self.plan_profile(steps, start_time)
+        self.axis.controller.input_vel = 0  # hold still until the first step
+        self._velocity_control()
+
+        # reference the schedule to the performance counter once, so clock resyncs
+        # during the recipe cannot shift the step boundaries
+        offset = clock() - time.perf_counter()
+        future = Future()
+        thread = threading.Thread(
+            target=self.__profile_worker, args=(profile, offset, future), daemon=True
+        )
+        thread.start()
+        return future
+
+    def __profile_worker(self, profile, offset, future):
+        _raise_thread_priority()
+        record = []
+        try:
+            for step in profile:
+                target = step.time - offset  # perf_counter time of this transition
+                remaining = target - time.perf_counter()
+                if remaining > self.PROFILE_SPIN_WINDOW:
+                    time.sleep(remaining - self.PROFILE_SPIN_WINDOW)
+                while time.perf_counter() < target:
+                    pass
+                t_actual = time.perf_counter()
+                rps = int(step.rpm / 60)  # convert rpm to rps for odrive
+                self.axis.controller.config.vel_ramp_rate = int(step.acceleration / 60)
+                self.axis.controller.input_vel = rps
+                t_sent = time.perf_counter()
+                self._current_rps = rps
+                record.append(
+                    {
+                        "rpm": step.rpm,
+                        "acceleration": step.acceleration,
+                        "scheduled": step.time,
+                        "actual": t_actual + offset,
+                        "sent": t_sent + offset,
+                        "error": t_actual - target,
+                    }
+                )
+        except Exception as e:
+            future.set_exception(e)
+            return
+        future.set_result(record)
 
     def lock(self):
         """
@@ -295,30 +403,89 @@ class SpinCoater:
                 return err
 
     # logging code
-    def __logging_worker(self):
-        t0 = time.time()
-        self.__logdata = {"time": [], "rpm": []}
+    def __logging_worker(self, offset):
+        t_next = time.perf_counter()
         while self.__logging_active:
             if self.__connected:
-                self.__logdata["time"].append(time.time() - t0)
-                self.__logdata["rpm"].append(
-                    self.axis.encoder.vel_estimate * 60
-                )  # rps from odrive -> rpm
-            time.sleep(self.LOGGINGINTERVAL)
+                t = time.perf_counter() + offset
+                rpm = self.axis.encoder.vel_estimate * 60  # rps from odrive -> rpm
+                self.__logbuffer[self.__logcount % self.LOGGINGCAPACITY] = (t, rpm)
+                self.__logcount += 1
+            t_next += self.LOGGINGINTERVAL  # fixed rate, read time does not accumulate
+            delay = t_next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                t_next = time.perf_counter()  # fell behind, do not try to catch up
+
+    def start_logging(self, t0: float = None, clock=None):
+        """Start logging the rotor speed in a background thread
 
-    def start_logging(self):
+        Args:
+                        t0 (float, optional): time (on clock) logged times are relative to. Defaults to now.
+                        clock (callable, optional): returns the current time on the clock t0 refers to. Defaults to time.time.
+        """
         if self.__logging_active:
             raise ValueError("Logging is already active!")
+        if clock is None:
+            clock = time.time
+        if t0 is None:
+            t0 = clock()
+        offset = clock() - t0 - time.perf_counter()  # perf_counter -> seconds since t0
+        self.__logcount = 0
         self.__logging_active = True
-        self.__logging_thread = threading.Thread(target=self.__logging_worker)
+        self.__logging_thread = threading.Thread(
+            target=self.__logging_worker, args=(offset,), daemon=True
+        )
         self.__logging_thread.start()
 
-    def finish_logging(self):
+    def finish_logging(self) -> dict:
+        """Stop logging the rotor speed
+
+        Returns:
+                        dict: {"time": seconds since t0, "rpm": rotor speed}, numpy arrays oldest first
+        """
         if not self.__logging_active:
             raise ValueError("Logging is already stopped!")
         self.__logging_active = False
         self.__logging_thread.join()
-        return self.__logdata
+        if self.__logcount <= self.LOGGINGCAPACITY:
+            log = self.__logbuffer[: self.__logcount].copy()
+        else:
+            idx = self.__logcount % self.LOGGINGCAPACITY
+            log = np.concatenate([self.__logbuffer[idx:], self.__logbuffer[:idx]])
+        return {"time": log[:, 0], "rpm": log[:, 1]}
+
+    def set_directory(self, filepath):
+        self.logdir = filepath
+        if not os.path.exists(self.logdir):
+            os.makedirs(self.logdir)
+
+    def save_log(self, name: str, log: dict, transitions: list = None) -> str:
+        """Save a spin log as a compressed numpy file in the log directory
+
+        Args:
+                        name (str): file name, without extension
+                        log (dict): output of .finish_logging()
+                        transitions (list, optional): spin profile transitions from .run_profile(). Defaults to None.
+
+        Returns:
+                        str: path to the saved file
+        """
+        if self.logdir is None:
+            raise ValueError("No log directory set, call .set_directory() first!")
+        arrays = {"time": log["time"], "rpm": log["rpm"]}
+        if transitions is not None:
+            arrays["transitions"] = np.array(
+                [
+                    (t["scheduled"], t["actual"], t["rpm"], t["acceleration"])
+                    for t in transitions
+                ],
+                dtype=float,
+            ).reshape(-1, 4)  # scheduled (s), actual (s), rpm, acceleration (rpm/s)
+        filepath = os.path.join(self.logdir, f"{name}.npz")
+        np.savez_compressed(filepath, **arrays)
+        return filepath
 
     def __libfibre_timer_worker(self):
         """To prevent libfibre timers from accumulating, inducing global interpreter lock (GIL)
@@ -354,3 +521,63 @@ class SpinCoater:
 
     def __del__(self):
         self.disconnect()
+
+
+def load_spin_log(filepath: str) -> dict:
+    """Load a spin log saved by SpinCoater.save_log
+
+    Args:
+                    filepath (str): path to the .npz file
+
+    Returns:
+                    dict: {"time", "rpm"} arrays, plus "transitions" (n,4) array of scheduled (s), actual (s), rpm, acceleration (rpm/s) if recorded
+    """
+    with np.load(filepath) as f:
+        return {k: f[k] for k in f.files}
+
+
+def rpm_tracking_error(log: dict, transitions: list) -> list:
+    """Summarize how well the rotor held the target speed of each spin profile step
+
+    Only samples after the expected ramp to the step's rpm (at the step's acceleration)
+    are counted, so the ramp itself does not count as tracking error.
+
+    Args:
+                    log (dict): output of SpinCoater.finish_logging()
+                    transitions (list): spin profile transitions from SpinCoater.run_profile(), on the same time base as the log
+
+    Returns:
+                    list: one dict per step (excluding the final stop) with the target rpm, mean rpm, mean + rms error (rpm) and number of samples. Statistics are None if the rotor never settled within the step.
+    """
+    t = np.asarray(log["time"])
+    rpm = np.asarray(log["rpm"])
+    summary = []
+    previous_rpm = 0
+    for step, next_step in zip(transitions[:-1], transitions[1:]):
+        ramp = abs(step["rpm"] - previous_rpm) / step["acceleration"]
+        mask = (t >= step["actual"] + ramp) & (t < next_step["actual"])
+        error = rpm[mask] - step["rpm"]
+        settled = mask.sum() > 0
+        summary.append(
+            {
+                "rpm": step["rpm"],
+                "mean_rpm": float(rpm[mask].mean()) if settled else None,
+                "mean_error": float(error.mean()) if settled else None,
+                "rms_error": float(np.sqrt((error ** 2).mean())) if settled else None,
+                "samples": int(mask.sum()),
+            }
+        )
+        previous_rpm = step["rpm"]
+    return summary
+
+
+def _raise_thread_priority():
+    """Best effort to raise the priority of the calling thread, so it is scheduled promptly at spin profile transitions"""
+    try:
+        kernel32 = ctypes.windll.kernel32  # WINDOWS ONLY
+        THREAD_PRIORITY_TIME_CRITICAL = 15
+        kernel32.SetThreadPriority(
+            kernel32.GetCurrentThread(), THREAD_PRIORITY_TIME_CRITICAL
+        )
+    except Exception:
+        pass
@@ -1,21 +1,24 @@
 import numpy as np
-import yaml
 import os
+import re
 import serial
 from functools import partial
-from .helpers import get_port
+from .helpers import get_port, load_hardware_constants
 import time
 from threading import Lock
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(os.path.join(MODULE_DIR, "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)["characterizationline"]
+constants = load_hardware_constants()["characterizationline"]
 
 
 class Switchbox:
     """Interfaces with numato 16 relay board to toggle relays for
     characterization hardware (relays, light sources, shutters, etc)
 
+    The state of all relays is tracked, so any number of switches can be changed
+    with a single `relay writeall` command, and commands that would not change
+    any relay are skipped.
+
     https://numato.com/product/16-channel-usb-relay-module/
     """
 
@@ -51,46 +54,108 @@ class Switchbox:
         self._lock = (
             Lock()
         )  # to prevent multiple workers from talking to switchbox simultaneously
+        self._mask = None  # current relay states, bit n = relay n. None if unknown
         self.connect()
 
     def connect(self):
         self._handle = serial.Serial(port=self.port, timeout=5)
+        self._mask = self._read_mask()
+        if self._mask is None:
+            self.all_off()  # start from a known state
         print("Connected to characterization switchbox")
 
+    def _read_mask(self):
+        """Read the current state of all relays
+
+        Returns:
+            int: relay states, bit n = relay n. None if the response could not be parsed
+        """
+        with self._lock:
+            self._handle.reset_input_buffer()
+            self._handle.write(b"relay readall\n\r")
+            response = self._handle.read_until(b">").decode("utf-8", errors="ignore")
+        match = re.search(r"^\s*([0-9A-Fa-f]{4})\s*$", response, re.MULTILINE)
+        if match is None:
+            return None
+        return int(match.group(1), 16)
+
+    def _write_mask(self, mask: int):
+        """write all relay states at once. Caller must hold self._lock"""
+        self._handle.write(f"relay writeall {mask:04X}\n\r".encode())
+        self._mask = mask
+        time.sleep(self.RELAYRESPONSETIME)
+
     def _get_relay(self, switch):
         if switch not in self._relay_key:
             raise ValueError(f"Switch {switch} does not exist!")
         else:
             return self._relay_key[switch]
 
-    def off(self, switch: int):
+    def set_state(self, states: dict) -> bool:
+        """Set any number of switches in one transaction. Switches not included keep their current state.
+
+        Args:
+            states (dict): {switch: True (HIGH) or False (LOW)}
+
+        Returns:
+            bool: True if any relay changed, False if the switchbox was already in this state
+        """
+        bits = {
+            switch: 1 << int(self._get_relay(switch), 16) for switch in states
+        }  # validate switches before touching the relays
+        with self._lock:  # read-modify-write, so concurrent callers do not clobber each other's relays
+            mask = self._mask or 0
+            for switch, state in states.items():
+                if state:
+                    mask |= bits[switch]
+                else:
+                    mask &= ~bits[switch]
+            if mask == self._mask:
+                return False  # nothing to change
+            self._write_mask(mask)
+        return True
+
+    def get_state(self, switch) -> bool:
+        """current state of a switch
+
+        Args:
+            switch (int): index of switch
+
+        Returns:
+            bool: True if HIGH, False if LOW, None if unknown
+        """
+        if self._mask is None:
+            return None
+        return bool(self._mask & (1 << int(self._get_relay(switch), 16)))
+
+    def off(self, switch: int) -> bool:
         """sets a switch LOW
 
         Args:
             switch (int): index of switch to adjust
+
+        Returns:
+            bool: True if the relay changed state
         """
-        relay = self._get_relay(switch)
-        with self._lock:
-            self._handle.write(f"relay off {relay}\n\r".encode())
-        time.sleep(self.RELAYRESPONSETIME)
+        return self.set_state({switch: False})
 
-    def on(self, switch: int):
+    def on(self, switch: int) -> bool:
         """sets a switch HIGH
 
         Args:
             switch (int): index of switch to adjust
+
+        Returns:
+            bool: True if the relay changed state
         """
-        relay = self._get_relay(switch)
-        with self._lock:
-            self._handle.write(f"relay on {relay}\n\r".encode())
-        time.sleep(self.RELAYRESPONSETIME)
+        return self.set_state({switch: True})
 
     def all_off(self):
         """
         sets all relays low
         """
-        for relay in self._relay_key:
-            self.off(relay)  # turn all relays off to start
+        with self._lock:
+            self._write_mask(0)
 
     def Switch(self, switch: int):
         """Returns a SingleSwitch object that controls single switch state
@@ -108,8 +173,12 @@ class SingleSwitch:
         self.switchid = switchid
         self.switchbox = switchbox
 
+    @property
+    def state(self):
+        return self.switchbox.get_state(self.switchid)
+
     def on(self):
-        self.switchbox.on(self.switchid)
+        return self.switchbox.on(self.switchid)
 
     def off(self):
-        self.switchbox.off(self.switchid)
+        return self.switchbox.off(self.switchid)
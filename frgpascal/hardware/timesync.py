@@ -0,0 +1,146 @@
+import time
+from threading import Thread, Lock
+from warnings import warn
+from .helpers import load_hardware_constants
+
+constants = load_hardware_constants()["timesync"]
+
+
+class TimeSync:
+    """Shared clock referenced to an NTP server (NIST time).
+
+    A single sync is performed on startup with a bounded number of requests. Periodic
+    background resyncs track the drift of the local clock relative to the reference,
+    so `nist_time()` stays accurate between syncs. If the NTP server cannot be reached,
+    the local clock is used (with a warning) until a later resync succeeds.
+    """
+
+    def __init__(
+        self, server=None, timeout=None, attempts=None, resync_interval=None
+    ):
+        self.server = server or constants["server"]
+        self.TIMEOUT = timeout or constants["timeout"]  # seconds per NTP request
+        self.ATTEMPTS = attempts or constants["attempts"]  # NTP requests per sync
+        self.RESYNC_INTERVAL = (
+            resync_interval or constants["resync_interval"]
+        )  # seconds between background resyncs
+        self.HISTORY = constants["history"]  # number of syncs used to fit drift
+
+        self._lock = Lock()
+        self._history = []  # (local time, offset) for recent successful syncs
+        self._offset = 0  # seconds, reference - local at self._t_ref
+        self._drift = 0  # seconds of offset change per second of local time
+        self._t_ref = time.time()
+        self.synced = False
+        self.last_sync = None  # local time of last successful sync
+        self.__resync_thread = None
+
+    ### Synchronization
+    def _request_offset(self):
+        """Query the NTP server once
+
+        Returns:
+            float: offset (seconds) between the NTP server and local clock, or None if the request failed
+        """
+        import ntplib
+
+        client = ntplib.NTPClient()
+        try:
+            response = client.request(self.server, version=3, timeout=self.TIMEOUT)
+        except Exception:
+            return None
+        return response.offset  # corrects for round trip delay
+
+    def sync(self):
+        """Sync to the NTP server, updating the drift model
+
+        Returns:
+            bool: True if the sync succeeded
+        """
+        offset = None
+        for _ in range(self.ATTEMPTS):
+            offset = self._request_offset()
+            if offset is not None:
+                break
+        if offset is None:
+            if not self.synced:
+                warn(
+                    f"Could not reach NTP server {self.server} - falling back to local clock!"
+                )
+            return False
+        self.set_offset(offset)
+        return True
+
+    def set_offset(self, offset, t_local=None):
+        """Record a measured offset between the reference and local clocks
+
+        Args:
+            offset (float): seconds, reference time - local time
+            t_local (float, optional): local time at which the offset was measured. Defaults to now.
+        """
+        if t_local is None:
+            t_local = time.time()
+        with self._lock:
+            self._history.append((t_local, offset))
+            self._history = self._history[-self.HISTORY :]
+            self._fit_drift()
+            self.synced = True
+            self.last_sync = t_local
+
+    def _fit_drift(self):
+        """Least squares fit of offset vs local time over recent syncs"""
+        n = len(self._history)
+        t_mean = sum(t for t, _ in self._history) / n
+        o_mean = sum(o for _, o in self._history) / n
+        var = sum((t - t_mean) ** 2 for t, _ in self._history)
+        if n < 2 or var == 0:
+            self._drift = 0
+        else:
+            cov = sum((t - t_mean) * (o - o_mean) for t, o in self._history)
+            self._drift = cov / var
+        self._t_ref = t_mean
+        self._offset = o_mean
+
+    ### Background resync
+    def start(self):
+        """Sync once, then keep resyncing in a background thread"""
+        self.sync()
+        if self.__resync_thread is None:
+            self.__resync_thread = Thread(target=self.__resync_worker, daemon=True)
+            self.__resync_thread.start()
+
+    def __resync_worker(self):
+        while True:
+            time.sleep(self.RESYNC_INTERVAL)
+            self.sync()
+
+    ### Time
+    @property
+    def offset(self):
+        """seconds, reference time - local time, at the current moment"""
+        t = time.time()
+        with self._lock:
+            return self._offset + self._drift * (t - self._t_ref)
+
+    def nist_time(self):
+        """Current time (seconds since epoch) on the reference clock"""
+        return time.time() + self.offset
+
+
+_clock = None
+_clock_lock = Lock()
+
+
+def get_clock() -> TimeSync:
+    """Get the clock shared by all components in this process, starting it on first use"""
+    global _clock
+    with _clock_lock:
+        if _clock is None:
+            _clock = TimeSync()
+            _clock.start()
+    return _clock
+
+
+def nist_time() -> float:
+    """Current time (seconds since epoch) on the shared reference clock"""
+    return get_clock().nist_time()
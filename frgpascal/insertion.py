@@ -0,0 +1,217 @@
+import numpy as np
+from math import ceil
+import roboflo as rf
+
+
+class InsertionScheduler:
+    """Inserts a new protocol into an already solved roboflo schedule.
+
+    Tasks that are already scheduled are frozen. The new protocol's tasks are
+    placed one at a time, each as early as possible after its precedent, into
+    the gaps left on each worker. Chains of immediate tasks are placed as a
+    single block. The same constraints as the roboflo solver are respected:
+        - worker capacity (no overlap on unit capacity workers, cumulative otherwise)
+        - no two transitions to/from the same worker at once
+        - a sample occupies a unit capacity worker from the transition onto
+            it until the transition off of it
+
+    This is greedy, so the result can be later than a full re-solve, but it
+    takes milliseconds instead of the full solve time. If the protocol cannot
+    be inserted (ie other protocols are still unsolved), `.insert()` returns
+    False and the full solver should be used instead.
+    """
+
+    def __init__(self, system: rf.System, max_iterations: int = 10000):
+        """
+        Args:
+            system (rf.System): roboflo system the protocols were generated by
+            max_iterations (int, optional): placement attempts before giving up on insertion. Defaults to 10000.
+        """
+        self.system = system
+        self.MAX_ITERATIONS = max_iterations
+
+    ### Timelines
+    @staticmethod
+    def _spans(worklist: list) -> list:
+        """(arrival, departure) transition pairs bounding a sample's stay on a unit capacity worker"""
+        spans = []
+        for i, arrival in enumerate(worklist):
+            if not isinstance(arrival, rf.Transition):
+                continue
+            if arrival.destination.capacity != 1:
+                continue
+            for departure in worklist[i + 1 :]:
+                if (
+                    isinstance(departure, rf.Transition)
+                    and departure.source == arrival.destination
+                ):
+                    spans.append((arrival, departure))
+                    break
+        return spans
+
+    def _build_timelines(self, protocols: list, after: float):
+        """Intervals already occupied on each worker, ignoring anything that ends before `after`
+
+        Returns:
+            bool: False if any existing task has not been scheduled yet
+        """
+        workers = self.system.workers
+        self._busy = {w.name: [] for w in workers}  # task intervals
+        self._moving = {w.name: [] for w in workers}  # transitions to/from the worker
+        self._occupied = {
+            w.name: [] for w in workers if w.capacity == 1
+        }  # samples sitting on the worker
+        for p in protocols:
+            for task in p.worklist:
+                if np.isnan(task.start):
+                    return False
+                if task.end <= after:
+                    continue
+                for w in task.workers:
+                    self._busy[w.name].append((task.start, task.end))
+                if isinstance(task, rf.Transition):
+                    for w in (task.source, task.destination):
+                        self._moving[w.name].append((task.start, task.end))
+            for arrival, departure in self._spans(p.worklist):
+                if departure.end > after:
+                    self._occupied[arrival.destination.name].append(
+                        (arrival.start, departure.end)
+                    )
+        return True
+
+    ### Conflicts
+    @staticmethod
+    def _overlapping(intervals, start, end) -> list:
+        return [iv for iv in intervals if iv[0] < end and iv[1] > start]
+
+    @staticmethod
+    def _peak(intervals) -> int:
+        """most intervals overlapping at any one time"""
+        events = sorted([(s, 1) for s, _ in intervals] + [(e, -1) for _, e in intervals])
+        peak = 0
+        count = 0
+        for _, change in events:  # ends sort before starts at the same time
+            count += change
+            peak = max(peak, count)
+        return peak
+
+    def _conflict(self, task, start):
+        """Check whether a task fits at a given start time
+
+        Returns:
+            float: None if the task fits, otherwise the earliest time it could possibly start instead
+        """
+        end = start + task.duration
+        bump = None
+        for w in task.workers:
+            overlapping = self._overlapping(self._busy[w.name], start, end)
+            if len(overlapping) == 0:
+                continue
+            if w.capacity == 1 or self._peak(overlapping) >= w.capacity:
+                # the interval ending first blocks every start before its end
+                b = min(iv[1] for iv in overlapping)
+                bump = b if bump is None else max(bump, b)
+        if isinstance(task, rf.Transition):
+            for w in (task.source, task.destination):
+                overlapping = self._overlapping(self._moving[w.name], start, end)
+                if len(overlapping) > 0:
+                    b = min(iv[1] for iv in overlapping)
+                    bump = b if bump is None else max(bump, b)
+        return bump
+
+    ### Placement
+    @staticmethod
+    def _blocks(worklist: list) -> list:
+        """split a worklist into chains of immediate tasks, which must be placed back to back"""
+        blocks = []
+        for task in worklist:
+            if task.immediate and task.precedent is not None and len(blocks) > 0:
+                blocks[-1].append(task)
+            else:
+                blocks.append([task])
+        return blocks
+
+    def _place_block(self, block, earliest):
+        offsets = [0]
+        for task in block[:-1]:
+            offsets.append(offsets[-1] + task.duration)
+        start = earliest
+        for _ in range(self.MAX_ITERATIONS):
+            bump = None
+            for task, offset in zip(block, offsets):
+                b = self._conflict(task, start + offset)
+                if b is not None:
+                    b = ceil(b) - offset
+                    bump = b if bump is None else max(bump, b)
+            if bump is None:
+                return [start + offset for offset in offsets]
+            start = max(bump, start + 1)
+        return None
+
+    def _place(self, worklist, not_before):
+        """Place every task in a worklist as early as possible
+
+        Returns:
+            dict: {task id: start time}, or None if placement failed
+        """
+        starts = {}
+        previous_end = -np.inf
+        for i, block in enumerate(self._blocks(worklist)):
+            earliest = ceil(max(block[0].min_start, previous_end, not_before.get(i, 0)))
+            block_starts = self._place_block(block, earliest)
+            if block_starts is None:
+                return None
+            for task, start in zip(block, block_starts):
+                starts[task.id] = start
+            previous_end = block_starts[-1] + block[-1].duration
+        return starts
+
+    def insert(self, protocol: rf.Protocol) -> bool:
+        """Schedule a new protocol around the tasks already scheduled
+
+        Args:
+            protocol (rf.Protocol): protocol from `system.generate_protocol()` with no scheduled tasks
+
+        Returns:
+            bool: True if the protocol was inserted (task start/end times are set), False if the full solver is required
+        """
+        scheduler = self.system.scheduler
+        worklist = protocol.worklist
+        existing = [p for p in scheduler.protocols if p is not protocol]
+        after = min(task.min_start for task in worklist)
+        if not self._build_timelines(existing, after=after):
+            return False
+
+        blocks = self._blocks(worklist)
+        block_of = {task.id: i for i, block in enumerate(blocks) for task in block}
+        not_before = {}  # block index: earliest start, raised when a sample's stay on a worker collides with another
+        for _ in range(self.MAX_ITERATIONS):
+            starts = self._place(worklist, not_before)
+            if starts is None:
+                return False
+            collision = None
+            for arrival, departure in self._spans(worklist):
+                span = (
+                    starts[arrival.id],
+                    starts[departure.id] + departure.duration,
+                )
+                overlapping = self._overlapping(
+                    self._occupied[arrival.destination.name], *span
+                )
+                if len(overlapping) > 0:
+                    collision = (block_of[arrival.id], min(iv[1] for iv in overlapping))
+                    break
+            if collision is None:
+                break
+            i, t = collision
+            not_before[i] = max(not_before.get(i, 0), ceil(t))
+        else:
+            return False
+
+        for task in worklist:
+            task.start = starts[task.id]
+            task.end = task.start + task.duration
+            task._solution_count += 1
+        scheduler._build_tasklist()
+        scheduler._num_tasks_on_last_solve = len(scheduler.tasklist)
+        return True
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+from threading import Lock
+from copy import deepcopy
+
+
+class TaskJournal:
+    """Write-ahead journal of Maestro task execution.
+
+    Every event is appended as one line of JSON and fsync'd to disk before
+    returning, so the journal survives a crash or power loss at any point in
+    a run. Events:
+        load: snapshot of all samples + their worklists at (re)start of a run
+        protocol: a sample added during a run (external control)
+        start: a task has started
+        finish: a task has finished, with its outputs
+        reschedule: start times of queued tasks were re-solved
+        stop: the run finished normally
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._lock = Lock()
+        self._f = open(filepath, "a")
+
+    def write(self, event: str, **data):
+        record = {"event": event, "time": time.time(), **data}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+    @staticmethod
+    def read(filepath: str) -> list:
+        """Read all events from a journal file
+
+        Args:
+            filepath (str): path to the journal
+
+        Returns:
+            list: events, in the order they were written. A partially written
+                final line (ie from a crash mid-write) is ignored.
+        """
+        records = []
+        with open(filepath, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # torn write, nothing after this was committed
+        return records
+
+
+def replay_journal(filepath: str) -> dict:
+    """Rebuild the state of a run from its journal
+
+    Args:
+        filepath (str): path to the journal
+
+    Raises:
+        ValueError: journal does not contain a load event
+
+    Returns:
+        dict: {
+            "name": experiment name,
+            "t0": nist time at which the run started,
+            "hotplate_setpoints": {hotplate name: temperature},
+            "samples": {sample name: sample dict, with actual timings + outputs filled in for finished tasks},
+            "completed_tasks": {task id: finish time},
+            "interrupted_tasks": [task dicts that started but did not finish],
+            "stopped": True if the run finished normally,
+        }
+    """
+    records = TaskJournal.read(filepath)
+    load_idx = [i for i, r in enumerate(records) if r["event"] == "load"]
+    if len(load_idx) == 0:
+        raise ValueError(f"No load event found in journal {filepath}!")
+    snapshot = records[load_idx[-1]]
+    samples = deepcopy(snapshot["samples"])
+
+    completed_tasks = {}
+    started = {}
+    tasks_by_id = {}
+
+    def index_sample(sample):
+        for task in sample["worklist"]:
+            tasks_by_id[task["id"]] = task
+            if "finish_actual" in task:
+                completed_tasks[task["id"]] = task["finish_actual"]
+
+    for sample in samples.values():
+        index_sample(sample)
+
+    stopped = False
+    for r in records[load_idx[-1] + 1 :]:
+        if r["event"] == "protocol":
+            samples[r["sample"]["name"]] = r["sample"]
+            index_sample(r["sample"])
+        elif r["event"] == "start":
+            started[r["id"]] = r
+            tasks_by_id[r["id"]]["start_actual"] = r["start_actual"]
+        elif r["event"] == "finish":
+            started.pop(r["id"], None)
+            tasks_by_id[r["id"]].update(r["output"])
+            completed_tasks[r["id"]] = r["output"]["finish_actual"]
+            sample = samples[r["sample"]]
+            if r.get("hotplate_slot") is not None:
+                sample["hotplate_slot"] = r["hotplate_slot"]
+        elif r["event"] == "reschedule":
+            for taskid, start in r["starts"].items():
+                tasks_by_id[taskid]["start"] = start
+        elif r["event"] == "stop":
+            stopped = True
+
+    return {
+        "name": snapshot["name"],
+        "t0": snapshot["t0"],
+        "hotplate_setpoints": snapshot.get("hotplate_setpoints", {}),
+        "samples": samples,
+        "completed_tasks": completed_tasks,
+        "interrupted_tasks": [tasks_by_id[taskid] for taskid in started],
+        "stopped": stopped,
+    }
@@ -0,0 +1,115 @@
+import os
+import json
+import yaml
+from threading import Lock
+from abc import ABC, abstractmethod
+
+from frgpascal.journal import replay_journal
+
+
+class LearnedModel(ABC):
+    """Base for models learned from the logged timings of previous runs.
+
+    Observations are kept in dictionaries of {key: [observations]} (the
+    attributes named in STORES), bounded to the most recent MAX_OBSERVATIONS
+    per key and persisted together to one yaml file. Subclasses implement
+    `.learn()` to extract observations from a run's sample log.
+    """
+
+    STORES = ()  # attribute names of the observation stores persisted to yaml
+
+    def __init__(self, filepath: str, constants: dict, quantile: float = None):
+        """
+        Args:
+            filepath (str): yaml file the model is persisted to
+            constants (dict): hardwareconstants.yaml block with quantile, min_observations and max_observations
+            quantile (float, optional): quantile (0-1) of observations used as the estimate. Defaults to constants["quantile"].
+        """
+        self.filepath = filepath
+        self.QUANTILE = constants["quantile"] if quantile is None else quantile
+        self.MIN_OBSERVATIONS = constants[
+            "min_observations"
+        ]  # observations required before an estimate replaces the hardcoded value
+        self.MAX_OBSERVATIONS = constants[
+            "max_observations"
+        ]  # most recent observations kept per key, so the model tracks hardware changes
+        self._lock = Lock()
+        for store in self.STORES:
+            setattr(self, store, {})
+        if os.path.exists(filepath):
+            self.load()
+
+    @classmethod
+    def shared(cls):
+        """Instance shared by the planner and Maestro, loaded once on first use"""
+        if cls.__dict__.get("_shared") is None:
+            cls._shared = cls()
+        return cls._shared
+
+    ### Persistence
+    def load(self):
+        with open(self.filepath, "r") as f:
+            model = yaml.load(f, Loader=yaml.FullLoader) or {}
+        with self._lock:
+            for store in self.STORES:
+                setattr(self, store, model.get(store, {}))
+
+    def save(self):
+        with self._lock:
+            model = {store: getattr(self, store) for store in self.STORES}
+        with open(self.filepath, "w") as f:
+            yaml.dump(model, f)
+
+    ### Learning
+    def _record(self, store: dict, key: str, value):
+        with self._lock:
+            observations = store.setdefault(key, [])
+            observations.append(value)
+            del observations[: -self.MAX_OBSERVATIONS]
+
+    @abstractmethod
+    def learn(self, samples: dict):
+        """Learn from a run
+
+        Args:
+            samples (dict): {sample name: sample dict}, ie Maestro.samples or the contents of maestro_sample_log.json
+        """
+        pass
+
+    def learn_from_file(self, filepath: str):
+        """Learn from a maestro_sample_log.json, or a maestro_journal.jsonl of a run that may not have finished
+
+        Args:
+            filepath (str): path to the sample log or journal
+        """
+        self.learn(load_samples(filepath))
+
+
+def load_samples(filepath: str) -> dict:
+    """{sample name: sample dict} from a maestro_sample_log.json or maestro_journal.jsonl"""
+    if filepath.endswith(".jsonl"):
+        return replay_journal(filepath)["samples"]
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def learn_from_runs(filepaths: list, save: bool = True):
+    """Update the shared task duration and liquid handler timing models from logged runs
+
+    Args:
+        filepaths (list): paths to maestro_sample_log.json or maestro_journal.jsonl files
+        save (bool, optional): persist the updated models. Defaults to True.
+    """
+    from frgpascal import system
+    from frgpascal.durationmodel import DurationModel
+    from frgpascal.liquidhandlertimings import LiquidHandlerTimingModel
+
+    models = [DurationModel.shared(), LiquidHandlerTimingModel.shared()]
+    for filepath in filepaths:
+        samples = load_samples(filepath)
+        for model in models:
+            model.learn(samples)
+    if save:
+        for model in models:
+            model.save()
+    system.get_transitions.cache_clear()  # rebuild transitions with new estimates
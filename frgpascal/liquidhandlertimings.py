@@ -0,0 +1,216 @@
+import os
+import re
+import numpy as np
+
+from frgpascal.hardware.helpers import load_hardware_constants
+from frgpascal.learnedmodel import LearnedModel
+
+MODULE_DIR = os.path.dirname(__file__)
+MODEL_PATH = os.path.join(MODULE_DIR, "hardware", "liquidhandlertimings.yaml")
+constants = load_hardware_constants()["liquidhandlertimings"]
+tc = load_hardware_constants()["liquidhandler"]["timings"]
+
+LABEL = re.compile(r"^(aspirate|stage|dispense)_solution(\d?)$")
+PIPETTES = ["perovskite", "antisolvent"]  # pipette used for drop 0, drop 1
+
+
+class LiquidHandlerTimingModel(LearnedModel):
+    """OT2 timing constants learned from the liquid handler tasks of previous runs.
+
+    For every spincoat, Maestro records when each liquid handler task was
+    requested and when the OT2 reported it complete. The OT2 runs its tasks in
+    order, so each task starts at the later of its requested time and the
+    completion of the task before it. This gives one observed duration per
+    aspiration, staging and dispense.
+
+    Aspiration durations are fit per pipette as a linear function of the same
+    terms as the hardcoded constants (tip pickup + travel, volume, premix
+    volume and cycles, touch tip, slow retract, air gap), regularized towards
+    the hardcoded constants so sparse data or flags that never vary do not
+    throw off the fit. Staging durations are learned per pipette and travel
+    speed, dispense delays per travel speed.
+
+    Aspiration and staging are planned at a high quantile, so the pipette is
+    ready in time. Dispense delays are planned at the median, so drops land on
+    their target time.
+    """
+
+    STORES = (
+        "aspirate",  # {pipette: [[*features, seconds]]}
+        "stage",  # {pipette/travel: [seconds]}
+        "dispense",  # {travel: [seconds]}
+    )
+
+    def __init__(self, filepath=MODEL_PATH, quantile=None):
+        """
+        Args:
+            filepath (str, optional): yaml file the model is persisted to. Defaults to liquidhandlertimings.yaml next to hardwareconstants.yaml.
+            quantile (float, optional): quantile (0-1) of aspiration/staging durations used as the estimate. Defaults to hardwareconstants.yaml > liquidhandlertimings > quantile.
+        """
+        self._fits = {}  # {pipette: (coefficients, residuals)}, cleared on new observations
+        super().__init__(filepath=filepath, constants=constants, quantile=quantile)
+        self.PRIOR_WEIGHT = constants["prior_weight"]
+
+    def load(self):
+        super().load()
+        self._fits = {}
+
+    ### Features
+    @staticmethod
+    def _features(drop) -> np.ndarray:
+        cycles, premix_volume = drop["pre_mix"]
+        return np.array(
+            [
+                1,
+                drop["volume"],
+                cycles * premix_volume,
+                cycles,
+                bool(drop["touch_tip"]),
+                bool(drop["slow_retract"]),
+                bool(drop["air_gap"]),
+            ],
+            dtype=float,
+        )
+
+    @staticmethod
+    def _prior() -> np.ndarray:
+        """aspiration coefficients from the hardcoded constants"""
+        ac = tc["aspirate"]
+        return np.array(
+            [
+                ac["preparetip"] + tc["travel"],
+                1 / 100,
+                ac["premix"]["a"],
+                ac["premix"]["b"],
+                ac["touchtip"],
+                ac["slowretract"],
+                ac["airgap"],
+            ]
+        )
+
+    @staticmethod
+    def _travel(slow_travel) -> str:
+        return "slow" if slow_travel else "normal"
+
+    ### Learning
+    def _record(self, store, key, value):
+        super()._record(store, key, value)
+        with self._lock:
+            self._fits = {}
+
+    def observe_aspiration(self, pipette: str, drop: dict, duration: float):
+        self._record(
+            self.aspirate,
+            pipette,
+            [float(x) for x in self._features(drop)] + [round(float(duration), 3)],
+        )
+
+    def observe_staging(self, pipette: str, slow_travel: bool, duration: float):
+        self._record(
+            self.stage,
+            f"{pipette}/{self._travel(slow_travel)}",
+            round(float(duration), 3),
+        )
+
+    def observe_dispense(self, slow_travel: bool, duration: float):
+        self._record(
+            self.dispense, self._travel(slow_travel), round(float(duration), 3)
+        )
+
+    def learn(self, samples: dict):
+        """Learn from the liquid handler timings of a run
+
+        Args:
+            samples (dict): {sample name: sample dict}, ie Maestro.samples or the contents of maestro_sample_log.json
+        """
+        for sample in samples.values():
+            for task in sample["worklist"]:
+                if task["name"] != "spincoat":
+                    continue
+                if "liquidhandler_requested" not in task:
+                    continue  # did not complete, or run before requested times were recorded
+                requested = task["liquidhandler_requested"]
+                completed = task["liquidhandler_timings"]
+                drops = task["details"]["drops"]
+
+                previous = -np.inf
+                for label in sorted(requested, key=requested.get):
+                    if label not in completed:
+                        continue
+                    start = max(requested[label], previous)
+                    duration = completed[label] - start
+                    previous = completed[label]
+                    match = LABEL.match(label)
+                    if match is None or duration <= 0:
+                        continue  # ie clearing the chuck between drops
+                    step, idx = match.group(1), int(match.group(2) or 0)
+                    drop = drops[idx]
+                    if step == "aspirate":
+                        self.observe_aspiration(PIPETTES[idx], drop, duration)
+                    elif step == "stage":
+                        self.observe_staging(
+                            PIPETTES[idx], drop["slow_travel"], duration
+                        )
+                    else:
+                        self.observe_dispense(drop["slow_travel"], duration)
+
+    ### Estimates
+    def _fit(self, pipette):
+        """Aspiration coefficients for a pipette, ridge regression towards the hardcoded constants
+
+        Returns:
+            tuple: (coefficients, residuals of the observations), residuals is None if there are not enough observations
+        """
+        with self._lock:
+            if pipette in self._fits:
+                return self._fits[pipette]
+            observations = np.array(self.aspirate.get(pipette, []), dtype=float)
+        prior = self._prior()
+        if len(observations) < self.MIN_OBSERVATIONS:
+            return prior, None
+        X, y = observations[:, :-1], observations[:, -1]
+        scale = np.maximum((X**2).mean(axis=0), 1)  # prior counts as PRIOR_WEIGHT typical observations
+        penalty = np.diag(self.PRIOR_WEIGHT * scale)
+        coefficients = np.linalg.solve(X.T @ X + penalty, X.T @ y + penalty @ prior)
+        fit = (coefficients, y - X @ coefficients)
+        with self._lock:
+            self._fits[pipette] = fit
+        return fit
+
+    def aspiration_duration(self, drop: dict, pipette: str = "perovskite") -> float:
+        coefficients, residuals = self._fit(pipette)
+        d = float(self._features(drop) @ coefficients)
+        if residuals is not None:
+            d += float(np.quantile(residuals, self.QUANTILE))
+        return d
+
+    def staging_duration(self, pipette: str, slow_travel: bool) -> float:
+        observations = self.stage.get(f"{pipette}/{self._travel(slow_travel)}", [])
+        if len(observations) < self.MIN_OBSERVATIONS:
+            return tc["travel_slow"] if slow_travel else tc["travel"]
+        return float(np.quantile(observations, self.QUANTILE))
+
+    def dispense_duration(self, slow_travel: bool) -> float:
+        observations = self.dispense.get(self._travel(slow_travel), [])
+        if len(observations) < self.MIN_OBSERVATIONS:
+            return tc["dispensedelay_slow"] if slow_travel else tc["dispensedelay"]
+        return float(np.median(observations))
+
+    def expected_timings(self, drop: dict, pipette: str = "perovskite") -> tuple:
+        """Estimated durations (seconds) of the aspiration, staging and dispense of a drop
+
+        Args:
+            drop (dict): dictionary of drop parameters
+            pipette (str, optional): "perovskite" (first drop) or "antisolvent" (second drop). Defaults to "perovskite".
+
+        Returns:
+            tuple: (aspirate, staging, dispense) durations in seconds
+        """
+        return (
+            self.aspiration_duration(drop, pipette),
+            self.staging_duration(pipette, drop["slow_travel"]),
+            self.dispense_duration(drop["slow_travel"]),
+        )
+
+
+get_liquidhandler_timing_model = LiquidHandlerTimingModel.shared
@@ -3,9 +3,7 @@ import sys
 from threading import Thread, Lock
 from concurrent.futures import ThreadPoolExecutor
 import time
-import yaml
 import json
-import ntplib
 import asyncio
 import datetime
 import logging
@@ -25,7 +23,12 @@ from frgpascal.hardware.characterizationline import (
     CharacterizationLine,
 )
 from frgpascal.hardware.switchbox import Switchbox
+from frgpascal.hardware.timesync import get_clock
 from frgpascal.analysis.processing import load_all
+from frgpascal.journal import TaskJournal, replay_journal
+from frgpascal.netlist import read_netlist
+from frgpascal.rescheduling import Rescheduler
+from frgpascal.learnedmodel import learn_from_runs
 
 from frgpascal.workers import (
     Worker_Hotplate,
@@ -36,14 +39,18 @@ from frgpascal.workers import (
 )
 
 from frgpascal.closedloop.websocket import Server
-from frgpascal.hardware.helpers import get_ot2_ip
+from frgpascal.hardware.helpers import (
+    get_ot2_ip,
+    load_hardware_constants,
+    startup_step,
+    run_startup_graph,
+)
 
 from frgpascal.hardware.characterizationline import CharacterizationLine
 
 
 MODULE_DIR = os.path.dirname(__file__)
-with open(os.path.join(MODULE_DIR, "hardware", "hardwareconstants.yaml"), "r") as f:
-    constants = yaml.load(f, Loader=yaml.FullLoader)
+constants = load_hardware_constants()
 
 ROOTDIR = "C:\\Users\\Admin\\Desktop\\PASCAL_Runs"
 
@@ -77,18 +84,13 @@ class MaestroServer(Server):
 
     def add_protocol(self, sample_dict: dict):
         """Add a protocol to the maestro workers"""
-        for t in sample_dict["worklist"]:
-            assigned = False
-            for workername, worker in self.maestro.workers.items():
-                if t["name"] in worker.functions:
-                    worker.add_task(t)
-                    assigned = True
-                    self.maestro.tasks.append(t)
-                    continue
-            if not assigned:
-                raise Exception(f"No worker assigned to task {t['name']}")
         samplename = sample_dict["name"]
         self.maestro.samples[samplename] = sample_dict
+        self.maestro.journal.write("protocol", sample=sample_dict)
+        self.maestro._index_tasks(sample_dict["worklist"])
+        for t in sample_dict["worklist"]:
+            self.maestro._assign_task(t)
+            self.maestro.tasks.append(t)
 
     def share_experiment_directory(self, d: dict):
         """Share the experiment directory with the active learner"""
@@ -134,63 +136,8 @@ class Maestro:
         ]  # number of times to try picking up a sample before erroring out
         self.TWISTOFF = True
         # Workers
-        self.gantry = Gantry()
-        self.gripper = Gripper()
-        self.switchbox = Switchbox()
-
-        # tries to connect to characterization line
-        self._handle_characterization_connection()
-
-        self.liquidhandler = OT2()
-
-        # Labware
-        self.hotplates = {
-            "Hotplate1": HotPlate(
-                name="Hotplate1",
-                version="hotplate_frg4inch",
-                gantry=self.gantry,
-                gripper=self.gripper,
-                id=1,
-                p0=constants["hotplates"]["hp1"]["p0"],
-            ),
-            "Hotplate2": HotPlate(
-                name="Hotplate2",
-                version="hotplate_frg4inch",
-                gantry=self.gantry,
-                gripper=self.gripper,
-                id=2,
-                p0=constants["hotplates"]["hp2"]["p0"],
-            ),
-            "Hotplate3": HotPlate(
-                name="Hotplate3",
-                version="hotplate_frg4inch",
-                gantry=self.gantry,
-                gripper=self.gripper,
-                id=3,
-                p0=constants["hotplates"]["hp3"]["p0"],
-            ),
-        }
-        self.storage = {
-            "Tray1": SampleTray(
-                name="Tray1",
-                version="storage_v3",
-                gantry=self.gantry,
-                gripper=self.gripper,
-                p0=constants["sampletray"]["p1"],
-            ),
-            "Tray2": SampleTray(
-                name="Tray2",
-                version="storage_v3",
-                gantry=self.gantry,
-                gripper=self.gripper,
-                p0=constants["sampletray"]["p2"],
-            ),
-        }
-
-        self.spincoater = SpinCoater(
-            gantry=self.gantry,
-            switch=self.switchbox.Switch(constants["spincoater"]["switchindex"]),
-        )
+        needs_characterization = self._prompt_characterization()
+        self._connect_hardware(needs_characterization)
 
         ### Workers to run tasks in parallel
         self.workers = {
@@ -208,35 +155,34 @@ class Maestro:
         }
         if self.characterization is not None:
             self.workers["characterization"] = Worker_Characterization(maestro=self)
+        self._worker_by_task = {}  # task name: worker that executes it
+        for worker in self.workers.values():
+            for taskname in worker.functions:
+                self._worker_by_task.setdefault(taskname, worker)
 
         self._load_calibrations()  # load coordinate calibrations for labware
-        self.__calibrate_time_to_nist()  # for sync with other hardware
         # Status
         self.samples = {}
         self.tasks = []
+        self.task_index = {}  # task id: task dict in its sample's worklist
+        self.pending_tasks = set()
+        self.completed_tasks = {}
         self.lock_pendingtasks = Lock()
         self.lock_completedtasks = Lock()
         self.t0 = None
         self._under_external_control = False
+        self.journal = None  # write-ahead log of task execution, opened with the experiment folder
+        self.rescheduler = Rescheduler(
+            maestro=self, threshold=30, solve_time=20, buffer=10
+        )  # re-solves the remaining schedule when execution runs late
+        self.RESCHEDULE_INTERVAL = 5  # seconds between checks for schedule lateness
+        self.experiment_name = None
+        self.hotplate_setpoints = {}
 
         # worker thread coordination
         self.threadpool = ThreadPoolExecutor(max_workers=40)
 
     ### Time Synchronization with NIST
-    def __calibrate_time_to_nist(self):
-        client = ntplib.NTPClient()
-        response = None
-        t0 = time.time()
-        while response is None:
-            try:
-                response = client.request("europe.pool.ntp.org", version=3)
-            except:
-                pass
-            if time.time() - t0 >= 10:
-                warn("Could not get NIST time!")
-                return
-        self.__local_nist_offset = response.tx_time - time.time()
-
     @property
     def experiment_time(self):
         if self.t0 is None:
@@ -245,7 +191,7 @@ class Maestro:
 
     @property
     def nist_time(self):
-        return time.time() + self.__local_nist_offset
+        return self.clock.nist_time()
 
     def calibrate(self):
         """Prompt user to fine tune the gantry positions for all hardware components"""
@@ -361,10 +307,7 @@ class Maestro:
 
     def get_gripper_load(self):
         time.sleep(0.5)  # wait for gripper to complete motion
-        self.gripper.write("l")
-        with self.gripper._lock:
-            load = float(self.gripper._handle.readline())
-        return load
+        return self.gripper.get_load()
 
     def transfer(self, p1, p2, zhop=True):
         """Move a sample from one location (source) to another (destination)
@@ -427,15 +370,19 @@ class Maestro:
         # time.sleep(2)
         self.release()  # drop the sample
 
-        self.gantry.moverel(
-            z=self.gantry.ZHOP_HEIGHT
-        )  # move up a bit, mostly to avoid resting gripper on hotplate
+        x, y, z = self.gantry.position
+        path = [
+            [x, y, z + self.gantry.ZHOP_HEIGHT]
+        ]  # move up a bit, mostly to avoid resting gripper on hotplate
+        onto_spincoater = all([a == b for a, b in zip(p2, self.spincoater())])
+        if onto_spincoater:
+            path += self.gantry._transition_path(
+                "workspace", start=path[-1]
+            )  # move gantry out of the liquid handler
+        self.gantry.movepath(path, m400=False)  # lift + exit as one queued motion
 
         # self.gripper.close()  # fully close gripper to reduce servo strain
-        if all([a == b for a, b in zip(p2, self.spincoater())]):
-            self.gantry._transition_to_frame(
-                "workspace"
-            )  # move gantry out of the liquid handler
+        if onto_spincoater:
             self.spincoater.idle()  # dont actively hold chuck in registered position
 
     ### Batch Sample Execution
@@ -489,18 +436,16 @@ class Maestro:
         # self.loop.set_debug(True)
 
     def _load_worklist(self, filepath):
-        with open(filepath, "r") as f:
-            worklist = json.load(f)
+        worklist = read_netlist(filepath)  # json or compact (.pnl) netlist
         # self.tasks = worklist["tasks"]
         self.samples = worklist["samples"]
-        self.tasks = []
-        for details in self.samples.values():
-            self.tasks.extend(details["worklist"])
-        self.tasks.sort(key=lambda t: t["start"])
+        self.tasks = worklist["tasks"]  # already ordered by start time
+        self.task_index = {}
+        self._index_tasks(self.tasks)
 
-        for hp_name, temperature in worklist["hotplate_setpoints"].items():
-            self.hotplates[hp_name].controller.setpoint = temperature
-            print(f"Hotplate {hp_name} set to {temperature:.1f}C")
+        self.hotplate_setpoints = worklist["hotplate_setpoints"]
+        self._set_hotplates()
+        self.experiment_name = worklist["name"]
         return worklist["name"]
         # self._characterization_baselines_required = worklist["baselines_required"]
 
@@ -518,15 +463,26 @@ class Maestro:
                 break
         os.mkdir(folder)
         print(f"Experiment folder created at {folder}")
+        self._open_experiment_folder(folder, log_name=folder_name)
+        return folder
 
+    def _open_experiment_folder(self, folder, log_name):
+        """Direct characterization data, logs and the task journal to an experiment folder"""
         if self.characterization is not None:
             self.characterization.set_directory(
                 os.path.join(folder, "Characterization")
             )
+        self.spincoater.set_directory(os.path.join(folder, "Spincoater"))
         self.experiment_folder = folder
+        self.journal = TaskJournal(os.path.join(folder, "maestro_journal.jsonl"))
+        for name, hp in self.hotplates.items():
+            if hp.telemetry is not None:
+                hp.telemetry.set_logfile(
+                    os.path.join(folder, f"{name}_temperature.csv")
+                )
         self.logger.setLevel(logging.DEBUG)
         self._fh = logging.FileHandler(
-            os.path.join(self.experiment_folder, f"{folder_name}.log")
+            os.path.join(self.experiment_folder, f"{log_name}.log")
         )
         self._sh = logging.StreamHandler(sys.stdout)
         self._sh.setLevel(logging.INFO)
@@ -543,8 +499,6 @@ class Maestro:
         self.logger.addHandler(self._fh)
         self.logger.addHandler(self._sh)
 
-        return folder
-
     def _experiment_checklist(self, characterization_only=False):
         """prompt user to go through checklist to ensure that
         all hardware is set properly for PASCAL to run
@@ -576,22 +530,34 @@ class Maestro:
 
         # if we make it this far, checklist has been passed
 
+    def _set_hotplates(self):
+        for hp_name, temperature in self.hotplate_setpoints.items():
+            self.hotplates[hp_name].controller.setpoint = temperature
+            print(f"Hotplate {hp_name} set to {temperature:.1f}C")
+
     def turn_off_hotplates(self):
         for hp in self.hotplates.values():
             hp.controller.setpoint = 0
 
     def load_netlist(self, filepath: str):
+        """Load a maestro netlist exported by PASCALPlanner, either json or compact (.pnl)"""
         experiment_name = self._load_worklist(filepath)
         self._set_up_experiment_folder(experiment_name)
 
     def get_ot2_ip_maestro(self):
         print(get_ot2_ip())
 
-    def run(self, ip=None):
+    def run(self, ip=None, reschedule: bool = False):
+        """Execute the loaded netlist
+
+        Args:
+            ip (str, optional): IP address of the OT2. Defaults to None, in which case it is found automatically.
+            reschedule (bool, optional): If True, the remaining schedule is re-solved whenever tasks run later than `self.rescheduler.THRESHOLD` seconds behind the plan. Defaults to False.
+        """
         if len(self.samples) == 0:
             raise Exception("No samples loaded, did you forget to run .load_netlist()?")
         self._experiment_checklist()
-        self.pending_tasks = []
+        self.pending_tasks = set()
         self.completed_tasks = {}
         if ip is None:
             self.liquidhandler.server.ip = get_ot2_ip()
@@ -600,31 +566,175 @@ class Maestro:
 
         self._start_loop()
         self.t0 = self.nist_time
+        self._journal_snapshot()
 
         for worker in self.workers.values():
             worker.prime(loop=self.loop)
         for task in self.tasks:
-            assigned = False
-            for workername, worker in self.workers.items():
-                if task["name"] in worker.functions:
-                    worker.add_task(task)
-                    assigned = True
-                    continue
-            if not assigned:
-                raise Exception(f"No worker assigned to task {task['name']}")
+            self._assign_task(task)
 
         for worker in self.workers.values():
             worker.start()
+        if reschedule:
+            asyncio.run_coroutine_threadsafe(self._reschedule_monitor(), self.loop)
+
+    async def _reschedule_monitor(self):
+        """Re-solve the remaining schedule whenever execution falls too far behind it"""
+        retry = False
+        while self.working:
+            if not retry:
+                await asyncio.sleep(self.RESCHEDULE_INTERVAL)
+            retry = False
+            lateness = self.rescheduler.lateness()
+            if lateness < self.rescheduler.THRESHOLD:
+                continue
+            self.logger.info(
+                f"{lateness:.0f} seconds behind schedule, re-solving remaining tasks"
+            )
+            queued = self.rescheduler.queued_ids()
+            try:
+                new_starts = await self.loop.run_in_executor(
+                    self.threadpool, self.rescheduler.solve, queued
+                )
+            except Exception:
+                self.logger.exception(
+                    "Could not re-solve schedule, continuing with the current one"
+                )
+                continue
+            # no awaits from here on, so workers see all new start times at once
+            new_starts = self.rescheduler.apply(new_starts)
+            if new_starts is None:
+                self.logger.info(
+                    "Tasks started while re-solving, discarding solution and re-solving with them fixed"
+                )
+                retry = True
+                continue
+            self.journal.write("reschedule", starts=new_starts)
+            self.logger.info(f"rescheduled {len(new_starts)} tasks")
+
+    def _index_tasks(self, tasks: list):
+        """Add task dicts to the task id lookup used by the workers"""
+        for task in tasks:
+            self.task_index[task["id"]] = task
+
+    def _assign_task(self, task):
+        worker = self._worker_by_task.get(task["name"])
+        if worker is None:
+            raise Exception(f"No worker assigned to task {task['name']}")
+        worker.add_task(task)
+
+    def _journal_snapshot(self, **kwargs):
+        """Record the full sample list in the journal. Task events after this are relative to this snapshot"""
+        self.journal.write(
+            "load",
+            name=self.experiment_name,
+            t0=self.t0,
+            hotplate_setpoints=self.hotplate_setpoints,
+            samples=self.samples,
+            **kwargs,
+        )
+
+    def resume(self, journal: str, ip=None, delay: float = 60):
+        """Resume an interrupted run from its journal (maestro_journal.jsonl in the
+        experiment folder). Completed tasks are not repeated, samples on hotplates
+        are placed back in their hotplate slots, and the remaining tasks are
+        re-enqueued with their relative timing preserved, shifted so the first
+        remaining task starts `delay` seconds after resuming. Experiment time
+        continues from the original start of the run.
+
+        Tasks that were in progress when the run was interrupted will be repeated.
+        Make sure these samples are back in their expected positions before
+        passing the checklist!
+
+        Args:
+            journal (str): filepath to the journal of the interrupted run
+            ip (str, optional): IP address of the OT2. Defaults to None, in which case it is found automatically.
+            delay (float, optional): seconds between resuming and the first remaining task. Defaults to 60.
+        """
+        state = replay_journal(journal)
+        if state["stopped"]:
+            raise Exception("This run finished normally, there is nothing to resume!")
+        self.samples = state["samples"]
+        self.tasks = []
+        for details in self.samples.values():
+            self.tasks.extend(details["worklist"])
+        self.tasks.sort(key=lambda t: t["start"])
+        self.task_index = {}
+        self._index_tasks(self.tasks)
+        completed_tasks = state["completed_tasks"]
+        remaining_tasks = [t for t in self.tasks if t["id"] not in completed_tasks]
+        if len(remaining_tasks) == 0:
+            raise Exception("All tasks in this run were completed, nothing to resume!")
+
+        self.experiment_name = state["name"]
+        self.hotplate_setpoints = state["hotplate_setpoints"]
+        self._set_hotplates()
+        self._restore_sample_locations(completed_tasks)
+        for task in state["interrupted_tasks"]:
+            print(
+                f"{task['name']} for {task['sample']} was interrupted and will be repeated - check this sample's position!"
+            )
+
+        folder = os.path.dirname(os.path.abspath(journal))
+        self._open_experiment_folder(folder, log_name=os.path.basename(folder))
+        print(
+            f"Resuming {self.experiment_name}: {len(completed_tasks)} tasks completed, {len(remaining_tasks)} remaining"
+        )
+
+        self._experiment_checklist()
+        self.pending_tasks = set()
+        self.completed_tasks = completed_tasks
+        if ip is None:
+            self.liquidhandler.server.ip = get_ot2_ip()
+        else:
+            self.liquidhandler.server.ip = ip
+
+        self._start_loop()
+        self.t0 = state["t0"]  # keep the original clock, so actual timings stay comparable
+        shift = self.experiment_time + delay - remaining_tasks[0]["start"]
+        for task in remaining_tasks:
+            task["start"] += shift
+        self._journal_snapshot(resumed=True)
+
+        for worker in self.workers.values():
+            worker.prime(loop=self.loop)
+        for task in remaining_tasks:
+            self._assign_task(task)
+        for worker in self.workers.values():
+            worker.start()
+
+    def _restore_sample_locations(self, completed_tasks: dict):
+        """Place samples back onto the hotplate slots they occupied when the run was interrupted"""
+        for sample in self.samples.values():
+            completed = [t for t in sample["worklist"] if t["id"] in completed_tasks]
+            if len(completed) == 0:
+                continue  # sample never left storage
+            last_task = completed[-1]
+            if last_task["name"].endswith("_to_hotplate"):
+                hotplate_slot = sample["hotplate_slot"]
+                self.hotplates[hotplate_slot["hotplate"]].load(
+                    hotplate_slot["slot"], sample
+                )
 
     def stop(self):
         self.working = False
         # clean up the experiment, save log of actual timings
         for hp in self.hotplates.values():
             hp.controller.setpoint = 0
+            if hp.telemetry is not None:
+                hp.telemetry.close_logfile()
         with open(
             os.path.join(self.experiment_folder, "maestro_sample_log.json"), "w"
         ) as f:
             json.dump(self.samples, f)
+        try:
+            learn_from_runs(
+                [os.path.join(self.experiment_folder, "maestro_sample_log.json")]
+            )  # tighten task durations and liquid handler headstarts for future runs
+        except Exception as e:
+            self.logger.warning(f"Could not update learned timing models: {e}")
+        self.journal.write("stop")
+        self.journal.close()
 
         if self.characterization is not None:
             metrics, _ = load_all(datadir=self.characterization.rootdir)
@@ -671,15 +781,11 @@ class Maestro:
             if len(new_tasks) > 0:
                 new_tasks.sort(key=lambda task: task["start"])
                 for t in new_tasks:
-                    assigned = False
-                    for workername, worker in self.workers.items():
-                        if t["task"] in worker.functions:
-                            worker.add_task(t)
-                            assigned = True
-                            self.tasks.append(t)
-                            continue
-                    if not assigned:
+                    worker = self._worker_by_task.get(t["task"])
+                    if worker is None:
                         raise Exception(f"No worker assigned to task {t['task']}")
+                    worker.add_task(t)
+                    self.tasks.append(t)
             await asyncio.sleep(0.5)
 
     def run_externalcontrol(self, name, ot2_ip):
@@ -689,10 +795,13 @@ class Maestro:
 
         self.liquidhandler.server.ip = ot2_ip
         # self.read_protocol_files = []
-        self.pending_tasks = []
+        self.pending_tasks = set()
         self.completed_tasks = {}
+        self.task_index = {}
         folder = self._set_up_experiment_folder(name)
+        self.experiment_name = name
         self._start_loop()
+        self._journal_snapshot()  # protocols are journaled as they arrive
 
         for worker in self.workers.values():
             worker.prime(loop=self.loop)
@@ -700,21 +809,94 @@ class Maestro:
 
         self.server = MaestroServer(maestro=self)  # open for external commands
 
-    def _handle_characterization_connection(self):
+    def _prompt_characterization(self):
         """
-        Prompts user if they want characterization and tries to connect to
-        characterization line if so. If connection fails, continues without
-        characterization.
+        Prompts user if they want characterization. Asked before any hardware
+        connects, so startup can proceed unattended.
         """
-        self.characterization = None
         response = input("Do you need characterization? (y/n)")
-        needs_char = response in ["y", "Y"]
-        if needs_char:
-            try:
-                self.characterization = CharacterizationLine(
-                    gantry=self.gantry, rootdir=ROOTDIR, switchbox=self.switchbox
-                )
-            except:
-                print(
-                    "Failed to connect to characterization line, continuing without it."
-                )
+        return response in ["y", "Y"]
+
+    def _connect_hardware(self, needs_characterization: bool):
+        """
+        Connects to all hardware. Independent devices connect concurrently; devices
+        that need another device (ie hotplates need the gantry) wait for it.
+        Each device has a timeout (hardwareconstants.yaml > startup). If
+        characterization fails to connect, continues without characterization.
+        Any other failure raises an exception.
+        """
+        timeouts = constants["startup"]["timeouts"]
+
+        def hotplate(name, id):
+            return lambda gantry, gripper: HotPlate(
+                name=name,
+                version="hotplate_frg4inch",
+                gantry=gantry,
+                gripper=gripper,
+                id=id,
+                p0=constants["hotplates"][f"hp{id}"]["p0"],
+            )
+
+        def sampletray(name, p0):
+            return lambda gantry, gripper: SampleTray(
+                name=name,
+                version="storage_v3",
+                gantry=gantry,
+                gripper=gripper,
+                p0=p0,
+            )
+
+        steps = {
+            # shared NIST clock, for sync with other hardware
+            "clock": startup_step(get_clock, [], timeouts["clock"]),
+            "gantry": startup_step(Gantry, [], timeouts["gantry"]),
+            "gripper": startup_step(Gripper, [], timeouts["gripper"]),
+            "switchbox": startup_step(Switchbox, [], timeouts["switchbox"]),
+            "liquidhandler": startup_step(OT2, [], timeouts["liquidhandler"]),
+            "spincoater": startup_step(
+                lambda gantry, switchbox: SpinCoater(
+                    gantry=gantry,
+                    switch=switchbox.Switch(constants["spincoater"]["switchindex"]),
+                ),
+                ["gantry", "switchbox"],
+                timeouts["spincoater"],
+            ),
+        }
+        for id in [1, 2, 3]:
+            steps[f"Hotplate{id}"] = startup_step(
+                hotplate(f"Hotplate{id}", id),
+                ["gantry", "gripper"],
+                timeouts["hotplate"],
+            )
+        for name, p0 in [
+            ("Tray1", constants["sampletray"]["p1"]),
+            ("Tray2", constants["sampletray"]["p2"]),
+        ]:
+            steps[name] = startup_step(
+                sampletray(name, p0), ["gantry", "gripper"], timeouts["sampletray"]
+            )
+        if needs_characterization:
+            steps["characterization"] = startup_step(
+                lambda gantry, switchbox: CharacterizationLine(
+                    gantry=gantry, rootdir=ROOTDIR, switchbox=switchbox
+                ),
+                ["gantry", "switchbox"],
+                timeouts["characterization"],
+            )
+
+        results, errors = run_startup_graph(steps)
+        self.characterization = results.get("characterization", None)
+        if "characterization" in errors:
+            print("Failed to connect to characterization line, continuing without it.")
+            del errors["characterization"]
+        if len(errors) > 0:
+            raise Exception(f"Failed to connect to hardware: {errors}")
+
+        self.clock = results["clock"]
+        self.gantry = results["gantry"]
+        self.gripper = results["gripper"]
+        self.switchbox = results["switchbox"]
+        self.liquidhandler = results["liquidhandler"]
+        self.spincoater = results["spincoater"]
+        self.hotplates = {f"Hotplate{id}": results[f"Hotplate{id}"] for id in [1, 2, 3]}
+        self.storage = {name: results[name] for name in ["Tray1", "Tray2"]}
@@ -0,0 +1,202 @@
+import os
+import gzip
+import json
+import numpy as np
+
+NETLIST_FORMAT = "pascal-netlist"
+NETLIST_VERSION = 1
+NETLIST_EXTENSION = ".pnl"
+
+
+class _NetlistEncoder(json.JSONEncoder):
+    """Converts numpy scalars to python numbers to allow dumping to json"""
+
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def _dumps(record) -> str:
+    return json.dumps(record, separators=(",", ":"), cls=_NetlistEncoder) + "\n"
+
+
+def write_netlist(netlist: dict, filepath: str):
+    """Write a maestro netlist in the compact format
+
+    The file is gzip compressed json lines:
+        header: format, schema version, and every top level field of the netlist except samples
+        sample: one line per sample, without its worklist
+        details: one line per unique task details dict. Tasks with identical
+            details (ie the same spincoat recipe) share one line
+        task: one line per task, ordered by start time, referencing its details by index
+
+    Args:
+        netlist (dict): maestro netlist, as written to maestronetlist_*.json
+        filepath (str): path to write to, conventionally ending in .pnl
+    """
+    samples = netlist["samples"]
+    tasks = []
+    for sample in samples.values():
+        tasks.extend(sample["worklist"] or [])
+    tasks.sort(key=lambda t: t["start"])  # stable, so each worklist keeps its order
+
+    details_index = {}
+    details_lines = []
+    task_lines = []
+    for task in tasks:
+        line = _dumps(task.get("details", {}))
+        if line not in details_index:
+            details_index[line] = len(details_lines)
+            details_lines.append(line)
+        record = {k: v for k, v in task.items() if k != "details"}
+        record["details"] = details_index[line]
+        task_lines.append(_dumps({"type": "task", "task": record}))
+
+    header = {k: v for k, v in netlist.items() if k != "samples"}
+    header.update(
+        {
+            "format": NETLIST_FORMAT,
+            "version": NETLIST_VERSION,
+            "n_samples": len(samples),
+            "n_tasks": len(tasks),
+        }
+    )
+    with gzip.open(filepath, "wt", encoding="utf-8") as f:
+        f.write(_dumps({"type": "header", "header": header}))
+        for sample in samples.values():
+            record = {k: v for k, v in sample.items() if k != "worklist"}
+            record["scheduled"] = sample["worklist"] is not None
+            f.write(_dumps({"type": "sample", "sample": record}))
+        for line in details_lines:
+            f.write('{"type":"details","details":' + line[:-1] + "}\n")
+        f.writelines(task_lines)
+
+
+class NetlistReader:
+    """Streams a compact (.pnl) maestro netlist.
+
+    The header, samples and shared task details are read on opening. Tasks are
+    only read as `.tasks()` is iterated, and are yielded in start order.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._f = gzip.open(filepath, "rt", encoding="utf-8")
+        self.header = self._next("header")
+        self._check_version()
+        self.samples = {}  # {sample name: sample dict, without worklist}
+        self._details = []  # json strings, parsed per task so tasks do not share details dicts
+        self._pending = None  # first task line, read while looking for the end of details
+        for line in self._f:
+            record = json.loads(line)
+            if record["type"] == "sample":
+                self.samples[record["sample"]["name"]] = record["sample"]
+            elif record["type"] == "details":
+                self._details.append(json.dumps(record["details"]))
+            else:
+                self._pending = record
+                break
+
+    def _next(self, expected_type):
+        record = json.loads(self._f.readline())
+        if record.get("type") != expected_type:
+            raise ValueError(
+                f"{self.filepath} is not a valid netlist, expected a {expected_type} line"
+            )
+        return record[expected_type]
+
+    def _check_version(self):
+        if self.header.get("format") != NETLIST_FORMAT:
+            raise ValueError(f"{self.filepath} is not a {NETLIST_FORMAT} file!")
+        if self.header["version"] > NETLIST_VERSION:
+            raise ValueError(
+                f"{self.filepath} uses netlist schema version {self.header['version']}, this version of frgpascal reads up to version {NETLIST_VERSION}. Update frgpascal to load it."
+            )
+
+    def tasks(self):
+        """Yield task dicts in order of start time"""
+        if self._pending is None:
+            return
+        records = [self._pending]
+        self._pending = None
+        while len(records) > 0:
+            # one json parse per chunk of lines, rather than per task
+            details = json.loads(
+                "[" + ",".join(self._details[r["task"]["details"]] for r in records) + "]"
+            )
+            for record, d in zip(records, details):
+                task = record["task"]
+                task["details"] = d
+                yield task
+            lines = self._f.readlines(1 << 16)
+            records = json.loads("[" + ",".join(lines) + "]")
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_netlist(filepath: str) -> dict:
+    """Load a maestro netlist, either json or compact (.pnl)
+
+    Args:
+        filepath (str): path to the netlist
+
+    Returns:
+        dict: netlist with the same structure as maestronetlist_*.json, plus a
+            "tasks" list of every task dict ordered by start time. Task dicts are
+            shared between "tasks" and the sample worklists.
+    """
+    if not filepath.endswith(NETLIST_EXTENSION):
+        with open(filepath, "r") as f:
+            netlist = json.load(f)
+        tasks = []
+        for sample in netlist["samples"].values():
+            tasks.extend(sample["worklist"])
+        tasks.sort(key=lambda t: t["start"])
+        netlist["tasks"] = tasks
+        return netlist
+
+    with NetlistReader(filepath) as reader:
+        netlist = {
+            k: v
+            for k, v in reader.header.items()
+            if k not in ["format", "version", "n_samples", "n_tasks"]
+        }
+        samples = {}
+        for name, sample in reader.samples.items():
+            scheduled = sample.pop("scheduled")
+            samples[name] = {**sample, "worklist": [] if scheduled else None}
+        tasks = []
+        for task in reader.tasks():
+            samples[task["sample"]]["worklist"].append(task)
+            tasks.append(task)
+    netlist["samples"] = samples
+    netlist["tasks"] = tasks
+    return netlist
+
+
+def convert_netlist(filepath: str, output_filepath: str = None) -> str:
+    """Convert a json maestro netlist to the compact format
+
+    Args:
+        filepath (str): path to maestronetlist_*.json
+        output_filepath (str, optional): path to write to. Defaults to the same path with a .pnl extension.
+
+    Returns:
+        str: path to the compact netlist
+    """
+    if output_filepath is None:
+        output_filepath = os.path.splitext(filepath)[0] + NETLIST_EXTENSION
+    with open(filepath, "r") as f:
+        netlist = json.load(f)
+    write_netlist(netlist, output_filepath)
+    return output_filepath
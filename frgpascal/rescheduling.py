@@ -0,0 +1,179 @@
+import numpy as np
+from copy import deepcopy
+from math import floor, ceil
+import roboflo as rf
+
+from frgpascal import system
+from frgpascal.experimentaldesign.tasks import get_all_tasks
+
+
+class Rescheduler:
+    """Re-solves the not-yet-started portion of a running experiment.
+
+    The task dicts Maestro is executing are rebuilt into a roboflo System
+    (from `system.build()`). Tasks that have finished, started, or already
+    been pulled off a worker queue are fixed at their actual (or committed)
+    times, and the remaining queued tasks are free to move, no earlier than
+    `solve_time + buffer` seconds from now. The new start times are then
+    pushed into the worker queues in a single step on Maestro's event loop.
+    """
+
+    def __init__(
+        self, maestro, threshold: float = 30, solve_time: float = 20, buffer: float = 10
+    ):
+        """
+        Args:
+            maestro (Maestro): running Maestro instance
+            threshold (float, optional): seconds a task may run late before the schedule is re-solved. Defaults to 30.
+            solve_time (float, optional): seconds allotted to the solver. Defaults to 20.
+            buffer (float, optional): extra seconds between the solution and the first rescheduled task. Defaults to 10.
+        """
+        self.maestro = maestro
+        self.THRESHOLD = threshold
+        self.SOLVE_TIME = solve_time
+        self.BUFFER = buffer
+
+    ### Lateness
+    def queued_ids(self) -> set:
+        """ids of tasks still waiting in a worker queue, ie free to be rescheduled"""
+        return {
+            task["id"]
+            for worker in self.maestro.workers.values()
+            for _, task in worker.queue._queue
+        }
+
+    def lateness(self) -> float:
+        """Current delay (seconds) relative to the schedule being executed, ie how
+        long past its start time the most overdue task is still waiting in a
+        worker queue.
+        """
+        now = self.maestro.experiment_time
+        lateness = 0
+        for worker in self.maestro.workers.values():
+            for start, _ in worker.queue._queue:
+                lateness = max(lateness, now - start)
+        return lateness
+
+    ### Build + solve
+    def _duration(self, task) -> int:
+        if "duration" in task["details"]:
+            return ceil(task["details"]["duration"])
+        return ceil(system.get_task_worker_types()[task["name"]]["estimated_duration"])
+
+    def _build_protocol(self, sample, rfsystem, transitions, queued, now, min_start):
+        workers = {w.name: w for w in rfsystem.workers}
+        all_tasks = get_all_tasks()
+        completed = self.maestro.completed_tasks
+        worklist = []
+        for i, task in enumerate(sample["worklist"]):
+            if task["name"] in transitions:
+                source = task["details"]["source"]
+                destination = task["details"]["destination"]
+                rftask = deepcopy(transitions[task["name"]][(source, destination)])
+                following = sample["worklist"][i + 1 : i + 2]
+                rftask.immediate = rftask.immediate or (
+                    len(following) > 0 and following[0].get("immediate", False)
+                )
+            else:
+                if task["name"] == "anneal":
+                    task_workers = [workers[task["details"]["hotplate"]]]
+                elif task["name"] == "rest":
+                    task_workers = [workers[sample["storage_slot"]["tray"]]]
+                else:
+                    task_workers = all_tasks[task["name"]]["workers"]
+                rftask = rf.Task(
+                    name=task["name"],
+                    workers=task_workers,
+                    duration=self._duration(task),
+                    immediate=task.get("immediate", False),
+                )
+            rftask.id = task["id"]
+            if isinstance(rftask, rf.Transition):
+                system.apply_slot_durations(
+                    [rftask], sample.get("storage_slot") or {}
+                )
+            rftask.precedent = worklist[-1] if len(worklist) > 0 else None
+
+            if task["id"] in completed:
+                rftask.start = floor(task["start_actual"])
+                rftask.end = max(ceil(task["finish_actual"]), rftask.start + 1)
+            elif "start_actual" in task:
+                rftask.start = floor(task["start_actual"])
+                rftask.end = max(rftask.start + rftask.duration, ceil(now) + 1)
+            elif task["id"] not in queued:  # already committed by its worker
+                rftask.start = max(ceil(task["start"]), ceil(now))
+                rftask.end = rftask.start + rftask.duration
+            if (
+                np.isnan(rftask.start)
+                and rftask.immediate
+                and rftask.precedent is not None
+                and not np.isnan(rftask.precedent.start)
+            ):
+                # chained onto a fixed task (ie removal from a hotplate mid-anneal), stays pinned to it
+                rftask.start = max(rftask.precedent.end, ceil(now))
+                rftask.end = rftask.start + rftask.duration
+            if np.isnan(rftask.start):
+                rftask.min_start = min_start
+            else:
+                rftask.min_start = rftask.start
+                rftask.duration = rftask.end - rftask.start
+                rftask.immediate = False
+            worklist.append(rftask)
+        return rf.Protocol(name=sample["name"], worklist=worklist)
+
+    def solve(self, queued: set) -> dict:
+        """Re-solve the remaining schedule. This blocks for up to `solve_time`, so
+        should be run off of Maestro's event loop.
+
+        Args:
+            queued (set): ids of tasks free to be rescheduled, from `.queued_ids()`
+
+        Returns:
+            dict: {task id: new start time (experiment time, seconds)} for every task still waiting in a worker queue
+        """
+        now = self.maestro.experiment_time
+        min_start = ceil(now + self.SOLVE_TIME + self.BUFFER)
+
+        rfsystem = system.build()
+        transitions = {}
+        for t in system.get_transitions():
+            transitions.setdefault(t.name, {})[(t.source.name, t.destination.name)] = t
+
+        protocols = []
+        free_tasks = []
+        for sample in self.maestro.samples.values():
+            p = self._build_protocol(
+                sample, rfsystem, transitions, queued, now, min_start
+            )
+            protocols.append(p)
+            free_tasks += [t for t in p.worklist if t.id in queued]
+        if len(free_tasks) == 0:
+            return {}
+        rfsystem.scheduler.add_protocols(protocols)
+        rfsystem.scheduler.solve(solve_time=self.SOLVE_TIME)
+        return {t.id: float(t.start) for t in free_tasks}
+
+    ### Push to workers
+    def apply(self, new_starts: dict) -> dict:
+        """Update start times of queued tasks. Must be called from Maestro's
+        event loop thread, so no worker can pull a task mid-update.
+
+        If any rescheduled task left its queue while solving, its worker has
+        committed to the old start time, which the solution did not account for.
+        The solution is discarded in that case.
+
+        Returns:
+            dict: the new start times that were applied, or None if the solution was discarded
+        """
+        if not set(new_starts).issubset(self.queued_ids()):
+            return None
+        for worker in self.maestro.workers.values():
+            q = worker.queue._queue
+            updated = []
+            for start, task in q:
+                if task["id"] in new_starts:
+                    task["start"] = new_starts[task["id"]]
+                updated.append((task["start"], task))
+            updated.sort(key=lambda x: x[0])  # a sorted list is a valid heap
+            q[:] = updated
+        return new_starts
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import roboflo as rf
+
+MODULE_DIR = os.path.dirname(__file__)
+CACHE_DIR = os.path.join(MODULE_DIR, "schedulecache")
+
+
+class ScheduleCache:
+    """On-disk cache of solved schedules, keyed by a signature of the scheduling problem.
+
+    A protocol's signature covers everything the solver sees for each task:
+    duration, workers, immediacy, breakpoints, minimum start, and source +
+    destination for transitions (which captures tray and hotplate assignments).
+    The problem signature combines the worker capacities with the signature of
+    every protocol, by sample name.
+
+    On an exact hit, the cached start times are applied and no solve is needed.
+    On a near hit (most protocols unchanged, ie a few samples added or removed),
+    the unchanged protocols are fixed at their cached times, so the solver only
+    has to place the rest.
+
+    Signatures of every cached schedule are kept in one index file, so a near
+    hit is found without loading each cached schedule. Only the most recently
+    saved `max_entries` schedules are kept.
+    """
+
+    def __init__(
+        self, folder: str = CACHE_DIR, min_overlap: float = 0.5, max_entries: int = 50
+    ):
+        """
+        Args:
+            folder (str, optional): directory cached schedules are stored in. Defaults to frgpascal/schedulecache.
+            min_overlap (float, optional): fraction (0-1) of protocols that must match a cached schedule to warm start from it. Defaults to 0.5.
+            max_entries (int, optional): number of cached schedules kept, oldest are removed first. Defaults to 50.
+        """
+        self.folder = folder
+        self.MIN_OVERLAP = min_overlap
+        self.MAX_ENTRIES = max_entries
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    ### Signatures
+    @staticmethod
+    def _hash(obj) -> str:
+        return hashlib.sha1(
+            json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+        ).hexdigest()
+
+    @classmethod
+    def protocol_signature(cls, protocol: rf.Protocol) -> str:
+        tasks = []
+        for task in protocol.worklist:
+            t = [
+                task.name,
+                int(task.duration),
+                [w.name for w in task.workers],
+                bool(task.immediate),
+                bool(task.breakpoint),
+                int(task.min_start),
+            ]
+            if isinstance(task, rf.Transition):
+                t += [task.source.name, task.destination.name]
+            tasks.append(t)
+        return cls._hash(tasks)
+
+    def problem_signature(self, system: rf.System):
+        """
+        Returns:
+            tuple: (problem signature, {protocol name: protocol signature})
+        """
+        protocols = {
+            p.name: self.protocol_signature(p) for p in system.scheduler.protocols
+        }
+        workers = sorted([w.name, w.capacity] for w in system.workers)
+        return self._hash([workers, protocols]), protocols
+
+    ### Lookup
+    def _path(self, signature):
+        return os.path.join(self.folder, f"{signature}.json")
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.folder, "index.json")
+
+    def _load(self, path):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _dump(self, obj, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp, path)  # never leave a partially written file
+
+    def _load_index(self) -> dict:
+        """{signature: {"workers", "protocols": {name: protocol signature}, "saved"}}, rebuilt from the cached schedules if missing"""
+        try:
+            return self._load(self._index_path)
+        except (OSError, json.JSONDecodeError):
+            pass
+        index = {}
+        for fname in os.listdir(self.folder):
+            if not fname.endswith(".json") or fname == "index.json":
+                continue
+            path = os.path.join(self.folder, fname)
+            try:
+                entry = self._load(path)
+            except (OSError, json.JSONDecodeError):
+                continue  # partially written or corrupted, ignore
+            index[fname[: -len(".json")]] = {
+                "workers": entry["workers"],
+                "protocols": {
+                    name: p["signature"] for name, p in entry["protocols"].items()
+                },
+                "saved": os.path.getmtime(path),
+            }
+        return index
+
+    def _closest(self, workers_signature, protocols):
+        """cached entry sharing the most unchanged protocols with this problem"""
+        best = None
+        best_matches = []
+        for signature, summary in self._load_index().items():
+            if summary["workers"] != workers_signature:
+                continue
+            matches = [
+                name
+                for name, protocol_signature in protocols.items()
+                if summary["protocols"].get(name) == protocol_signature
+            ]
+            if len(matches) > len(best_matches):
+                best, best_matches = signature, matches
+        if best is None:
+            return None, []
+        try:
+            return self._load(self._path(best)), best_matches
+        except (OSError, json.JSONDecodeError):
+            return None, []
+
+    def apply(self, system: rf.System, allow_partial: bool = True) -> str:
+        """Apply cached start times to a system's protocols
+
+        Args:
+            system (rf.System): system with all protocols added to its scheduler, none solved yet
+            allow_partial (bool, optional): warm start from a similar cached schedule. Disable when the rest will not be solved in one go (ie rolling windows). Defaults to True.
+
+        Returns:
+            str: "hit" if every task was scheduled from the cache, "partial" if
+                unchanged protocols were fixed from a similar cached schedule (solve
+                to place the rest), or "miss"
+        """
+        signature, protocols = self.problem_signature(system)
+        by_name = {p.name: p for p in system.scheduler.protocols}
+        if os.path.exists(self._path(signature)):
+            entry = self._load(self._path(signature))
+            matches = list(protocols)
+            status = "hit"
+        elif not allow_partial:
+            return "miss"
+        else:
+            workers = sorted([w.name, w.capacity] for w in system.workers)
+            entry, matches = self._closest(workers, protocols)
+            if len(matches) < self.MIN_OVERLAP * len(protocols) or len(matches) == 0:
+                return "miss"
+            status = "partial"
+
+        for name in matches:
+            for task, (start, end) in zip(
+                by_name[name].worklist, entry["protocols"][name]["times"]
+            ):
+                task.start = start
+                task.end = end
+                task._solution_count += 1
+        scheduler = system.scheduler
+        scheduler._build_tasklist()
+        if status == "hit":
+            scheduler._num_tasks_on_last_solve = len(scheduler.tasklist)
+        else:
+            scheduler._num_tasks_on_last_solve = 0
+        return status
+
+    def save(self, system: rf.System):
+        """Store the solved schedule of a system
+
+        Args:
+            system (rf.System): system whose protocols have all been solved
+        """
+        signature, protocols = self.problem_signature(system)
+        entry = {
+            "workers": sorted([w.name, w.capacity] for w in system.workers),
+            "protocols": {},
+        }
+        for p in system.scheduler.protocols:
+            if any(np.isnan(task.start) for task in p.worklist):
+                return  # incomplete solution, do not cache
+            entry["protocols"][p.name] = {
+                "signature": protocols[p.name],
+                "times": [[int(task.start), int(task.end)] for task in p.worklist],
+            }
+        self._dump(entry, self._path(signature))
+
+        index = self._load_index()
+        index[signature] = {
+            "workers": entry["workers"],
+            "protocols": protocols,
+            "saved": time.time(),
+        }
+        for old in sorted(index, key=lambda s: index[s]["saved"])[
+            : -self.MAX_ENTRIES
+        ]:  # keep the cache bounded
+            index.pop(old)
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+        self._dump(index, self._index_path)
@@ -1,5 +1,6 @@
 import roboflo as rf
 import itertools as itt
+from functools import lru_cache
 from frgpascal.workers import (
     Worker_GantryGripper,
     Worker_Characterization,
@@ -7,6 +8,8 @@ from frgpascal.workers import (
     Worker_SpincoaterLiquidHandler,
     Worker_Storage,
 )
+from frgpascal.durationmodel import get_duration_model
+from frgpascal.hardware.helpers import lazy_module_attributes
 
 # define workers
 def generate_workers(maestro=None):
@@ -31,17 +34,52 @@ def generate_workers(maestro=None):
     return {w.name: w for w in [gg, sclh, hp1, hp2, hp3, st1, st2, cl]}
 
 
-ALL_WORKERS = generate_workers()
+@lru_cache(maxsize=None)
+def get_planning_workers() -> dict:
+    """Planning (no hardware) workers, built once on first use and shared by the
+    experimental design and closed loop modules.
+
+    Returns:
+        dict: {worker name: worker}
+    """
+    return generate_workers()
+
+
+def get_hotplate_names() -> list:
+    return [
+        name
+        for name, worker in get_planning_workers().items()
+        if isinstance(worker, Worker_Hotplate)
+    ]
+
+
+def get_storage_names() -> list:
+    return [
+        name
+        for name, worker in get_planning_workers().items()
+        if isinstance(worker, Worker_Storage)
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_task_worker_types() -> dict:
+    """Tasks available to the planning workers, with the worker *types* that perform them.
+    See `experimentaldesign.tasks.get_all_tasks` for the worker instances.
+
+    Returns:
+        dict: {task name: {"workers": [worker classes], "estimated_duration": seconds}}
+    """
+    all_tasks = {}
+    for worker in get_planning_workers().values():
+        for task, details in worker.functions.items():
+            if task not in all_tasks:
+                all_tasks[task] = {
+                    "workers": [type(worker)]
+                    + details.other_workers,  # list of workers required to perform task
+                    "estimated_duration": details.estimated_duration,  # time (s) to complete task
+                }
+    return all_tasks
 
-ALL_TASKS = {}
-for worker in ALL_WORKERS.values():
-    for task, details in worker.functions.items():
-        if task not in ALL_TASKS:
-            ALL_TASKS[task] = {
-                "workers": [type(worker)]
-                + details.other_workers,  # list of workers required to perform task
-                "estimated_duration": details.estimated_duration,  # time (s) to complete task
-            }
 
 # define transitions
 
@@ -68,36 +106,95 @@ TRANSITION_TASKS = {
     },
 }
 
-transitions = []
-for w1, w2 in itt.permutations(ALL_WORKERS.values(), 2):
-    t1, t2 = type(w1), type(w2)
-    if Worker_GantryGripper in [t1, t2]:
-        continue  # no transition tasks for this worker
-    if t1 == t2:
-        continue  # no transtion between same type (hotplate->hotplate, etc)
-    immediate = False
-    if Worker_Hotplate in (t1, t2):
-        immediate = True  # always get on/off the hotplate at exact time
-    if t1 == Worker_SpincoaterLiquidHandler:
-        immediate = True  # move off of spincoater ASAP
-
-    transition_name = TRANSITION_TASKS[t1][t2]
-    this_transition = rf.Transition(
-        duration=ALL_TASKS[transition_name]["estimated_duration"],
-        source=w1,
-        destination=w2,
-        workers=[ALL_WORKERS["GantryGripper"]],
-        immediate=immediate,
+
+def transition_duration(name, source, destination, slot=None) -> int:
+    """Duration (s) of a transition, learned from previous runs where available
+
+    Args:
+        name (str): transition task name, ie "storage_to_hotplate"
+        source (str): source worker name
+        destination (str): destination worker name
+        slot (str, optional): storage slot picked from/placed into. Defaults to None.
+
+    Returns:
+        int: duration, in seconds
+    """
+    return get_duration_model().estimate(
+        name,
+        source=source,
+        destination=destination,
+        slot=slot,
+        default=get_task_worker_types()[name]["estimated_duration"],
     )
-    this_transition.name = transition_name
-    transitions.append(this_transition)
+
+
+def apply_slot_durations(worklist: list, storage_slot: dict):
+    """Set durations of transitions to/from a sample's storage slot, where the
+    duration model has per-slot observations
+
+    Args:
+        worklist (list): roboflo Tasks of a protocol. Transitions are modified in place
+        storage_slot (dict): {"tray": tray name, "slot": slot name} of the sample
+    """
+    tray, slot = storage_slot.get("tray"), storage_slot.get("slot")
+    if slot is None:
+        return
+    for task in worklist:
+        if not isinstance(task, rf.Transition):
+            continue
+        if tray not in (task.source.name, task.destination.name):
+            continue
+        task.duration = transition_duration(
+            task.name, task.source.name, task.destination.name, slot=slot
+        )
+
+
+@lru_cache(maxsize=None)
+def get_transitions() -> list:
+    all_workers = get_planning_workers()
+    transitions = []
+    for w1, w2 in itt.permutations(all_workers.values(), 2):
+        t1, t2 = type(w1), type(w2)
+        if Worker_GantryGripper in [t1, t2]:
+            continue  # no transition tasks for this worker
+        if t1 == t2:
+            continue  # no transtion between same type (hotplate->hotplate, etc)
+        immediate = False
+        if Worker_Hotplate in (t1, t2):
+            immediate = True  # always get on/off the hotplate at exact time
+        if t1 == Worker_SpincoaterLiquidHandler:
+            immediate = True  # move off of spincoater ASAP
+
+        transition_name = TRANSITION_TASKS[t1][t2]
+        this_transition = rf.Transition(
+            duration=transition_duration(transition_name, w1.name, w2.name),
+            source=w1,
+            destination=w2,
+            workers=[all_workers["GantryGripper"]],
+            immediate=immediate,
+        )
+        this_transition.name = transition_name
+        transitions.append(this_transition)
+    return transitions
+
+
+# workers, tasks and transitions are built on first access rather than at import
+__getattr__ = lazy_module_attributes(
+    __name__,
+    {
+        "ALL_WORKERS": get_planning_workers,
+        "ALL_TASKS": get_task_worker_types,
+        "transitions": get_transitions,
+    },
+)
 
 
 # default system
 def build():
+    all_workers = get_planning_workers()
     return rf.System(
-        workers=list(ALL_WORKERS.values()),
-        transitions=transitions,
-        starting_worker=ALL_WORKERS["Tray1"],
-        ending_worker=ALL_WORKERS["Tray1"],
+        workers=list(all_workers.values()),
+        transitions=get_transitions(),
+        starting_worker=all_workers["Tray1"],
+        ending_worker=all_workers["Tray1"],
     )
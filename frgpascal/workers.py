@@ -1,13 +1,16 @@
 import asyncio
 import logging
 from collections import namedtuple
+from functools import partial
 from roboflo import Worker as Worker_roboflo
 import json
+import os
 import time
+import numpy as np
 
 from frgpascal.hardware.liquidhandler import expected_timings
 
-task_tuple = namedtuple("task", ["function", "estimated_duration", "other_workers"])
+task_tuple = namedtuple("task_tuple", ["function", "estimated_duration", "other_workers"])
 
 
 class WorkerTemplate(Worker_roboflo):
@@ -89,14 +92,14 @@ class WorkerTemplate(Worker_roboflo):
             _, task = await self.queue.get()  # blocking wait for next task
             task_description = f'{task["name"]}, {task["sample"]}'
             sample = self.maestro.samples[task["sample"]]
-            sample_task = [t for t in sample["worklist"] if t["id"] == task["id"]][0]
+            sample_task = self.maestro.task_index[task["id"]]
             # print(f"starting {task_description}")
             if task is None:  # finished flag
                 break
             # wait for all previous tasks to complete
 
             with self.maestro.lock_pendingtasks:
-                self.maestro.pending_tasks.append(task["id"])
+                self.maestro.pending_tasks.add(task["id"])
 
             if task["precedent"] is not None:
                 first = True
@@ -130,6 +133,18 @@ class WorkerTemplate(Worker_roboflo):
             # )
 
             sample_task["start_actual"] = self.maestro.experiment_time
+            # journal fsyncs run off the event loop so other workers are not stalled, and
+            # in the default executor so they never queue behind hardware tasks
+            await self.loop.run_in_executor(
+                None,
+                partial(
+                    self.maestro.journal.write,
+                    "start",
+                    id=task["id"],
+                    sample=task["sample"],
+                    start_actual=sample_task["start_actual"],
+                ),
+            )
             function = self.functions[task["name"]].function
             details = sample_task.get("details", {})
             if asyncio.iscoroutinefunction(function):
@@ -153,12 +168,23 @@ class WorkerTemplate(Worker_roboflo):
             # update task lists
             output_dict["finish_actual"] = self.maestro.experiment_time
             sample_task.update(output_dict)
+            await self.loop.run_in_executor(
+                None,
+                partial(
+                    self.maestro.journal.write,
+                    "finish",
+                    id=task["id"],
+                    sample=task["sample"],
+                    output=output_dict,
+                    hotplate_slot=sample.get("hotplate_slot"),
+                ),
+            )
 
             self.logger.info(f"finished {task_description}")
             with self.maestro.lock_completedtasks:
                 self.maestro.completed_tasks[task["id"]] = self.maestro.experiment_time
             with self.maestro.lock_pendingtasks:
-                self.maestro.pending_tasks.remove(task["id"])
+                self.maestro.pending_tasks.discard(task["id"])
             self.queue.task_done()
 
     def __hash__(self):
@@ -431,7 +457,15 @@ class Worker_Hotplate(WorkerTemplate):
         }
 
     async def anneal(self, sample, details):
+        t_start = self.maestro.nist_time
         await asyncio.sleep(details["duration"])
+        hotplate = self.maestro.hotplates[sample["hotplate_slot"]["hotplate"]]
+        if hotplate.telemetry is None:
+            return
+        trace = hotplate.telemetry.trace(t_start, self.maestro.nist_time)
+        trace[:, 0] -= self.maestro.t0  # nist time -> experiment time
+        # rows of [experiment time (s), temperature (C), setpoint (C)]
+        return {"temperature_trace": np.round(trace, 2).tolist()}
 
 
 class Worker_Storage(WorkerTemplate):
@@ -488,55 +522,34 @@ class Worker_SpincoaterLiquidHandler(WorkerTemplate):
         return completed_tasks
 
     async def _set_spinspeeds(self, steps, t0, headstart):
-        await asyncio.sleep(headstart)
-        tnext = headstart
-        for step in steps:
-            self.spincoater.set_rpm(rpm=step["rpm"], acceleration=step["acceleration"])
-            tnext += step["duration"]
-            while self.maestro.nist_time - t0 < tnext:
-                await asyncio.sleep(0.1)
-            print(f"\t\t{t0-self.maestro.nist_time:.2f} finished step")
+        profile = self.spincoater.run_profile(
+            steps, start_time=t0 + headstart, clock=lambda: self.maestro.nist_time
+        )
+        transitions = await asyncio.wrap_future(profile)
         self.spincoater.stop()
         print(f"\t{t0-self.maestro.nist_time:.2f} finished all spinspeed steps")
+        for transition in transitions:  # nist time -> seconds relative to t0
+            for key in ["scheduled", "actual", "sent"]:
+                transition[key] -= t0
+        return transitions
 
-    def _expected_aspiration_duration(self, drop) -> float:
+    def _expected_aspiration_duration(self, drop, pipette="perovskite") -> float:
         """Estimate the duration (seconds) liquid aspiration will require for a given drop
 
         Args:
             drop (dict): dictionary of drop parameters
+            pipette (str, optional): "perovskite" or "antisolvent". Defaults to "perovskite".
 
         Returns:
             float: duration, in seconds
         """
-        ac = self.liquidhandler.CONSTANTS["aspirate"]  # aspiration constants
-        d = (
-            ac["preparetip"]
-            + drop["volume"] / 100
-            + self.liquidhandler.CONSTANTS["travel"]
-        )
-        d += drop["pre_mix"][0] * (
-            ac["premix"]["a"] * drop["pre_mix"][1] + ac["premix"]["b"]
-        )  # overhead time for aspirate+dispense cycles to mix solution prior to final aspiration
-        if drop["touch_tip"]:
-            d += ac["touchtip"]
-        if drop["slow_retract"]:
-            d += ac["slowretract"]
-        if drop["air_gap"]:
-            d += ac["airgap"]
-
-        return d
-
-    def _expected_staging_duration(self, drop) -> float:
-        if drop["slow_travel"]:
-            return self.liquidhandler.CONSTANTS["travel_slow"]
-        else:
-            return self.liquidhandler.CONSTANTS["travel"]
+        return expected_timings(drop, pipette=pipette)[0]
 
-    def _expected_dispense_duration(self, drop) -> float:
-        if drop["slow_travel"]:
-            return self.liquidhandler.CONSTANTS["dispensedelay_slow"]
-        else:
-            return self.liquidhandler.CONSTANTS["dispensedelay"]
+    def _expected_staging_duration(self, drop, pipette="perovskite") -> float:
+        return expected_timings(drop, pipette=pipette)[1]
+
+    def _expected_dispense_duration(self, drop, pipette="perovskite") -> float:
+        return expected_timings(drop, pipette=pipette)[2]
 
     def _generatelhtasks_onedrop(self, t0, drop):
         liquidhandlertasks = {}
@@ -593,7 +606,7 @@ class Worker_SpincoaterLiquidHandler(WorkerTemplate):
             drop0
         )
         aspirate1_duration, staging1_duration, dispense1_duration = expected_timings(
-            drop1
+            drop1, pipette="antisolvent"
         )
         if (drop1["time"] - drop0["time"]) < (
             aspirate1_duration + staging1_duration + dispense1_duration
@@ -654,7 +667,7 @@ class Worker_SpincoaterLiquidHandler(WorkerTemplate):
                 aspirate1_duration,
                 staging1_duration,
                 dispense1_duration,
-            ) = expected_timings(drop1)
+            ) = expected_timings(drop1, pipette="antisolvent")
 
         headstart = (
             aspirate0_duration
@@ -842,10 +855,12 @@ class Worker_SpincoaterLiquidHandler(WorkerTemplate):
         Returns:
             record: dictionary of recorded spincoating process.
         """
+        from frgpascal.hardware.spincoater import rpm_tracking_error
+
         self.liquidhandler.server._start_directly()  # connect to liquid handler websocket
 
         t0 = self.maestro.nist_time
-        self.spincoater.start_logging()
+        self.spincoater.start_logging(t0=t0, clock=lambda: self.maestro.nist_time)
         ### set up liquid handler tasks
         if len(details["drops"]) == 1:
             headstart, liquidhandlertasks = self._generatelhtasks_onedrop(
@@ -873,15 +888,48 @@ class Worker_SpincoaterLiquidHandler(WorkerTemplate):
 
         tasks_future.add_done_callback(future_callback)
 
-        drop_times, _ = loop.run_until_complete(tasks_future)
+        drop_times, spinspeed_timings = loop.run_until_complete(tasks_future)
         print(f"{t0-self.maestro.nist_time:.2f} finished all tasks")
         rpm_log = self.spincoater.finish_logging()
         print(f"{t0-self.maestro.nist_time:.2f} finished logging")
         self.liquidhandler.server.stop()  # disconnect from liquid handler websocket
         print(f"{t0-self.maestro.nist_time:.2f} server stopped")
+
+        # requested vs completed times of the liquid handler tasks, learned from to tighten future headstarts
+        requested = {
+            task: self.liquidhandler.server.requested_times[taskid] - t0
+            for task, taskid in liquidhandlertasks.items()
+        }
+        if len(details["drops"]) == 1:
+            dispense_tasks = ["dispense_solution"]
+        else:
+            dispense_tasks = ["dispense_solution0", "dispense_solution1"]
+        drop_timing_errors = [
+            drop_times[task] - (headstart + drop["time"])
+            for task, drop in zip(dispense_tasks, details["drops"])
+        ]  # seconds the drop landed after its target
+
+        # full rpm trace goes to a compressed sidecar file, only the summary goes in the sample log
+        previous_spincoats = [
+            t
+            for t in sample["worklist"]
+            if t["name"] == "spincoat" and "finish_actual" in t
+        ]
+        logpath = self.spincoater.save_log(
+            name=f"{sample['name']}_spincoat{len(previous_spincoats)}",
+            log=rpm_log,
+            transitions=spinspeed_timings,
+        )
         return {
             "liquidhandler_timings": {**drop_times},
-            "spincoater_log": {**rpm_log},
+            "liquidhandler_requested": requested,
+            "drop_timing_errors": drop_timing_errors,
+            "spincoater_log": os.path.relpath(logpath, self.maestro.experiment_folder),
+            "rpm_tracking": rpm_tracking_error(rpm_log, spinspeed_timings),
+            "spinspeed_timings": spinspeed_timings,
+            "spinspeed_timing_error": max(
+                abs(transition["error"]) for transition in spinspeed_timings
+            ),
             "headstart": headstart,
         }
 